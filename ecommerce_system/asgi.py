@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_system.settings')
 
 application = get_asgi_application()
+
+# Background expiry sweeps run in serving processes only
+from product_management.expiry import start_configured_sweeper  # noqa: E402
+
+start_configured_sweeper()
@@ -10,7 +10,9 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
+import os
 from pathlib import Path
+from .database import database_settings
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,11 +43,14 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'rest_framework',
+    'django_filters',
     'product_management',
     'drf_yasg',
 ]
 
 MIDDLEWARE = [
+    'product_management.metrics.MetricsMiddleware',
+    'product_management.compression.CompressionMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,14 +84,36 @@ WSGI_APPLICATION = 'ecommerce_system.wsgi.application'
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
+# SQLite tuned for concurrency by default, PostgreSQL with `DATABASE_URL`,
+# see `ecommerce_system/database.py`
 
 DATABASES = {
+    'default': database_settings(BASE_DIR),
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# Local memory by default, any Django cache backend (e.g. Redis) can be plugged
+# in through the environment
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'ecommerce-catalog'),
     }
 }
 
+# Cache alias and timeout (in seconds) of cached product API responses
+CATALOG_CACHE_ALIAS = 'default'
+CATALOG_CACHE_TIMEOUT = int(os.environ.get('CATALOG_CACHE_TIMEOUT', 300))
+
+# In-process LRU cache of hot product detail payloads in front of the shared
+# cache: entries per process (0 disables it) and seconds they live, which
+# bounds how long another process's writes can go unseen
+PRODUCT_LOCAL_CACHE_SIZE = int(os.environ.get('PRODUCT_LOCAL_CACHE_SIZE', 1000))
+PRODUCT_LOCAL_CACHE_TTL = float(os.environ.get('PRODUCT_LOCAL_CACHE_TTL', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -132,4 +159,54 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
   'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
   'PAGE_SIZE': 10,
+  # orjson when installed, DRF's encoder otherwise
+  'DEFAULT_RENDERER_CLASSES': [
+    'product_management.renderers.FastJSONRenderer',
+    'rest_framework.renderers.BrowsableAPIRenderer',
+  ],
 }
+
+# Responses under these paths are compressed with zstd, brotli or gzip, as
+# negotiated with Accept-Encoding, once their body reaches the minimum size
+RESPONSE_COMPRESSION_PATHS = ['/api/products/', '/api/categories/', '/api/async/']
+RESPONSE_COMPRESSION_MIN_SIZE = int(os.environ.get('RESPONSE_COMPRESSION_MIN_SIZE', 1024))
+
+# Bulk product writes: rows written per INSERT/UPDATE statement and the
+# maximum number of rows accepted in one request
+PRODUCT_BULK_BATCH_SIZE = 500
+PRODUCT_BULK_MAX_ROWS = 10000
+
+# Rows fetched from the database per round trip by the streaming catalog export
+PRODUCT_EXPORT_CHUNK_SIZE = 2000
+
+# Lower bounds of the effective price buckets counted by `?facets=true`
+PRODUCT_PRICE_BUCKETS = [0, 25, 50, 100, 250, 500, 1000]
+
+# Product search index: 'fts5' (SQLite FTS5), 'tokens' (portable inverted
+# index) or 'auto' for FTS5 on SQLite builds that have it and tokens elsewhere
+PRODUCT_SEARCH_BACKEND = os.environ.get('PRODUCT_SEARCH_BACKEND', 'auto')
+
+# Seconds between in-process sweeps deactivating expired discounts, 0 disables
+# the sweeper (run `manage.py expire_discounts` from a scheduler instead). It
+# only runs in processes serving through `wsgi.py`/`asgi.py`, runserver included
+DISCOUNT_EXPIRY_SWEEP_INTERVAL = int(os.environ.get('DISCOUNT_EXPIRY_SWEEP_INTERVAL', 0))
+
+# Seconds stock reservations are held when the request doesn't ask for a TTL,
+# and the longest TTL a request may ask for
+RESERVATION_TTL = int(os.environ.get('RESERVATION_TTL', 15 * 60))
+RESERVATION_MAX_TTL = 24 * 60 * 60
+
+# Share of requests (0 to 1) whose latency, query count, database time and
+# serialization time are recorded for `/metrics`; 0 makes the metrics
+# middleware a pass-through
+METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+
+# Seconds an `Idempotency-Key` and the response stored for it are kept
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# Change feed: entries per `/api/changes/` response by default and at most,
+# the longest `wait` of a long poll and how often it checks for new entries
+CHANGE_FEED_PAGE_SIZE = 500
+CHANGE_FEED_MAX_PAGE_SIZE = 5000
+CHANGE_FEED_MAX_WAIT = 30
+CHANGE_FEED_POLL_INTERVAL = float(os.environ.get('CHANGE_FEED_POLL_INTERVAL', 0.5))
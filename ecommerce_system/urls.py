@@ -19,6 +19,7 @@ from django.urls import path, include
 from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
+from product_management.metrics import metrics_view
 
 schema_view = get_schema_view(
     openapi.Info(
@@ -36,4 +37,5 @@ urlpatterns = [
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='swagger-schema'),
     path('admin/', admin.site.urls),
     path('api/', include('product_management.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ecommerce_system.settings')
 
 application = get_wsgi_application()
+
+# Background expiry sweeps run in serving processes only
+from product_management.expiry import start_configured_sweeper  # noqa: E402
+
+start_configured_sweeper()
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ProductManagementConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'product_management'
+
+    def ready(self):
+        from . import metrics, signals  # noqa: F401
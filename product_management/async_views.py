@@ -0,0 +1,168 @@
+"""Async, ASGI-native read endpoints for products and categories
+
+These mirror the responses of `ProductView` (with `pagination=page`),
+`ProductDetailView` and the category list, but run on the event loop with
+Django's async ORM instead of tying up a thread per request. Queries that
+don't depend on each other are issued together with `asyncio.gather`.
+
+The change feed is async for the same reason: its long polls spend most of
+their time waiting.
+"""
+
+import asyncio
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.views import View
+from rest_framework.exceptions import ValidationError
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+from .changes import changes_since, represent
+from .filters import ProductFilter
+from .models import Category, Discount, DiscountStatus, Product, category_children
+from .renderers import dumps
+from .pagination import ProductPageNumberPagination, get_product_ordering
+from .serializers import CategorySerializer, ProductSerializer
+from .views import parse_depth
+
+
+def json_response(data, status=200):
+  # Same JSON as the sync views' renderer
+  return HttpResponse(dumps(data), status=status, content_type='application/json')
+
+
+async def fetch(queryset):
+  return [instance async for instance in queryset]
+
+
+def attach_discounts(products, discounts):
+  """Set `active_discounts` as `with_active_discounts()` would"""
+  by_product = {}
+  for discount in discounts:
+    by_product.setdefault(discount.product_id, []).append(discount)
+  for product in products:
+    product.active_discounts = by_product.get(product.id, [])
+
+
+def filter_products(params, products):
+  filterset = ProductFilter(params, queryset=products)
+  if not filterset.is_valid():
+    raise ValidationError(filterset.errors)
+  return filterset.qs
+
+
+class AsyncProductView(View):
+  page_size = ProductPageNumberPagination.page_size
+  max_page_size = ProductPageNumberPagination.max_page_size
+
+  async def get(self, request):
+    try:
+      ordering = get_product_ordering(request)
+      # Resolving `include_descendants` looks up the category synchronously
+      products = await sync_to_async(filter_products)(request.GET, Product.objects.all())
+      page, page_size = self.get_page(request)
+    except ValidationError as error:
+      return json_response(error.detail, status=400)
+
+    products = products.order_by(*ordering)
+    rows = products[(page - 1) * page_size:page * page_size]
+    # The count, the page and the page's discounts are independent queries
+    count, results, discounts = await asyncio.gather(
+      products.acount(),
+      fetch(rows),
+      fetch(
+        Discount.objects.filter(status=DiscountStatus.ACTIVE, product_id__in=rows.values('id'))
+        .order_by('product_id', 'id')
+      ),
+    )
+    if not results and page > 1:
+      return json_response({'detail': 'Invalid page.'}, status=404)
+    attach_discounts(results, discounts)
+
+    url = request.build_absolute_uri()
+    return json_response({
+      'count': count,
+      'next': replace_query_param(url, 'page', page + 1) if page * page_size < count else None,
+      'previous': (
+        None if page == 1
+        else remove_query_param(url, 'page') if page == 2
+        else replace_query_param(url, 'page', page - 1)
+      ),
+      'results': ProductSerializer(results, many=True).data,
+    })
+
+  def get_page(self, request):
+    try:
+      page = int(request.GET.get('page', 1))
+      page_size = int(request.GET.get('page_size', self.page_size))
+    except ValueError:
+      raise ValidationError({'page': 'page and page_size must be positive integers.'})
+    if page < 1 or page_size < 1:
+      raise ValidationError({'page': 'page and page_size must be positive integers.'})
+    return page, min(page_size, self.max_page_size)
+
+
+class AsyncProductDetailView(View):
+  async def get(self, request, pk):
+    # Fetch the product and its discounts concurrently
+    try:
+      product, discounts = await asyncio.gather(
+        Product.objects.aget(id=pk),
+        fetch(Discount.objects.filter(product_id=pk, status=DiscountStatus.ACTIVE).order_by('id')),
+      )
+    except Product.DoesNotExist:
+      return json_response({'error': f'Product with id - {pk} not found'}, status=404)
+    product.active_discounts = discounts
+    return json_response(ProductSerializer(product).data)
+
+
+class AsyncCategoryListView(View):
+  async def get(self, request):
+    try:
+      depth = parse_depth(request.GET)
+    except ValidationError as error:
+      return json_response(error.detail, status=400)
+
+    categories = await fetch(Category.objects.select_related('rollup'))
+    children = category_children(categories)
+    if request.GET.get('tree') in ('true', '1'):
+      categories = children.get(None, [])
+    context = {'request': request, 'depth': depth, 'children': children}
+    return json_response(CategorySerializer(categories, many=True, context=context).data)
+
+
+class ChangeFeedView(View):
+  """ Catalog changes after `since`, waiting up to `wait` seconds for one """
+
+  async def get(self, request):
+    try:
+      since, limit, wait = self.get_params(request)
+    except ValidationError as error:
+      return json_response(error.detail, status=400)
+
+    deadline = time.monotonic() + wait
+    while True:
+      # One extra row tells whether more changes are waiting
+      entries = await fetch(changes_since(since, limit + 1))
+      remaining = deadline - time.monotonic()
+      if entries or remaining <= 0:
+        break
+      await asyncio.sleep(min(settings.CHANGE_FEED_POLL_INTERVAL, remaining))
+
+    entries, has_more = entries[:limit], len(entries) > limit
+    return json_response({
+      'changes': [represent(entry) for entry in entries],
+      'next': entries[-1].id if entries else since,
+      'has_more': has_more,
+    })
+
+  def get_params(self, request):
+    try:
+      since = int(request.GET.get('since', 0))
+      limit = int(request.GET.get('limit', settings.CHANGE_FEED_PAGE_SIZE))
+      wait = float(request.GET.get('wait', 0))
+    except ValueError:
+      raise ValidationError({'since': 'since and limit must be integers and wait a number of seconds.'})
+    if since < 0 or limit < 1 or not 0 <= wait < float('inf'):
+      raise ValidationError({'since': 'since, limit and wait must not be negative.'})
+    return since, min(limit, settings.CHANGE_FEED_MAX_PAGE_SIZE), min(wait, settings.CHANGE_FEED_MAX_WAIT)
@@ -0,0 +1,179 @@
+"""Helpers to seed synthetic catalogs and time API requests for benchmarks"""
+
+import random
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from . import rollups, search
+from .models import Category, Discount, DiscountStatus, DiscountType, Product
+from .pricing import reprice_products
+
+
+@contextmanager
+def benchmark_database(verbosity=0, test_name=None):
+  """Run against a throwaway test database so benchmarks never touch real data
+
+  `test_name` overrides the test database name, e.g. to use an SQLite file
+  that several threads can write to instead of a shared in-memory database.
+  """
+  if test_name is not None:
+    connection.settings_dict['TEST']['NAME'] = test_name
+  setup_test_environment()
+  old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True, serialize=False)
+  try:
+    yield
+  finally:
+    connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+    teardown_test_environment()
+
+
+def seed_category_tree(depth, fanout):
+  """Create a complete tree `depth` levels deep below one root, with `fanout`
+  children per node; returns the root id and the leaf ids"""
+  root = Category.objects.create(title='Benchmark category 0')
+  level = [('0', root)]
+  for _ in range(depth):
+    level = [
+      (f'{label}.{i}', Category.objects.create(title=f'Benchmark category {label}.{i}', parent=parent))
+      for label, parent in level
+      for i in range(fanout)
+    ]
+  return root.id, [category.id for _, category in level]
+
+
+def seed_products(count, categories=10, seed=0, batch_size=1000, category_ids=None):
+  """Bulk insert `count` products spread over `categories` flat categories,
+  or over the existing `category_ids`"""
+  rng = random.Random(seed)
+  if category_ids is None:
+    category_ids = [
+      Category.objects.create(title=f'Benchmark category {i}').id
+      for i in range(categories)
+    ]
+  for start in range(0, count, batch_size):
+    Product.objects.bulk_create([
+      Product(
+        name=f'Benchmark product {i}',
+        description='Synthetic benchmark product',
+        price=Decimal(rng.randint(100, 100000)) / 100,
+        quantity=rng.randint(0, 100),
+        category_id=rng.choice(category_ids),
+      )
+      for i in range(start, min(start + batch_size, count))
+    ])
+
+
+def seed_discounts(per_product=3, seed=0, batch_size=1000):
+  """Bulk insert up to `per_product` random active discounts on every product,
+  repricing the products as the discount write paths do"""
+  rng = random.Random(seed)
+  discounts = []
+
+  def flush():
+    Discount.objects.bulk_create(discounts)
+    reprice_products({discount.product_id for discount in discounts})
+    discounts.clear()
+
+  for product_id in list(Product.objects.order_by('id').values_list('id', flat=True)):
+    for _ in range(rng.randint(0, per_product)):
+      discount_type = rng.choice(DiscountType.values)
+      high = 5000 if discount_type == DiscountType.PERCENTAGE else 10000
+      discounts.append(Discount(product_id=product_id, discount_type=discount_type, value=Decimal(rng.randint(1, high)) / 100))
+    if len(discounts) >= batch_size:
+      flush()
+  flush()
+
+
+def seed_catalog(products, depth=3, fanout=4, discounts_per_product=3, seed=0):
+  """Seed a category tree, products in its leaves and their discounts
+
+  Returns the ids `ENDPOINTS` and `WRITE_ENDPOINTS` are formatted with.
+  """
+  root_id, leaf_ids = seed_category_tree(depth, fanout)
+  seed_products(products, seed=seed, category_ids=leaf_ids)
+  seed_discounts(per_product=discounts_per_product, seed=seed)
+  search.rebuild_index()
+  # The categories and products were inserted in bulk, bypassing the counters
+  rollups.rebuild()
+  return {
+    'root': root_id,
+    'leaf': leaf_ids[0],
+    'product': Product.objects.order_by('id').values_list('id', flat=True).first(),
+    'stocked': Product.objects.filter(quantity__gte=10).order_by('id').values_list('id', flat=True).first(),
+    'discount': Discount.objects.order_by('id').values_list('id', flat=True).first(),
+  }
+
+
+# Read endpoints measured by `bench_api` and whose query counts are pinned by
+# `tests/test_query_counts.py`, formatted with the ids from `seed_catalog`
+ENDPOINTS = {
+  'category_list': '/api/categories/',
+  'category_tree': '/api/categories/?tree=true',
+  'category_detail': '/api/categories/{root}/',
+  'product_list': '/api/products/',
+  'product_list_page': '/api/products/?pagination=page&page=2',
+  'product_list_filtered': '/api/products/?category={root}&include_descendants=true&max_price=500&facets=true',
+  'product_detail': '/api/products/{product}',
+  'product_search': '/api/products/search/?q=benchmark+prod',
+  'product_export': '/api/products/export/?category={leaf}',
+  'async_product_list': '/api/async/products/',
+  'async_product_detail': '/api/async/products/{product}',
+  'async_category_list': '/api/async/categories/',
+  'change_feed': '/api/changes/',
+}
+
+# Write endpoints whose query counts are pinned by `tests/test_query_counts.py`:
+# `(method, url, body)`, the body built from the ids from `seed_catalog`. Each
+# can be sent repeatedly against the same catalog.
+WRITE_ENDPOINTS = {
+  'product_create': ('post', '/api/products/', lambda ids: {
+    'name': 'Benchmark product', 'price': '10.00', 'quantity': 5, 'category': ids['leaf'],
+  }),
+  'product_bulk_create': ('post', '/api/products/bulk/', lambda ids: [
+    {'name': f'Benchmark product {i}', 'price': '10.00', 'quantity': 5, 'category': ids['leaf']} for i in range(10)
+  ]),
+  'product_bulk_update': ('patch', '/api/products/bulk/', lambda ids: [
+    {'id': ids['product'], 'name': 'Benchmark product'}, {'id': ids['stocked'], 'quantity': 50},
+  ]),
+  'discount_create': ('post', '/api/discounts/', lambda ids: {
+    'product': ids['product'], 'discount_type': DiscountType.PERCENTAGE, 'value': '10.00',
+    'status': DiscountStatus.ACTIVE, 'expires_at': '2100-01-01T00:00:00Z',
+  }),
+  'discount_apply': ('post', '/api/products/{product}/{discount}/', lambda ids: None),
+  'discount_campaign': ('post', '/api/discounts/{discount}/apply/', lambda ids: {
+    'category': ids['root'], 'include_descendants': True,
+  }),
+  'reservation_create': ('post', '/api/reservations/', lambda ids: {
+    'items': [{'product': ids['stocked'], 'quantity': 1}],
+  }),
+}
+
+
+@contextmanager
+def count_queries():
+  """Collect the SQL run in the block, without relying on a debug cursor"""
+  queries = []
+
+  def collect(execute, sql, params, many, context):
+    queries.append(sql)
+    return execute(sql, params, many, context)
+
+  with connection.execute_wrapper(collect):
+    yield queries
+
+
+def timed_get(client, url):
+  """Issue a GET through the test client and return (response, elapsed ms)"""
+  start = time.perf_counter()
+  response = client.get(url)
+  return response, (time.perf_counter() - start) * 1000
+
+
+def percentile(samples, fraction):
+  ordered = sorted(samples)
+  if not ordered:
+    return None
+  index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+  return ordered[index]
@@ -0,0 +1,86 @@
+"""Versioned read-through cache for product API responses
+
+Cached payloads are never deleted on writes. Instead every key embeds a
+version number: one per product for detail responses and one for the whole
+catalog for list responses. Writes bump the relevant versions, which makes the
+old entries unreachable, and they age out of the cache on their own.
+"""
+
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from . import local_cache
+
+CATALOG_VERSION_KEY = 'catalog:version'
+PRODUCT_VERSION_KEY = 'catalog:product:{pk}:version'
+
+
+def get_cache():
+  return caches[getattr(settings, 'CATALOG_CACHE_ALIAS', 'default')]
+
+
+def get_timeout():
+  return getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+
+
+def get_version(key):
+  """Read a version counter, seeding it with the current time when missing
+
+  Seeding from the clock rather than from 1 means a counter lost to eviction
+  never restarts at a value an older cached payload was stored under.
+  """
+  cache = get_cache()
+  version = cache.get(key)
+  if version is None:
+    cache.add(key, time.time_ns(), timeout=None)
+    version = cache.get(key)
+  return version
+
+
+def bump_version(key):
+  cache = get_cache()
+  try:
+    cache.incr(key)
+  except ValueError:
+    cache.set(key, time.time_ns(), timeout=None)
+
+
+def product_list_key(request):
+  """Cache key for a product listing, from its normalized query params"""
+  params = sorted((name, value) for name in request.query_params for value in request.query_params.getlist(name))
+  raw = repr((request.get_host(), request.path, params))
+  digest = hashlib.sha1(raw.encode()).hexdigest()
+  return f'catalog:products:list:{get_version(CATALOG_VERSION_KEY)}:{digest}'
+
+
+def product_version(pk):
+  return get_version(PRODUCT_VERSION_KEY.format(pk=pk))
+
+
+def product_detail_key(pk, fields=(), version=None):
+  """Cache key for a product detail response, per sparse fieldset"""
+  version = product_version(pk) if version is None else version
+  key = f'catalog:products:detail:{pk}:{version}'
+  return f'{key}:{",".join(fields)}' if fields else key
+
+
+def _bump(keys):
+  # Bump right away so the writing request's own reads miss, and again on
+  # commit so a concurrent reader can't pin data it read before the commit
+  for key in keys:
+    bump_version(key)
+  transaction.on_commit(lambda: [bump_version(key) for key in keys])
+
+
+def invalidate_catalog():
+  """Invalidate every cached product listing"""
+  _bump([CATALOG_VERSION_KEY])
+
+
+def invalidate_products(product_ids):
+  """Invalidate the detail responses of `product_ids` and every listing"""
+  product_ids = {pk for pk in product_ids if pk is not None}
+  _bump([CATALOG_VERSION_KEY] + [PRODUCT_VERSION_KEY.format(pk=pk) for pk in product_ids])
+  local_cache.evict_products(product_ids)
@@ -0,0 +1,95 @@
+"""Apply a discount to many products at once with set-based writes
+
+A discount belongs to a single product, so applying one to a selection of
+products gives each of them a copy linked back through `Discount.template`.
+Copies that were unapplied are switched back on with one UPDATE, products
+without one get theirs with batched INSERTs, and unapplying is one UPDATE
+over the active copies. Products that already have the discount in the
+wanted state are left alone, so repeating a request changes nothing.
+
+These writes bypass the model signals: `products_bulk_changed` reprices and
+evicts from the cache only the products whose discounts changed.
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Discount, DiscountStatus, Product
+from .signals import products_bulk_changed
+
+
+class CampaignError(Exception):
+  pass
+
+
+def campaign_template(discount):
+  """The discount campaigns run from: `discount`, or the one it is a copy of
+
+  Copying a copy would link the new copies to it, out of reach of the
+  template's unapply.
+  """
+  return discount.template if discount.template_id is not None else discount
+
+
+def campaign_discounts(discount):
+  """`discount` and all of its copies"""
+  return Discount.objects.filter(Q(id=discount.id) | Q(template_id=discount.id))
+
+
+def apply(discount, products, batch_size=None) -> list:
+  """Activate `discount` on every product of the `products` queryset,
+  returning the ids of the products it was newly applied to"""
+  discount = campaign_template(discount)
+  batch_size = batch_size or settings.PRODUCT_BULK_BATCH_SIZE
+  now = timezone.now()
+  if discount.expires_at is not None and discount.expires_at <= now:
+    raise CampaignError(f'Discount {discount.id} has expired.')
+
+  with transaction.atomic():
+    discounts = campaign_discounts(discount).filter(product__in=products)
+    applied = discounts.filter(status=DiscountStatus.ACTIVE).values('product_id')
+    # One inactive copy per product is enough to switch back on
+    inactive = dict(
+      discounts.filter(status=DiscountStatus.INACTIVE).exclude(product_id__in=applied)
+      .values_list('product_id', 'id')
+    )
+    if inactive:
+      Discount.objects.filter(id__in=list(inactive.values())).update(status=DiscountStatus.ACTIVE, updated_at=now)
+
+    missing = list(products.exclude(id__in=discounts.values('product_id')).order_by('id').values_list('id', flat=True))
+    copies = Discount.objects.bulk_create([
+      Discount(
+        product_id=product_id, template=discount, discount_type=discount.discount_type,
+        value=discount.value, expires_at=discount.expires_at, status=DiscountStatus.ACTIVE,
+      )
+      for product_id in missing
+    ], batch_size=batch_size)
+
+    changed = sorted([*inactive, *missing])
+    if changed:
+      products_bulk_changed.send(
+        sender=Product, product_ids=changed, action='discounts',
+        discount_ids=list(inactive.values()), created_discount_ids=[copy.pk for copy in copies],
+      )
+  return changed
+
+
+def unapply(discount, products) -> list:
+  """Deactivate `discount` and its copies on the `products` queryset,
+  returning the ids of the products it was removed from"""
+  discount = campaign_template(discount)
+  now = timezone.now()
+  with transaction.atomic():
+    active = list(
+      campaign_discounts(discount).filter(product__in=products, status=DiscountStatus.ACTIVE)
+      .values_list('id', 'product_id')
+    )
+    if not active:
+      return []
+    Discount.objects.filter(id__in=[pk for pk, _ in active]).update(status=DiscountStatus.INACTIVE, updated_at=now)
+    changed = sorted({product_id for _, product_id in active})
+    products_bulk_changed.send(
+      sender=Product, product_ids=changed, action='discounts', discount_ids=[pk for pk, _ in active]
+    )
+  return changed
@@ -0,0 +1,64 @@
+"""Append-only change feed of catalog mutations (a transactional outbox)
+
+Every create, update and delete of a category, product or discount adds a
+`ChangeLogEntry` in the transaction making the change, so the feed never
+misses a committed write nor reports one that was rolled back. Consumers
+read it incrementally from `/api/changes/?since=<seq>`, remember the `seq`
+of the last entry they applied and fetch the current state of the objects
+named. Entries say what changed, not how: `create` and `update` both mean
+"upsert the current state".
+
+Sequence numbers are assigned on insert. SQLite runs one write transaction
+at a time, so they also follow commit order; with overlapping writers
+(PostgreSQL) a long transaction can commit entries below a `seq` a consumer
+already passed, so consumers there should resume from a little behind.
+
+`compact()` drops entries superseded by a later one for the same object:
+the table then grows with the number of changed objects rather than of
+changes, and a consumer catching up reads each object once.
+"""
+
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef
+from .models import ChangeLogEntry
+
+
+def record(model, object_ids, action):
+  """Log `action` on the `object_ids` of `model` in the current transaction"""
+  ChangeLogEntry.objects.bulk_create([
+    ChangeLogEntry(model=model._meta.model_name, object_id=pk, action=action)
+    for pk in dict.fromkeys(object_ids)
+  ], batch_size=1000)
+
+
+def changes_since(since, limit):
+  """Up to `limit` entries after sequence number `since`, oldest first"""
+  return (
+    ChangeLogEntry.objects.filter(id__gt=since).order_by('id')
+    .values_list('id', 'model', 'object_id', 'action', 'created_at', named=True)[:limit]
+  )
+
+
+def represent(entry):
+  return {
+    'seq': entry.id,
+    'model': entry.model,
+    'id': entry.object_id,
+    'action': entry.action,
+    'changed_at': entry.created_at,
+  }
+
+
+def compact(batch_size=10000):
+  """Delete the entries superseded by a later entry for the same object,
+  one `batch_size` range of sequence numbers per transaction; returns how many"""
+  last = ChangeLogEntry.objects.aggregate(last=Max('id'))['last'] or 0
+  superseded = ChangeLogEntry.objects.filter(Exists(
+    ChangeLogEntry.objects.filter(model=OuterRef('model'), object_id=OuterRef('object_id'), id__gt=OuterRef('id'))
+  ))
+  deleted = 0
+  for start in range(0, last, batch_size):
+    with transaction.atomic():
+      count, _ = superseded.filter(id__gt=start, id__lte=start + batch_size).delete()
+    deleted += count
+  return deleted
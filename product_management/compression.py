@@ -0,0 +1,153 @@
+"""Response compression negotiated from `Accept-Encoding`
+
+Catalog listings and exports are large, repetitive JSON, which compresses
+by an order of magnitude. `CompressionMiddleware` compresses the responses
+of `RESPONSE_COMPRESSION_PATHS` with the best coding both the client
+accepts and this process has: zstd (`pip install zstandard`) or brotli
+(`pip install brotli`) when installed, gzip always.
+
+- Bodies under `RESPONSE_COMPRESSION_MIN_SIZE` bytes are sent as they are:
+  the framing would outweigh the savings.
+- Streamed exports are compressed chunk by chunk as they are produced,
+  without flushing after every row, so memory stays flat and the ratio
+  matches a one-shot compression.
+- Only JSON, NDJSON and CSV are compressed. HTML pages of the browsable API
+  carry a CSRF token, which compression would expose to BREACH.
+"""
+
+import zlib
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+
+try:
+  import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+  brotli = None
+
+try:
+  import zstandard
+except ImportError:  # pragma: no cover - zstandard is optional
+  zstandard = None
+
+GZIP_LEVEL = 6
+# Levels that compress dynamic responses about as fast as gzip, but smaller
+BROTLI_QUALITY = 5
+ZSTD_LEVEL = 3
+
+COMPRESSIBLE_TYPES = {'application/json', 'application/x-ndjson', 'text/csv'}
+
+
+def gzip_stream():
+  compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+  return compressor.compress, compressor.flush
+
+
+def brotli_stream():
+  compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+  return compressor.process, compressor.finish
+
+
+def zstd_stream():
+  compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+  return compressor.compress, compressor.flush
+
+
+# `(compress, finish)` factories of the available codings, preferred first
+CODECS = {
+  name: stream for name, stream, module in (
+    ('zstd', zstd_stream, zstandard),
+    ('br', brotli_stream, brotli),
+    ('gzip', gzip_stream, zlib),
+  ) if module is not None
+}
+
+
+def compress(coding, content):
+  compress, finish = CODECS[coding]()
+  return compress(content) + finish()
+
+
+def compress_chunks(coding, chunks):
+  compress, finish = CODECS[coding]()
+  for chunk in chunks:
+    compressed = compress(chunk)
+    if compressed:
+      yield compressed
+  yield finish()
+
+
+async def acompress_chunks(coding, chunks):
+  compress, finish = CODECS[coding]()
+  async for chunk in chunks:
+    compressed = compress(chunk)
+    if compressed:
+      yield compressed
+  yield finish()
+
+
+def parse_accept_encoding(header):
+  """`{coding: quality}` of an `Accept-Encoding` header"""
+  accepted = {}
+  for part in header.split(','):
+    coding, *params = part.split(';')
+    quality = 1.0
+    for param in params:
+      name, _, value = param.strip().partition('=')
+      if name.lower() == 'q':
+        try:
+          quality = float(value)
+        except ValueError:
+          quality = 0.0
+    if coding.strip():
+      accepted[coding.strip().lower()] = quality
+  return accepted
+
+
+def negotiate(header):
+  """The available coding the client ranks highest (ties go to ours), or None"""
+  accepted = parse_accept_encoding(header)
+  qualities = {coding: accepted.get(coding, accepted.get('*', 0.0)) for coding in CODECS}
+  # `max` keeps the first of equal qualities, i.e. the one preferred in `CODECS`
+  coding = max(qualities, key=qualities.get, default=None)
+  return coding if coding is not None and qualities[coding] > 0 else None
+
+
+class CompressionMiddleware(MiddlewareMixin):
+  """Compress catalog responses with zstd, brotli or gzip"""
+
+  def compressible(self, request, response):
+    return (
+      request.path.startswith(tuple(settings.RESPONSE_COMPRESSION_PATHS))
+      and not response.has_header('Content-Encoding')
+      and response.get('Content-Type', '').split(';')[0].strip() in COMPRESSIBLE_TYPES
+      and (response.streaming or len(response.content) >= settings.RESPONSE_COMPRESSION_MIN_SIZE)
+    )
+
+  def process_response(self, request, response):
+    if not self.compressible(request, response):
+      return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    coding = negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    if coding is None:
+      return response
+
+    if response.streaming:
+      if response.is_async:
+        response.streaming_content = acompress_chunks(coding, response.streaming_content)
+      else:
+        response.streaming_content = compress_chunks(coding, response.streaming_content)
+      del response.headers['Content-Length']
+    else:
+      compressed = compress(coding, response.content)
+      if len(compressed) >= len(response.content):
+        return response
+      response.content = compressed
+      response.headers['Content-Length'] = str(len(compressed))
+
+    # The body differs byte for byte from the uncompressed one
+    etag = response.get('ETag')
+    if etag and etag.startswith('"'):
+      response.headers['ETag'] = 'W/' + etag
+    response.headers['Content-Encoding'] = coding
+    return response
@@ -0,0 +1,103 @@
+"""Conditional GET support (ETag / Last-Modified) for catalog endpoints
+
+The validators are computed from a single aggregate query over the rows a
+response is built from, so a `304 Not Modified` never pays for fetching or
+serializing the payload itself.
+"""
+
+import hashlib
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework.response import Response
+from . import caching
+
+
+class ResourceState:
+  """ETag and Last-Modified validators of a response"""
+
+  def __init__(self, request, *parts, last_modified=None):
+    raw = repr((getattr(request, 'accepted_media_type', None),) + parts)
+    self.etag = quote_etag(hashlib.sha1(raw.encode()).hexdigest())
+    self.last_modified = int(last_modified.timestamp()) if last_modified else None
+
+
+def latest(*values):
+  values = [value for value in values if value is not None]
+  return max(values) if values else None
+
+
+def product_state(request, queryset):
+  """Validators covering a set of products and all of their discounts"""
+  state = queryset.order_by().aggregate(
+    product_count=Count('id', distinct=True),
+    product_updated=Max('updated_at'),
+    discount_count=Count('discounts', distinct=True),
+    discount_updated=Max('discounts__updated_at'),
+  )
+  if not state['product_count']:
+    return None
+  return ResourceState(
+    request, *state.values(),
+    last_modified=latest(state['product_updated'], state['discount_updated']),
+  )
+
+
+def category_state(request, queryset):
+  """Validators covering a set of categories and their product counters"""
+  state = queryset.order_by().aggregate(
+    count=Count('id'), updated=Max('updated_at'), counted=Max('rollup__updated_at')
+  )
+  return ResourceState(request, *state.values(), last_modified=latest(state['updated'], state['counted']))
+
+
+def cached_entry(cache_key, get_state, build_data):
+  """`(state, data)` from the cache, built and cached on a miss"""
+  cache = caching.get_cache()
+  entry = cache.get(cache_key)
+  if entry is None:
+    entry = (get_state(), build_data())
+    cache.set(cache_key, entry, caching.get_timeout())
+  return entry
+
+
+def conditional_response(request, state, data):
+  """`304 Not Modified` if the client has `state`, else `data` with its validators"""
+  if state is not None:
+    not_modified = get_conditional_response(request, etag=state.etag, last_modified=state.last_modified)
+    if not_modified is not None:
+      return not_modified
+  return validated_response(state, data)
+
+
+def validated_response(state, data):
+  response = Response(data)
+  if state is not None:
+    response.headers['ETag'] = state.etag
+    if state.last_modified is not None:
+      response.headers['Last-Modified'] = http_date(state.last_modified)
+  return response
+
+
+def conditional_get(request, get_state, build_data, cache_key=None):
+  """Answer with `304 Not Modified` when the client's copy is current
+
+  With a `cache_key` the validators are cached next to the payload, so a
+  cache hit is answered without touching the database at all. On a miss the
+  validators come from `get_state()` and the payload is only built (and
+  cached) when the client's copy is out of date.
+  """
+  cache = caching.get_cache()
+  entry = cache.get(cache_key) if cache_key else None
+  state, data = entry if entry is not None else (get_state(), None)
+
+  if state is not None:
+    not_modified = get_conditional_response(request, etag=state.etag, last_modified=state.last_modified)
+    if not_modified is not None:
+      return not_modified
+
+  if data is None:
+    data = build_data()
+    if cache_key:
+      cache.set(cache_key, (state, data), caching.get_timeout())
+  return validated_response(state, data)
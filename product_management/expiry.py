@@ -0,0 +1,94 @@
+"""Batch expiry of discounts past their `expires_at`"""
+
+import logging
+import threading
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from .idempotency import purge_idempotency_keys
+from .inventory import expire_reservations
+from .models import Discount, DiscountStatus, Product
+from .signals import products_bulk_changed
+
+logger = logging.getLogger(__name__)
+
+
+def expire_discounts(now=None, batch_size=1000):
+  """Deactivate every active discount that expired by `now`
+
+  Each batch is one indexed `(status, expires_at)` range read and one
+  set-based UPDATE in its own short transaction, after which only the
+  products that lost a discount are repriced and evicted from the cache.
+  Returns the number of discounts expired.
+  """
+  now = now or timezone.now()
+  expired = 0
+  while True:
+    with transaction.atomic():
+      batch = list(
+        Discount.objects.filter(status=DiscountStatus.ACTIVE, expires_at__lte=now)
+        .order_by('expires_at')
+        .values_list('id', 'product_id')[:batch_size]
+      )
+      if not batch:
+        return expired
+      Discount.objects.filter(id__in=[pk for pk, _ in batch], status=DiscountStatus.ACTIVE).update(
+        status=DiscountStatus.INACTIVE, updated_at=now
+      )
+      products_bulk_changed.send(
+        sender=Product, product_ids=list({product_id for _, product_id in batch}), action='discounts',
+        discount_ids=[pk for pk, _ in batch],
+      )
+    expired += len(batch)
+
+
+class ExpirySweeper(threading.Thread):
+  """Daemon thread running `expire_discounts`, `expire_reservations` and
+  `purge_idempotency_keys` every `interval` seconds"""
+
+  def __init__(self, interval, batch_size=1000):
+    super().__init__(name='discount-expiry-sweeper', daemon=True)
+    self.interval = interval
+    self.batch_size = batch_size
+    self.stopped = threading.Event()
+
+  def run(self):
+    while not self.stopped.wait(self.interval):
+      close_old_connections()
+      try:
+        expired = expire_discounts(batch_size=self.batch_size)
+        if expired:
+          logger.info('Expired %s discounts', expired)
+        released = expire_reservations(batch_size=self.batch_size)
+        if released:
+          logger.info('Released %s expired stock reservations', released)
+        purge_idempotency_keys()
+      except Exception:
+        logger.exception('Discount expiry sweep failed')
+      finally:
+        close_old_connections()
+
+  def stop(self):
+    self.stopped.set()
+
+
+_sweeper = None
+
+
+def start_expiry_sweeper(interval, batch_size=1000):
+  """Start the in-process sweeper once per process"""
+  global _sweeper
+  if _sweeper is None or not _sweeper.is_alive():
+    _sweeper = ExpirySweeper(interval, batch_size)
+    _sweeper.start()
+  return _sweeper
+
+
+def start_configured_sweeper():
+  """Start the sweeper if `DISCOUNT_EXPIRY_SWEEP_INTERVAL` asks for one
+
+  Called by the WSGI and ASGI entry points only (which `runserver` loads in
+  its serving process), so management commands and tests never sweep.
+  """
+  if settings.DISCOUNT_EXPIRY_SWEEP_INTERVAL:
+    return start_expiry_sweeper(settings.DISCOUNT_EXPIRY_SWEEP_INTERVAL)
@@ -0,0 +1,86 @@
+"""Product filters and facet counts shared by the listing, export and search"""
+
+from decimal import Decimal
+from django.conf import settings
+from django.db.models import Count, Q
+from django_filters import rest_framework as filters
+from .models import Category, Product, ProductStatus, path_range
+
+
+class ProductFilter(filters.FilterSet):
+  category = filters.NumberFilter(method='filter_category')
+  include_descendants = filters.BooleanFilter(method='filter_noop')
+  status = filters.ChoiceFilter(choices=ProductStatus.choices)
+  # Prices filter on the precomputed, indexed effective price
+  min_price = filters.NumberFilter(field_name='effective_price', lookup_expr='gte')
+  max_price = filters.NumberFilter(field_name='effective_price', lookup_expr='lte')
+  min_quantity = filters.NumberFilter(field_name='quantity', lookup_expr='gte')
+  in_stock = filters.BooleanFilter(method='filter_in_stock')
+  has_discount = filters.BooleanFilter(method='filter_has_discount')
+
+  class Meta:
+    model = Product
+    fields = []
+
+  def filter_category(self, queryset, name, value):
+    if not self.form.cleaned_data.get('include_descendants'):
+      return queryset.filter(category__id=value)
+    # Match the whole subtree with one range query over `Category.path`
+    category = Category.objects.filter(id=value).first()
+    if category is None:
+      return queryset.none()
+    lower, upper = path_range(category.path)
+    return queryset.filter(category__path__gte=lower, category__path__lt=upper)
+
+  def filter_noop(self, queryset, name, value):
+    # Only modifies how `category` is applied
+    return queryset
+
+  def filter_in_stock(self, queryset, name, value):
+    return queryset.filter(quantity__gt=0) if value else queryset.filter(quantity__lte=0)
+
+  def filter_has_discount(self, queryset, name, value):
+    # `best_discount` is set exactly when a product has an active discount
+    return queryset.filter(best_discount__isnull=not value)
+
+
+def price_buckets():
+  """`(lower, upper)` effective price ranges of the price facet, the last one open ended"""
+  bounds = [Decimal(str(bound)) for bound in settings.PRODUCT_PRICE_BUCKETS]
+  return list(zip(bounds, bounds[1:] + [None]))
+
+
+def product_facets(products):
+  """Counts of `products` per status, category and price bucket
+
+  One `GROUP BY category` query with conditional aggregates for the statuses
+  and price buckets; the per-category rows are then summed up in Python.
+  """
+  buckets = price_buckets()
+  aggregates = {f'status_{index}': Count('id', filter=Q(status=value)) for index, value in enumerate(ProductStatus.values)}
+  for index, (lower, upper) in enumerate(buckets):
+    condition = Q(effective_price__gte=lower)
+    if upper is not None:
+      condition &= Q(effective_price__lt=upper)
+    aggregates[f'price_{index}'] = Count('id', filter=condition)
+
+  rows = list(
+    products.order_by().values('category', 'category__title').annotate(count=Count('id'), **aggregates)
+    .order_by('-count', 'category')
+  )
+  statuses = [
+    {'value': value, 'count': sum(row[f'status_{index}'] for row in rows)}
+    for index, value in enumerate(ProductStatus.values)
+  ]
+  return {
+    'status': sorted([status for status in statuses if status['count']], key=lambda status: -status['count']),
+    'category': [{'id': row['category'], 'title': row['category__title'], 'count': row['count']} for row in rows],
+    'price': [
+      {
+        'min': str(lower),
+        'max': str(upper) if upper is not None else None,
+        'count': sum(row[f'price_{index}'] for row in rows),
+      }
+      for index, (lower, upper) in enumerate(buckets)
+    ],
+  }
@@ -0,0 +1,82 @@
+"""Safe retries of write requests carrying an `Idempotency-Key` header
+
+The first request with a key claims it by inserting an `IdempotencyKey` row,
+runs, and stores its successful response in the same transaction. A retry
+with the same key and body gets the stored response back without redoing the
+work, and one with a different body is refused. A retry racing the original
+waits on the key's unique constraint until the original commits (or fails
+and frees the key). Keys are forgotten after `IDEMPOTENCY_KEY_TTL` seconds.
+"""
+
+import hashlib
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+
+def request_hash(request):
+  """Digest of the path and parsed body, insensitive to key order and spacing"""
+  body = json.dumps(request.data, cls=JSONEncoder, sort_keys=True, separators=(',', ':'))
+  return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def purge_idempotency_keys(now=None):
+  """Delete the keys older than `IDEMPOTENCY_KEY_TTL`, returning how many"""
+  now = now or timezone.now()
+  deleted, _ = IdempotencyKey.objects.filter(
+    created_at__lte=now - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+  ).delete()
+  return deleted
+
+
+def idempotent(request, scope, handler):
+  """The response of `handler()`, run at most once per `Idempotency-Key`"""
+  key = request.headers.get(HEADER)
+  if key is None:
+    return handler()
+  if not key or len(key) > 255:
+    raise ValidationError({HEADER: 'Idempotency keys must be 1 to 255 characters long.'})
+  digest = request_hash(request)
+
+  with transaction.atomic():
+    IdempotencyKey.objects.filter(
+      scope=scope, key=key, created_at__lte=timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+    ).delete()
+    try:
+      with transaction.atomic():
+        claim = IdempotencyKey.objects.create(scope=scope, key=key, request_hash=digest)
+    except IntegrityError:
+      return replay(IdempotencyKey.objects.get(scope=scope, key=key), digest)
+
+    response = handler()
+    if status.is_success(response.status_code):
+      claim.status_code = response.status_code
+      claim.response = response.data
+      claim.save(update_fields=['status_code', 'response'])
+    else:
+      # Failed requests did nothing worth replaying; let the retry run
+      claim.delete()
+  return response
+
+
+def replay(stored, digest):
+  if stored.request_hash != digest:
+    return Response(
+      {'error': 'This Idempotency-Key was already used for a different request.'},
+      status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+    )
+  if stored.status_code is None:
+    return Response({'error': 'A request with this Idempotency-Key is in progress.'}, status=status.HTTP_409_CONFLICT)
+  response = Response(stored.response, status=stored.status_code)
+  response[REPLAYED_HEADER] = 'true'
+  return response
@@ -0,0 +1,181 @@
+"""Stock reservations with contention-safe, conditional decrements
+
+Stock is never read, modified and written back. Reserving `n` units is a
+single `UPDATE ... SET quantity = quantity - n WHERE quantity >= n`, which
+the database applies atomically: of two checkouts racing for the last unit,
+exactly one UPDATE matches a row. Multi-item reservations take their rows in
+ascending product id order inside one transaction, so two reservations
+sharing products always lock them in the same order and can't deadlock.
+
+The category rollups are adjusted by the known difference of each change
+(units times price, and the status flip the UPDATE makes), read off the
+product rows locked first, rather than recounted.
+"""
+
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+from . import rollups
+from .models import Product, ProductStatus, Reservation, ReservationItem, ReservationStatus
+from .signals import products_bulk_changed
+
+
+class ReservationError(Exception):
+  pass
+
+
+class InsufficientStock(ReservationError):
+  def __init__(self, product_id, quantity):
+    super().__init__(f'Not enough stock of product {product_id} to reserve {quantity}.')
+    self.product_id = product_id
+    self.quantity = quantity
+
+
+def merge_items(items):
+  """`{product_id: quantity}` of `(product_id, quantity)` pairs, summing repeats"""
+  merged = {}
+  for product_id, quantity in items:
+    if quantity < 1:
+      raise ValueError('Reserved quantities must be positive.')
+    merged[product_id] = merged.get(product_id, 0) + quantity
+  return merged
+
+
+def lock_products(product_ids):
+  """`{product_id: (category_id, category path, status, price, quantity)}`,
+  locked in ascending id order until the transaction ends"""
+  rows = (
+    Product.objects.select_for_update(of=('self',)).filter(id__in=product_ids).order_by('id')
+    .values_list('id', 'category_id', 'category__path', 'status', 'price', 'quantity')
+  )
+  return {product_id: row for product_id, *row in rows}
+
+
+def count_stock_change(deltas, row, change):
+  """Add the rollup difference of `change` units (negative when taken) to
+  a locked product `row` to `deltas`, mirroring `take_stock`/`return_stock`"""
+  category_id, path, status, price, quantity = row
+  new_status = status
+  if change < 0 and status == ProductStatus.ACTIVE and quantity + change == 0:
+    new_status = ProductStatus.OUT_OF_STOCK
+  elif change > 0 and status == ProductStatus.OUT_OF_STOCK:
+    new_status = ProductStatus.ACTIVE
+  delta = rollups.Totals.of(new_status, price, quantity + change).minus(rollups.Totals.of(status, price, quantity))
+  key = (category_id, path)
+  deltas[key] = deltas.get(key, rollups.ZERO).plus(delta)
+
+
+def take_stock(product_id, quantity, now):
+  """Decrement stock if at least `quantity` is left, returning whether it was"""
+  # `status` comes first so every SET expression sees the old quantity, even
+  # on databases evaluating assignments left to right
+  return bool(Product.objects.filter(id=product_id, quantity__gte=quantity).update(
+    status=Case(
+      When(status=ProductStatus.ACTIVE, quantity=quantity, then=Value(ProductStatus.OUT_OF_STOCK)),
+      default=F('status'),
+    ),
+    quantity=F('quantity') - quantity,
+    updated_at=now,
+  ))
+
+
+def return_stock(product_id, quantity, now):
+  Product.objects.filter(id=product_id).update(
+    status=Case(
+      When(status=ProductStatus.OUT_OF_STOCK, then=Value(ProductStatus.ACTIVE)),
+      default=F('status'),
+    ),
+    quantity=F('quantity') + quantity,
+    updated_at=now,
+  )
+
+
+def reserve(items, ttl=None) -> Reservation:
+  """Reserve `(product_id, quantity)` items all at once, for `ttl` seconds
+
+  Raises `InsufficientStock` (and reserves nothing) if any product lacks
+  stock, or `Product.DoesNotExist` for unknown products.
+  """
+  items = merge_items(items)
+  if not items:
+    raise ValueError('A reservation needs at least one item.')
+  ttl = settings.RESERVATION_TTL if ttl is None else ttl
+  now = timezone.now()
+  with transaction.atomic():
+    rows, deltas = lock_products(items), {}
+    for product_id in sorted(items):
+      if product_id not in rows:
+        raise Product.DoesNotExist(f'Product with id - {product_id} not found')
+      if not take_stock(product_id, items[product_id], now):
+        raise InsufficientStock(product_id, items[product_id])
+      count_stock_change(deltas, rows[product_id], -items[product_id])
+    reservation = Reservation.objects.create(expires_at=now + timedelta(seconds=ttl))
+    ReservationItem.objects.bulk_create([
+      ReservationItem(reservation=reservation, product_id=product_id, quantity=quantity)
+      for product_id, quantity in sorted(items.items())
+    ])
+    rollups.add_categories(deltas)
+    products_bulk_changed.send(sender=Product, product_ids=sorted(items), action='stock')
+  return reservation
+
+
+def commit(reservation_id) -> Reservation:
+  """Make a pending, unexpired reservation final; its stock stays sold"""
+  now = timezone.now()
+  with transaction.atomic():
+    committed = Reservation.objects.filter(
+      id=reservation_id, status=ReservationStatus.PENDING, expires_at__gt=now
+    ).update(status=ReservationStatus.COMMITTED, updated_at=now)
+    if committed:
+      return Reservation.objects.get(id=reservation_id)
+
+  reservation = Reservation.objects.get(id=reservation_id)
+  if reservation.status == ReservationStatus.PENDING:
+    # Expired but not swept yet: give the stock back right away
+    release(reservation_id, status=ReservationStatus.EXPIRED)
+    raise ReservationError(f'Reservation {reservation_id} has expired.')
+  raise ReservationError(f'Reservation {reservation_id} is {reservation.status}.')
+
+
+def release(reservation_id, status=ReservationStatus.RELEASED) -> Reservation:
+  """Cancel a pending reservation and put its stock back"""
+  now = timezone.now()
+  with transaction.atomic():
+    # The status change is the guard: only one release or commit can win it
+    released = Reservation.objects.filter(id=reservation_id, status=ReservationStatus.PENDING).update(
+      status=status, updated_at=now
+    )
+    reservation = Reservation.objects.get(id=reservation_id)
+    if not released:
+      raise ReservationError(f'Reservation {reservation_id} is {reservation.status}.')
+    items = list(reservation.items.order_by('product_id').values_list('product_id', 'quantity'))
+    rows, deltas = lock_products([product_id for product_id, _ in items]), {}
+    for product_id, quantity in items:
+      return_stock(product_id, quantity, now)
+      if product_id in rows:
+        count_stock_change(deltas, rows[product_id], quantity)
+    rollups.add_categories(deltas)
+    products_bulk_changed.send(sender=Product, product_ids=[product_id for product_id, _ in items], action='stock')
+  return reservation
+
+
+def expire_reservations(now=None, batch_size=1000):
+  """Release every pending reservation past its TTL, returning how many"""
+  now = now or timezone.now()
+  expired = 0
+  while True:
+    batch = list(
+      Reservation.objects.filter(status=ReservationStatus.PENDING, expires_at__lte=now)
+      .order_by('expires_at').values_list('id', flat=True)[:batch_size]
+    )
+    if not batch:
+      return expired
+    for reservation_id in batch:
+      try:
+        release(reservation_id, status=ReservationStatus.EXPIRED)
+        expired += 1
+      except ReservationError:
+        # Committed or released concurrently
+        pass
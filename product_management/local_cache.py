@@ -0,0 +1,180 @@
+"""Bounded in-process LRU cache with single-flight loading
+
+The shared catalog cache (`caching.py`) still costs a round trip or two per
+request, and when a hot product's entry is missing every concurrent request
+for it queries the database at once. `LocalCache` keeps the most recently
+used product detail payloads in process memory for a few seconds, and makes
+concurrent misses for one key wait on a single load instead ("single
+flight").
+
+Entries are keyed by the product's version in the shared cache, which
+every process bumps on writes (see `caching.invalidate_products`), so a
+write made anywhere makes the entry unreachable; a write in this process
+also evicts it right away. A hit costs one shared cache read instead of two
+plus the payload transfer. `PRODUCT_LOCAL_CACHE_TTL` bounds how long
+entries of cold products linger.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from . import metrics
+
+COUNTERS = ('hits', 'misses', 'coalesced', 'evictions', 'expirations', 'invalidations')
+
+
+class Flight:
+  """A load in progress, which concurrent misses for its key wait on"""
+
+  __slots__ = ('done', 'value', 'error', 'stale')
+
+  def __init__(self):
+    self.done = threading.Event()
+    self.value = None
+    self.error = None
+    # Set when the key is invalidated mid-load: the result may predate the write
+    self.stale = False
+
+
+class LocalCache:
+  """Thread-safe LRU of at most `max_size` entries living `ttl` seconds"""
+
+  def __init__(self, name, max_size, ttl, wait_timeout=10):
+    self.name = name
+    self.wait_timeout = wait_timeout
+    self.lock = threading.Lock()
+    self.entries = OrderedDict()
+    self.flights = {}
+    self.counts = dict.fromkeys(COUNTERS, 0)
+    self.configure(max_size, ttl)
+
+  def configure(self, max_size, ttl):
+    with self.lock:
+      self.max_size = max_size
+      self.ttl = ttl
+      self.entries.clear()
+
+  def __len__(self):
+    return len(self.entries)
+
+  def __contains__(self, key):
+    return key in self.entries
+
+  def get_or_load(self, key, load):
+    """The cached value of `key`, or `load()`'s, which concurrent callers share"""
+    if self.max_size <= 0:
+      return load()
+    now = time.monotonic()
+    with self.lock:
+      entry = self.entries.get(key)
+      if entry is not None:
+        expires, value = entry
+        if expires > now:
+          self.entries.move_to_end(key)
+          self.counts['hits'] += 1
+          return value
+        del self.entries[key]
+        self.counts['expirations'] += 1
+      flight = self.flights.get(key)
+      leader = flight is None
+      if leader:
+        flight = self.flights[key] = Flight()
+        self.counts['misses'] += 1
+      else:
+        self.counts['coalesced'] += 1
+
+    if not leader:
+      if not flight.done.wait(self.wait_timeout):
+        return load()
+      if flight.error is not None:
+        raise flight.error
+      return flight.value
+
+    try:
+      flight.value = load()
+    except BaseException as error:
+      flight.error = error
+      raise
+    finally:
+      with self.lock:
+        del self.flights[key]
+        if flight.error is None and not flight.stale:
+          self.store(key, flight.value)
+      flight.done.set()
+    return flight.value
+
+  def store(self, key, value):
+    self.entries[key] = (time.monotonic() + self.ttl, value)
+    self.entries.move_to_end(key)
+    while len(self.entries) > self.max_size:
+      self.entries.popitem(last=False)
+      self.counts['evictions'] += 1
+
+  def invalidate(self, matches):
+    """Drop the entries, and results of loads in progress, whose key `matches`"""
+    with self.lock:
+      for key in [key for key in self.entries if matches(key)]:
+        del self.entries[key]
+        self.counts['invalidations'] += 1
+      for key, flight in self.flights.items():
+        if matches(key):
+          flight.stale = True
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      for flight in self.flights.values():
+        flight.stale = True
+
+  def stats(self):
+    with self.lock:
+      return {**self.counts, 'entries': len(self.entries)}
+
+
+# Product detail payloads, keyed by `(pk, fields, shared version)`
+product_details = LocalCache(
+  'product_detail', settings.PRODUCT_LOCAL_CACHE_SIZE, settings.PRODUCT_LOCAL_CACHE_TTL
+)
+
+
+def evict_products(product_ids):
+  """Evict the payloads of `product_ids`, now and again on commit"""
+  product_ids = set(product_ids)
+  if not product_ids or product_details.max_size <= 0:
+    return
+
+  def evict():
+    product_details.invalidate(lambda key: key[0] in product_ids)
+
+  evict()
+  transaction.on_commit(evict)
+
+
+@receiver(setting_changed)
+def reconfigure(setting, **kwargs):
+  if setting in ('PRODUCT_LOCAL_CACHE_SIZE', 'PRODUCT_LOCAL_CACHE_TTL', 'CACHES'):
+    product_details.configure(settings.PRODUCT_LOCAL_CACHE_SIZE, settings.PRODUCT_LOCAL_CACHE_TTL)
+
+
+def render_counters():
+  """Counters of the in-process caches in the Prometheus text format"""
+  lines = []
+  stats = product_details.stats()
+  for counter in COUNTERS:
+    name = f'local_cache_{counter}_total'
+    lines += [
+      f'# HELP {name} In-process cache {counter}.', f'# TYPE {name} counter',
+      f'{name}{{cache="{product_details.name}"}} {stats[counter]}',
+    ]
+  lines += [
+    '# HELP local_cache_entries Entries held by the in-process cache.', '# TYPE local_cache_entries gauge',
+    f'local_cache_entries{{cache="{product_details.name}"}} {stats["entries"]}',
+  ]
+  return lines
+
+
+metrics.register(render_counters)
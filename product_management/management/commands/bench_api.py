@@ -0,0 +1,99 @@
+import json
+import platform
+import time
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from product_management import renderers
+from product_management.benchmarks import ENDPOINTS, benchmark_database, count_queries, percentile, seed_catalog
+from product_management.models import Category, Discount, Product
+
+
+class Command(BaseCommand):
+  help = 'Measure throughput, p50/p99 latency and query counts of the read endpoints on a synthetic catalog'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=3, help='Levels of subcategories below the root category')
+    parser.add_argument('--fanout', type=int, default=4, help='Subcategories per category')
+    parser.add_argument('--discounts', type=int, default=3, help='Most discounts per product')
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per endpoint')
+    parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per endpoint')
+    parser.add_argument('--endpoints', help=f'Comma separated subset of: {", ".join(ENDPOINTS)}')
+    parser.add_argument('--cache', action='store_true', help='Keep the response cache enabled')
+    parser.add_argument('--accept-encoding', default='', help='Accept-Encoding sent, e.g. "gzip" or "zstd, br, gzip"')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+  def handle(self, *args, **options):
+    names = options['endpoints'].split(',') if options['endpoints'] else list(ENDPOINTS)
+    unknown = set(names) - set(ENDPOINTS)
+    if unknown:
+      raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+
+    with benchmark_database():
+      ids = seed_catalog(options['products'], options['depth'], options['fanout'], options['discounts'], options['seed'])
+      report = {
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'cache': options['cache'],
+        'renderer': renderers.ENGINE,
+        'accept_encoding': options['accept_encoding'],
+        'catalog': {
+          'products': Product.objects.count(),
+          'categories': Category.objects.count(),
+          'discounts': Discount.objects.count(),
+          'depth': options['depth'],
+          'fanout': options['fanout'],
+        },
+        'endpoints': {},
+      }
+      if options['cache']:
+        self.run(names, ids, options, report)
+      else:
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+          self.run(names, ids, options, report)
+
+    output = json.dumps(report, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as file:
+        file.write(output)
+    else:
+      self.stdout.write(output)
+
+  def run(self, names, ids, options, report):
+    client = Client(headers={'Accept-Encoding': options['accept_encoding']} if options['accept_encoding'] else None)
+    for name in names:
+      url = ENDPOINTS[name].format(**ids)
+      for _ in range(options['warmup']):
+        self.get(client, url)
+      with count_queries() as queries:
+        status_code, size, _, coding = self.get(client, url)
+      if status_code != 200:
+        raise CommandError(f'{name}: GET {url} answered {status_code}')
+
+      timings = []
+      started, cpu_started = time.perf_counter(), time.process_time()
+      for _ in range(options['requests']):
+        timings.append(self.get(client, url)[2])
+      elapsed, cpu = time.perf_counter() - started, time.process_time() - cpu_started
+      report['endpoints'][name] = {
+        'url': url,
+        'requests_per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 0.5), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'cpu_ms': round(cpu / len(timings) * 1000, 3),
+        'queries': len(queries),
+        'bytes': size,
+        'content_encoding': coding,
+      }
+
+  def get(self, client, url):
+    """GET `url`, reading streamed bodies in full; returns (status, bytes on
+    the wire, ms, content encoding)"""
+    started = time.perf_counter()
+    response = client.get(url)
+    body = b''.join(response.streaming_content) if response.streaming else response.content
+    return response.status_code, len(body), (time.perf_counter() - started) * 1000, response.get('Content-Encoding')
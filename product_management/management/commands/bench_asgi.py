@@ -0,0 +1,101 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import AsyncClient, Client, override_settings
+from product_management.benchmarks import benchmark_database, percentile, seed_discounts, seed_products
+
+# Sync endpoints served through the WSGI handler and their async twins
+# served through the ASGI handler
+ENDPOINTS = {
+  'product_list': ('/api/products/?pagination=page&ordering=created_at', '/api/async/products/?ordering=created_at'),
+  'product_detail': ('/api/products/{pk}', '/api/async/products/{pk}'),
+  'category_list': ('/api/categories/', '/api/async/categories/'),
+}
+
+
+class Command(BaseCommand):
+  help = 'Compare the throughput of the sync endpoints under WSGI and the async ones under ASGI at high concurrency'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per endpoint and handler')
+    parser.add_argument('--concurrency', type=int, default=100, help='Requests in flight at once')
+    parser.add_argument('--cache', action='store_true', help='Keep the response cache enabled')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+  def handle(self, *args, **options):
+    with benchmark_database():
+      seed_products(options['products'])
+      seed_discounts()
+      if options['cache']:
+        report = self.run(options)
+      else:
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+          report = self.run(options)
+
+    output = json.dumps(report, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as file:
+        file.write(output)
+    else:
+      self.stdout.write(output)
+
+  def run(self, options):
+    total, concurrency = options['requests'], options['concurrency']
+    report = {'products': options['products'], 'requests': total, 'concurrency': concurrency, 'endpoints': {}}
+    for name, (sync_url, async_url) in ENDPOINTS.items():
+      urls = [sync_url.format(pk=1 + i % options['products']) for i in range(total)]
+      async_urls = [async_url.format(pk=1 + i % options['products']) for i in range(total)]
+      report['endpoints'][name] = {
+        'wsgi': self.wsgi(urls, concurrency),
+        'asgi': asyncio.run(self.asgi(async_urls, concurrency)),
+      }
+    return report
+
+  def wsgi(self, urls, concurrency):
+    """A pool of `concurrency` threads, each with its own WSGI test client"""
+    local = threading.local()
+
+    def get(url):
+      if not hasattr(local, 'client'):
+        local.client = Client()
+      start = time.perf_counter()
+      response = local.client.get(url)
+      elapsed = (time.perf_counter() - start) * 1000
+      # Don't leak a connection per worker thread
+      connections.close_all()
+      return response.status_code, elapsed
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+      results = list(pool.map(get, urls))
+    return summary(results, time.perf_counter() - start)
+
+  async def asgi(self, urls, concurrency):
+    """`concurrency` requests at a time on one event loop through the ASGI handler"""
+    client = AsyncClient()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def get(url):
+      async with slots:
+        start = time.perf_counter()
+        response = await client.get(url)
+        return response.status_code, (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(get(url) for url in urls))
+    return summary(results, time.perf_counter() - start)
+
+
+def summary(results, seconds):
+  latencies = [elapsed for _, elapsed in results]
+  return {
+    'requests_per_second': round(len(results) / seconds, 1),
+    'p50_ms': round(percentile(latencies, 0.5), 2),
+    'p99_ms': round(percentile(latencies, 0.99), 2),
+    'errors': sum(1 for status, _ in results if status >= 400),
+  }
@@ -0,0 +1,113 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection, connections
+from django.test import Client, override_settings
+from ecommerce_system.database import sqlite_options
+from product_management import inventory
+from product_management.benchmarks import benchmark_database, percentile, seed_discounts, seed_products
+from product_management.models import Product
+
+
+class Command(BaseCommand):
+  help = 'Measure write concurrency and read latency of the database profile under a mixed load'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--products', type=int, default=2000)
+    parser.add_argument('--writers', type=int, default=4, help='Threads reserving and releasing stock')
+    parser.add_argument('--readers', type=int, default=8, help='Threads reading product pages')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+  def handle(self, *args, **options):
+    # On SQLite compare Django's defaults with the tuned profile, each on a
+    # fresh database file; other databases are measured as configured
+    if connection.vendor == 'sqlite':
+      profiles = {'sqlite_default': {}, 'sqlite_tuned': sqlite_options()}
+    else:
+      profiles = {connection.vendor: connection.settings_dict['OPTIONS']}
+
+    report = {'products': options['products'], 'writers': options['writers'], 'readers': options['readers'], 'profiles': {}}
+    configured = connection.settings_dict['OPTIONS']
+    try:
+      for name, database_options in profiles.items():
+        # Connections opened by the load threads share this settings dict
+        connection.close()
+        connection.settings_dict['OPTIONS'] = database_options
+        test_name = os.path.join(tempfile.mkdtemp(), 'bench.sqlite3') if connection.vendor == 'sqlite' else None
+        with benchmark_database(test_name=test_name):
+          seed_products(options['products'])
+          seed_discounts()
+          with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            report['profiles'][name] = self.load(options)
+    finally:
+      connection.close()
+      connection.settings_dict['OPTIONS'] = configured
+
+    output = json.dumps(report, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as file:
+        file.write(output)
+    else:
+      self.stdout.write(output)
+
+  def load(self, options):
+    product_ids = list(Product.objects.values_list('id', flat=True))
+    deadline = time.perf_counter() + options['seconds']
+    results = {'write': [], 'read': []}
+    errors = {'write': 0, 'read': 0}
+    lock = threading.Lock()
+
+    def run(kind, operation, seed):
+      rng = random.Random(seed)
+      timings, failed = [], 0
+      try:
+        while time.perf_counter() < deadline:
+          started = time.perf_counter()
+          try:
+            operation(rng)
+          except OperationalError:
+            # "database is locked" once the busy timeout runs out
+            failed += 1
+            continue
+          timings.append((time.perf_counter() - started) * 1000)
+      finally:
+        connections.close_all()
+        with lock:
+          results[kind].extend(timings)
+          errors[kind] += failed
+
+    def write(rng):
+      reservation = inventory.reserve([(rng.choice(product_ids), 1)])
+      inventory.release(reservation.id)
+
+    client = threading.local()
+
+    def read(rng):
+      if not hasattr(client, 'instance'):
+        client.instance = Client()
+      url = f'/api/products/{rng.choice(product_ids)}' if rng.random() < 0.5 else '/api/products/?page_size=50'
+      if client.instance.get(url).status_code != 200:
+        raise OperationalError(url)
+
+    threads = [threading.Thread(target=run, args=('write', write, seed)) for seed in range(options['writers'])]
+    threads += [threading.Thread(target=run, args=('read', read, seed)) for seed in range(options['readers'])]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    elapsed = options['seconds']
+    return {
+      kind: {
+        'per_second': round(len(timings) / elapsed, 1),
+        'p50_ms': round(percentile(timings, 0.5) or 0, 2),
+        'p99_ms': round(percentile(timings, 0.99) or 0, 2),
+        'errors': errors[kind],
+      }
+      for kind, timings in results.items()
+    }
@@ -0,0 +1,58 @@
+import json
+from django.core.management.base import BaseCommand
+from django.test import Client
+from product_management.benchmarks import benchmark_database, percentile, seed_products, timed_get
+
+
+class Command(BaseCommand):
+  help = 'Compare keyset and page number pagination latency from the first page to the deepest one'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--pages', type=int, default=10000)
+    parser.add_argument('--page-size', type=int, default=10)
+    parser.add_argument('--checkpoints', default='1,10,100,1000,10000',
+                        help='Comma separated page numbers to report')
+    parser.add_argument('--ordering', default='-created_at')
+    parser.add_argument('--repeat', type=int, default=5, help='Samples per checkpoint, the median is reported')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+  def handle(self, *args, **options):
+    pages, page_size = options['pages'], options['page_size']
+    checkpoints = sorted({int(page) for page in options['checkpoints'].split(',') if int(page) <= pages})
+
+    with benchmark_database():
+      seed_products(pages * page_size)
+      client = Client()
+      report = {
+        'products': pages * page_size,
+        'page_size': page_size,
+        'ordering': options['ordering'],
+        'keyset_ms': self.walk_cursor(client, pages, page_size, options['ordering'], checkpoints, options['repeat']),
+        'page_number_ms': {
+          page: self.median_get(client, f'/api/products/?page={page}&page_size={page_size}&ordering={options["ordering"]}', options['repeat'])
+          for page in checkpoints
+        },
+      }
+
+    output = json.dumps(report, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as file:
+        file.write(output)
+    else:
+      self.stdout.write(output)
+
+  def median_get(self, client, url, repeat):
+    return percentile([timed_get(client, url)[1] for _ in range(repeat)], 0.5)
+
+  def walk_cursor(self, client, pages, page_size, ordering, checkpoints, repeat):
+    """Follow `next` links page by page, recording latency at each checkpoint"""
+    timings = {}
+    url = f'/api/products/?page_size={page_size}&ordering={ordering}'
+    for page in range(1, pages + 1):
+      response, _ = timed_get(client, url)
+      if page in checkpoints:
+        timings[page] = self.median_get(client, url, repeat)
+      url = response.json()['next']
+      if not url:
+        break
+    return timings
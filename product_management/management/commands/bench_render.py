@@ -0,0 +1,75 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from product_management import compression, renderers
+from product_management.benchmarks import ENDPOINTS, benchmark_database, seed_catalog
+
+# Endpoints answering a single JSON document (the export streams NDJSON)
+DOCUMENT_ENDPOINTS = [name for name in ENDPOINTS if name != 'product_export']
+
+
+def cpu_ms(function, repeat):
+  """Mean CPU milliseconds of `function()` over `repeat` calls, and its last result"""
+  started = time.process_time()
+  for _ in range(repeat):
+    result = function()
+  return (time.process_time() - started) / repeat * 1000, result
+
+
+class Command(BaseCommand):
+  help = 'Compare JSON renderers and response compressions: bytes on the wire and CPU per response'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--depth', type=int, default=3, help='Levels of subcategories below the root category')
+    parser.add_argument('--fanout', type=int, default=4, help='Subcategories per category')
+    parser.add_argument('--page-size', type=int, default=100, help='Products per listing page')
+    parser.add_argument('--repeat', type=int, default=200, help='Renders and compressions timed per payload')
+    parser.add_argument('--endpoints', help=f'Comma separated subset of: {", ".join(DOCUMENT_ENDPOINTS)}')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+  def handle(self, *args, **options):
+    names = options['endpoints'].split(',') if options['endpoints'] else DOCUMENT_ENDPOINTS
+    unknown = set(names) - set(DOCUMENT_ENDPOINTS)
+    if unknown:
+      raise CommandError(f'Unknown endpoints: {", ".join(sorted(unknown))}')
+
+    engines = {'json': renderers.stdlib_dumps}
+    if renderers.orjson is not None:
+      engines['orjson'] = renderers.dumps
+    report = {'renderers': list(engines), 'codings': list(compression.CODECS), 'endpoints': {}}
+
+    with benchmark_database():
+      ids = seed_catalog(options['products'], options['depth'], options['fanout'], 3, options['seed'])
+      client = Client()
+      for name in names:
+        url = ENDPOINTS[name].format(**ids)
+        url += ('&' if '?' in url else '?') + f'page_size={options["page_size"]}'
+        response = client.get(url)
+        if response.status_code != 200:
+          raise CommandError(f'{name}: GET {url} answered {response.status_code}')
+        # DRF responses keep their data; the async views only have their body
+        data = response.data if hasattr(response, 'data') else json.loads(response.content)
+        report['endpoints'][name] = self.measure(data, engines, options['repeat'])
+
+    output = json.dumps(report, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as file:
+        file.write(output)
+    else:
+      self.stdout.write(output)
+
+  def measure(self, data, engines, repeat):
+    result = {'render': {}, 'compress': {}}
+    for engine, dumps in engines.items():
+      cpu, content = cpu_ms(lambda: dumps(data), repeat)
+      result['render'][engine] = {'bytes': len(content), 'cpu_ms': round(cpu, 4)}
+    result['compress']['identity'] = {'bytes': len(content), 'cpu_ms': 0, 'ratio': 1}
+    for coding in compression.CODECS:
+      cpu, compressed = cpu_ms(lambda: compression.compress(coding, content), repeat)
+      result['compress'][coding] = {
+        'bytes': len(compressed), 'cpu_ms': round(cpu, 4), 'ratio': round(len(content) / len(compressed), 2),
+      }
+    return result
@@ -0,0 +1,114 @@
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.db.models import Sum
+from product_management import inventory
+from product_management.benchmarks import benchmark_database, seed_products
+from product_management.models import Product, ReservationItem, ReservationStatus
+
+
+class Command(BaseCommand):
+  help = 'Stress stock reservations from many threads and check that no product is oversold'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--products', type=int, default=20, help='Few products keep contention high')
+    parser.add_argument('--stock', type=int, default=500, help='Initial quantity of every product')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--reservations', type=int, default=5000, help='Reservations attempted in total')
+    parser.add_argument('--max-items', type=int, default=3, help='Products per reservation')
+    parser.add_argument('--release-ratio', type=float, default=0.3, help='Share of reservations released instead of committed')
+    parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+  def handle(self, *args, **options):
+    # Threads need a database they can all write to
+    test_name = None
+    if connection.vendor == 'sqlite':
+      test_name = os.path.join(tempfile.mkdtemp(), 'bench_reservations.sqlite3')
+    with benchmark_database(test_name=test_name):
+      seed_products(options['products'], categories=1)
+      Product.objects.update(quantity=options['stock'])
+      product_ids = list(Product.objects.values_list('id', flat=True))
+      report = self.stress(product_ids, options)
+      report.update(self.audit(product_ids, options['stock']))
+    if report['oversold']:
+      raise CommandError(json.dumps(report, indent=2))
+
+    output = json.dumps(report, indent=2)
+    if options['output']:
+      with open(options['output'], 'w') as file:
+        file.write(output)
+    else:
+      self.stdout.write(output)
+
+  def stress(self, product_ids, options):
+    counts = {'reserved': 0, 'committed': 0, 'released': 0, 'conflicts': 0, 'retries': 0}
+    lock = threading.Lock()
+    per_thread = options['reservations'] // options['threads']
+
+    def worker(seed):
+      rng = random.Random(seed)
+      local = dict.fromkeys(counts, 0)
+      try:
+        for _ in range(per_thread):
+          items = [
+            (product_id, rng.randint(1, 3))
+            for product_id in rng.sample(product_ids, rng.randint(1, options['max_items']))
+          ]
+          while True:
+            try:
+              reservation = inventory.reserve(items)
+              break
+            except inventory.InsufficientStock:
+              reservation = None
+              break
+            except OperationalError:
+              # SQLite allows a single writer and reports "database is locked"
+              local['retries'] += 1
+          if reservation is None:
+            local['conflicts'] += 1
+            continue
+          local['reserved'] += 1
+          if rng.random() < options['release_ratio']:
+            inventory.release(reservation.id)
+            local['released'] += 1
+          else:
+            inventory.commit(reservation.id)
+            local['committed'] += 1
+      finally:
+        connections.close_all()
+        with lock:
+          for key, value in local.items():
+            counts[key] += value
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(options['threads'])]
+    started = time.perf_counter()
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+      'threads': options['threads'],
+      'seconds': round(elapsed, 2),
+      'reservations_per_second': round((counts['reserved'] + counts['conflicts']) / elapsed, 1),
+      **counts,
+    }
+
+  def audit(self, product_ids, stock):
+    """Every unit missing from stock must belong to a committed reservation"""
+    sold = dict(
+      ReservationItem.objects.filter(reservation__status=ReservationStatus.COMMITTED)
+      .values_list('product').annotate(total=Sum('quantity'))
+    )
+    products = Product.objects.filter(id__in=product_ids).values_list('id', 'quantity', 'status')
+    oversold = [pk for pk, quantity, _ in products if quantity < 0 or quantity + sold.get(pk, 0) != stock]
+    return {
+      'units_sold': sum(sold.values()),
+      'out_of_stock': sum(1 for _, quantity, status in products if quantity == 0 and status == 'out-of-stock'),
+      'oversold': oversold,
+    }
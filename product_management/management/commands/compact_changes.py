@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from product_management.changes import compact
+
+
+class Command(BaseCommand):
+  help = 'Drop change feed entries superseded by a later change of the same object'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=10000, help='Sequence numbers compacted per transaction')
+    parser.add_argument('--interval', type=float, help='Keep running, compacting every INTERVAL seconds')
+
+  def handle(self, *args, **options):
+    while True:
+      started = time.monotonic()
+      deleted = compact(batch_size=options['batch_size'])
+      self.stdout.write(f'Dropped {deleted} superseded changes in {time.monotonic() - started:.2f}s')
+      if not options['interval']:
+        return
+      time.sleep(options['interval'])
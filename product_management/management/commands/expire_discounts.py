@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from product_management.expiry import expire_discounts
+
+
+class Command(BaseCommand):
+  help = 'Deactivate discounts past their expiry date and reprice the affected products'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=1000, help='Discounts expired per transaction')
+    parser.add_argument('--interval', type=float, help='Keep running, sweeping every INTERVAL seconds')
+
+  def handle(self, *args, **options):
+    while True:
+      started = time.monotonic()
+      expired = expire_discounts(batch_size=options['batch_size'])
+      self.stdout.write(f'Expired {expired} discounts in {time.monotonic() - started:.2f}s')
+      if not options['interval']:
+        return
+      time.sleep(options['interval'])
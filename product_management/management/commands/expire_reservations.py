@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from product_management.inventory import expire_reservations
+
+
+class Command(BaseCommand):
+  help = 'Release stock reservations past their TTL, putting their stock back'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=1000, help='Reservations read per query')
+    parser.add_argument('--interval', type=float, help='Keep running, sweeping every INTERVAL seconds')
+
+  def handle(self, *args, **options):
+    while True:
+      started = time.monotonic()
+      expired = expire_reservations(batch_size=options['batch_size'])
+      self.stdout.write(f'Released {expired} expired reservations in {time.monotonic() - started:.2f}s')
+      if not options['interval']:
+        return
+      time.sleep(options['interval'])
@@ -0,0 +1,316 @@
+import csv
+import json
+import os
+import time
+from decimal import Decimal, InvalidOperation
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from product_management import caching, changes, rollups
+from product_management.models import Category, ChangeAction, Discount, DiscountStatus, DiscountType, Product, path_segment
+from product_management.signals import products_bulk_changed
+
+SECTIONS = ('categories', 'products', 'discounts')
+
+
+def read_records(path, offset=0):
+  """Stream `(record, offset after record)` pairs from a CSV or NDJSON file
+
+  Offsets are byte positions, so an import can seek straight back to where a
+  checkpoint left off instead of re-reading the file from the start.
+  """
+  with open(path, 'rb') as file:
+    def lines():
+      for line in iter(file.readline, b''):
+        yield line.decode('utf-8')
+
+    if path.endswith('.csv'):
+      header = next(csv.reader(lines()), None)
+      if header is None:
+        return
+      if offset:
+        file.seek(offset)
+      for row in csv.reader(lines()):
+        if row:
+          yield dict(zip(header, row)), file.tell()
+    else:
+      file.seek(offset)
+      for line in lines():
+        if line.strip():
+          yield json.loads(line), file.tell()
+
+
+def chunked(records, size):
+  chunk = []
+  for record in records:
+    chunk.append(record)
+    if len(chunk) >= size:
+      yield chunk
+      chunk = []
+  if chunk:
+    yield chunk
+
+
+class Command(BaseCommand):
+  help = 'Stream categories, products and discounts from CSV/NDJSON files into the catalog'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--categories', help='File of categories: title, description, parent (title)')
+    parser.add_argument('--products', help='File of products: sku, name, description, price, quantity, status, category (title)')
+    parser.add_argument('--discounts', help='File of discounts: product (sku), discount_type, value, status, expires_at')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Rows upserted per transaction')
+    parser.add_argument('--checkpoint', help='Progress file to resume an interrupted import from')
+
+  def handle(self, *args, **options):
+    self.chunk_size = options['chunk_size']
+    self.checkpoint_path = options['checkpoint']
+    self.checkpoint = self.load_checkpoint()
+    self.errors = 0
+
+    for section in SECTIONS:
+      path = options[section]
+      if not path:
+        continue
+      if not os.path.exists(path):
+        raise CommandError(f'File not found: {path}')
+      self.import_section(section, path)
+
+    self.stdout.write(self.style.SUCCESS(f'Import finished with {self.errors} rejected rows'))
+
+  # Checkpoints
+
+  def load_checkpoint(self):
+    if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+      with open(self.checkpoint_path) as file:
+        return json.load(file)
+    return {}
+
+  def save_checkpoint(self):
+    if not self.checkpoint_path:
+      return
+    # Write to a temporary file first so a crash never leaves a torn checkpoint
+    temporary = f'{self.checkpoint_path}.tmp'
+    with open(temporary, 'w') as file:
+      json.dump(self.checkpoint, file)
+    os.replace(temporary, self.checkpoint_path)
+
+  # Sections
+
+  def import_section(self, section, path):
+    state = self.checkpoint.setdefault(section, {'file': path, 'offset': 0, 'rows': 0, 'done': False})
+    if state['file'] != path:
+      raise CommandError(f'Checkpoint was recorded for {state["file"]}, not {path}')
+    if state['done']:
+      self.stdout.write(f'{section}: already imported, skipping')
+      return
+
+    upsert = getattr(self, f'upsert_{section}')
+    started, imported = time.monotonic(), 0
+    for chunk in chunked(read_records(path, state['offset']), self.chunk_size):
+      with transaction.atomic():
+        upsert([record for record, _ in chunk])
+      imported += len(chunk)
+      state['rows'] += len(chunk)
+      state['offset'] = chunk[-1][1]
+      self.save_checkpoint()
+      self.report(section, imported, started)
+
+    if section == 'categories':
+      self.flush_orphans(state)
+    state['done'] = True
+    self.save_checkpoint()
+    self.report(section, imported, started)
+
+  def report(self, section, imported, started):
+    elapsed = max(time.monotonic() - started, 1e-9)
+    self.stdout.write(f'{section}: {imported} rows ({imported / elapsed:.0f} rows/s)')
+
+  def reject(self, section, record, reason):
+    self.errors += 1
+    self.stderr.write(f'{section}: rejected {record!r}: {reason}')
+
+  # Categories
+
+  def upsert_categories(self, records):
+    """Insert categories level by level so parents always exist before children
+
+    Rows whose parent hasn't been seen yet are parked in the checkpoint and
+    retried with the next chunks.
+    """
+    state = self.checkpoint['categories']
+    pending = state.get('pending', []) + [record for record in records if record.get('title')]
+    known = self.known_categories({record.get('parent') for record in pending if record.get('parent')})
+
+    while pending:
+      ready = [record for record in pending if not record.get('parent') or record['parent'] in known]
+      if not ready:
+        break
+      pending = [record for record in pending if record.get('parent') and record['parent'] not in known]
+      known.update(self.write_categories(ready, known))
+    state['pending'] = pending
+    caching.invalidate_catalog()
+
+  def known_categories(self, titles):
+    return {
+      title: (pk, path)
+      for title, pk, path in Category.objects.filter(title__in=titles).values_list('title', 'id', 'path')
+    }
+
+  def write_categories(self, records, known):
+    records = list({record['title']: record for record in records}.values())
+    titles = [record['title'] for record in records]
+    previous = {
+      title: (parent_id, path)
+      for title, parent_id, path in Category.objects.filter(title__in=titles).values_list('title', 'parent_id', 'path')
+    }
+
+    Category.objects.bulk_create(
+      [
+        Category(
+          title=record['title'],
+          description=record.get('description') or '',
+          parent_id=known[record['parent']][0] if record.get('parent') else None,
+          slug=Category.make_slug(record['title']),
+        )
+        for record in records
+      ],
+      update_conflicts=True,
+      unique_fields=['title'],
+      update_fields=['description', 'parent', 'updated_at'],
+    )
+
+    written = {
+      category.title: category
+      for category in Category.objects.filter(title__in=titles).only('id', 'title', 'parent_id', 'path')
+    }
+    created = [category.pk for title, category in written.items() if title not in previous]
+    changes.record(Category, created, ChangeAction.CREATE)
+    rollups.ensure(created)
+    changes.record(Category, [category.pk for title, category in written.items() if title in previous], ChangeAction.UPDATE)
+    return self.write_paths(written, previous, known)
+
+  def write_paths(self, written, previous, known):
+    """Compute the materialized path of freshly written categories in bulk"""
+    parent_paths = {pk: path for pk, path in known.values()}
+    updated, moved = [], []
+    for title, category in written.items():
+      path = parent_paths.get(category.parent_id, '') + path_segment(category.pk)
+      if title in previous and previous[title][0] != category.parent_id and previous[title][1]:
+        # An existing category changed parent: rebase its subtree in one UPDATE
+        moved.append(category)
+      elif category.path != path:
+        category.path = path
+        updated.append(category)
+    Category.objects.bulk_update(updated, ['path'], batch_size=self.chunk_size)
+    for category in moved:
+      category.update_path()
+    return {title: (category.pk, category.path) for title, category in written.items()}
+
+  def flush_orphans(self, state):
+    for record in state.pop('pending', []):
+      self.reject('categories', record, f'unknown parent category {record["parent"]!r}')
+
+  # Products
+
+  def upsert_products(self, records):
+    categories = dict(
+      Category.objects.filter(title__in={record.get('category') for record in records}).values_list('title', 'id')
+    )
+    products = {}
+    for record in records:
+      product = self.build_product(record, categories)
+      if product is not None:
+        products[product.sku] = product
+
+    # Categories the products leave get recounted along with the new ones
+    left = Product.objects.filter(sku__in=products).order_by().values_list('category_id', flat=True).distinct()
+    category_ids = list(left)
+    Product.objects.bulk_create(
+      list(products.values()),
+      update_conflicts=True,
+      unique_fields=['sku'],
+      update_fields=['name', 'description', 'price', 'quantity', 'status', 'category', 'updated_at'],
+    )
+    product_ids = list(Product.objects.filter(sku__in=products).values_list('id', flat=True))
+    products_bulk_changed.send(sender=Product, product_ids=product_ids, action='upsert', category_ids=category_ids)
+
+  def build_product(self, record, categories):
+    if not record.get('sku'):
+      return self.reject('products', record, 'missing sku')
+    if record.get('category') not in categories:
+      return self.reject('products', record, f'unknown category {record.get("category")!r}')
+    product = Product(
+      sku=record['sku'],
+      name=record.get('name', ''),
+      description=record.get('description') or '',
+      price=record.get('price'),
+      quantity=record.get('quantity') or 0,
+      status=record.get('status') or Product._meta.get_field('status').default,
+      category_id=categories[record['category']],
+    )
+    try:
+      product.full_clean(exclude=['category'], validate_unique=False, validate_constraints=False)
+    except ValidationError as error:
+      return self.reject('products', record, error.message_dict)
+    return product
+
+  # Discounts
+
+  def upsert_discounts(self, records):
+    """Update discounts matching (product, type, value), create the others"""
+    products = dict(
+      Product.objects.filter(sku__in={record.get('product') for record in records}).values_list('sku', 'id')
+    )
+    existing = {
+      (discount.product_id, discount.discount_type, discount.value): discount
+      for discount in Discount.objects.filter(product_id__in=products.values())
+    }
+
+    created, updated = {}, {}
+    for record in records:
+      discount = self.build_discount(record, products)
+      if discount is None:
+        continue
+      key = (discount.product_id, discount.discount_type, discount.value)
+      if key in existing:
+        current = existing[key]
+        current.status, current.expires_at = discount.status, discount.expires_at
+        updated[current.pk] = current
+      else:
+        created[key] = discount
+
+    Discount.objects.bulk_create(list(created.values()), batch_size=self.chunk_size)
+    Discount.objects.bulk_update(list(updated.values()), ['status', 'expires_at'], batch_size=self.chunk_size)
+    product_ids = {key[0] for key in created} | {discount.product_id for discount in updated.values()}
+    products_bulk_changed.send(
+      sender=Product, product_ids=list(product_ids), action='discounts', discount_ids=list(updated),
+      created_discount_ids=[discount.pk for discount in created.values() if discount.pk],
+    )
+
+  def build_discount(self, record, products):
+    if record.get('product') not in products:
+      return self.reject('discounts', record, f'unknown product {record.get("product")!r}')
+    if record.get('discount_type') not in DiscountType.values:
+      return self.reject('discounts', record, f'invalid discount_type {record.get("discount_type")!r}')
+    status = record.get('status') or DiscountStatus.ACTIVE
+    if status not in DiscountStatus.values:
+      return self.reject('discounts', record, f'invalid status {status!r}')
+    try:
+      value = Decimal(str(record.get('value'))).quantize(Decimal('0.01'))
+    except InvalidOperation:
+      value = None
+    if value is None or value < 0:
+      return self.reject('discounts', record, f'invalid value {record.get("value")!r}')
+    expires_at = record.get('expires_at') or None
+    if expires_at is not None:
+      expires_at = parse_datetime(expires_at)
+      if expires_at is None:
+        return self.reject('discounts', record, f'invalid expires_at {record["expires_at"]!r}')
+    return Discount(
+      product_id=products[record['product']],
+      discount_type=record['discount_type'],
+      value=value,
+      status=status,
+      expires_at=expires_at,
+    )
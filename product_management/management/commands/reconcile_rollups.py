@@ -0,0 +1,15 @@
+import time
+from django.core.management.base import BaseCommand
+from product_management.rollups import rebuild
+
+
+class Command(BaseCommand):
+  help = 'Recompute the per-category product counters from the products'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=1000, help='Counter rows written per INSERT')
+
+  def handle(self, *args, **options):
+    started = time.monotonic()
+    rows, corrected = rebuild(batch_size=options['batch_size'])
+    self.stdout.write(f'Reconciled {rows} categories, corrected {corrected}, in {time.monotonic() - started:.2f}s')
@@ -0,0 +1,278 @@
+"""Per-route request metrics exposed in the Prometheus text format
+
+`MetricsMiddleware` records the latency, SQL query count, database time and
+serialization time of a sample of requests into in-process histograms, keyed
+by HTTP method and URL route. `metrics_view` renders them for Prometheus to
+scrape. Each worker process keeps and exposes its own histograms.
+
+Queries are timed by a database execute wrapper installed on every
+connection, and serialization by `serialization_timer()`, around serializer
+`.data` and response rendering. Both only read a context variable on
+requests that aren't sampled, so `METRICS_SAMPLE_RATE` bounds the overhead.
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+# Sub-buckets per power of two: values are kept to within 1/64 (~1.6%)
+SUB_BUCKET_BITS = 7
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF_SUB_BUCKETS = SUB_BUCKETS // 2
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class Histogram:
+  """HDR-style log-linear histogram of non-negative integers
+
+  Values below `SUB_BUCKETS` are counted exactly; larger ones fall in one of
+  `HALF_SUB_BUCKETS` equal buckets per power of two, so the relative error
+  is bounded whatever the range, and recording is one dict increment.
+  """
+
+  def __init__(self):
+    self.counts = {}
+    self.count = 0
+    self.total = 0
+    self.min = None
+    self.max = None
+
+  @staticmethod
+  def index(value):
+    if value < SUB_BUCKETS:
+      return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKETS + (shift - 1) * HALF_SUB_BUCKETS + (value >> shift) - HALF_SUB_BUCKETS
+
+  @staticmethod
+  def upper_bound(index):
+    """Highest value counted in bucket `index`"""
+    if index < SUB_BUCKETS:
+      return index
+    shift, offset = divmod(index - SUB_BUCKETS, HALF_SUB_BUCKETS)
+    shift += 1
+    return ((offset + HALF_SUB_BUCKETS + 1) << shift) - 1
+
+  def record(self, value):
+    value = max(int(value), 0)
+    index = self.index(value)
+    self.counts[index] = self.counts.get(index, 0) + 1
+    self.count += 1
+    self.total += value
+    self.min = value if self.min is None else min(self.min, value)
+    self.max = value if self.max is None else max(self.max, value)
+
+  def quantile(self, fraction):
+    """Value at or above `fraction` of the recorded values, within the bucket error"""
+    if not self.count:
+      return None
+    rank = max(1, int(fraction * self.count + 0.5))
+    seen = 0
+    for index in sorted(self.counts):
+      seen += self.counts[index]
+      if seen >= rank:
+        return max(self.min, min(self.upper_bound(index), self.max))
+    return self.max
+
+
+class RouteMetrics:
+  def __init__(self):
+    # Times in microseconds
+    self.latency = Histogram()
+    self.db_time = Histogram()
+    self.serialization = Histogram()
+    self.queries = Histogram()
+    self.responses = {}
+
+
+class Sample:
+  """What one sampled request spent, filled in while it runs"""
+
+  __slots__ = ('queries', 'db_time', 'serialization', 'serializing')
+
+  def __init__(self):
+    self.queries = 0
+    self.db_time = 0.0
+    self.serialization = 0.0
+    self.serializing = 0
+
+
+_current = ContextVar('request_metrics_sample', default=None)
+_lock = threading.Lock()
+_routes = {}
+_collectors = []
+
+
+def record(method, route, status_code, latency, sample):
+  with _lock:
+    metrics = _routes.get((method, route))
+    if metrics is None:
+      metrics = _routes[(method, route)] = RouteMetrics()
+    metrics.latency.record(latency * 1e6)
+    metrics.db_time.record(sample.db_time * 1e6)
+    metrics.serialization.record(sample.serialization * 1e6)
+    metrics.queries.record(sample.queries)
+    metrics.responses[status_code] = metrics.responses.get(status_code, 0) + 1
+
+
+def register(collector):
+  """Add a callable returning more exposition lines to `render()`"""
+  _collectors.append(collector)
+
+
+def reset():
+  with _lock:
+    _routes.clear()
+
+
+def time_query(execute, sql, params, many, context):
+  sample = _current.get()
+  if sample is None:
+    return execute(sql, params, many, context)
+  started = time.perf_counter()
+  try:
+    return execute(sql, params, many, context)
+  finally:
+    sample.db_time += time.perf_counter() - started
+    sample.queries += 1
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+  if time_query not in connection.execute_wrappers:
+    connection.execute_wrappers.append(time_query)
+
+
+@contextmanager
+def serialization_timer():
+  """Count the time spent in the block as serialization, nested blocks once"""
+  sample = _current.get()
+  if sample is None or sample.serializing:
+    yield
+    return
+  sample.serializing += 1
+  started = time.perf_counter()
+  try:
+    yield
+  finally:
+    sample.serialization += time.perf_counter() - started
+    sample.serializing -= 1
+
+
+class TimedDataMixin:
+  """Serializer mixin counting the time spent building `.data` as serialization"""
+
+  @property
+  def data(self):
+    with serialization_timer():
+      return super().data
+
+
+def route_of(request):
+  match = getattr(request, 'resolver_match', None)
+  return '/' + match.route if match is not None else 'unmatched'
+
+
+class MetricsMiddleware:
+  """Record latency, queries, database and serialization time per route"""
+
+  sync_capable = True
+  async_capable = True
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+    self.async_mode = iscoroutinefunction(get_response)
+    if self.async_mode:
+      markcoroutinefunction(self)
+
+  def sampled(self):
+    rate = settings.METRICS_SAMPLE_RATE
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+  def __call__(self, request):
+    if self.async_mode:
+      return self.__acall__(request)
+    if not self.sampled():
+      return self.get_response(request)
+    sample, token, started = self.start()
+    try:
+      response = self.get_response(request)
+    finally:
+      _current.reset(token)
+    self.finish(request, response, sample, started)
+    return response
+
+  async def __acall__(self, request):
+    if not self.sampled():
+      return await self.get_response(request)
+    sample, token, started = self.start()
+    try:
+      response = await self.get_response(request)
+    finally:
+      _current.reset(token)
+    self.finish(request, response, sample, started)
+    return response
+
+  def start(self):
+    sample = Sample()
+    return sample, _current.set(sample), time.perf_counter()
+
+  def finish(self, request, response, sample, started):
+    record(request.method, route_of(request), response.status_code, time.perf_counter() - started, sample)
+
+  def process_template_response(self, request, response):
+    # DRF responses are rendered right after this hook returns
+    sample = _current.get()
+    if sample is not None:
+      started = time.perf_counter()
+
+      def rendered(response):
+        sample.serialization += time.perf_counter() - started
+
+      response.add_post_render_callback(rendered)
+    return response
+
+
+def escape(value):
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def render():
+  """All recorded metrics in the Prometheus text exposition format"""
+  with _lock:
+    routes = sorted(_routes.items())
+    summaries = [
+      ('http_request_duration_seconds', 'Request latency', 'latency', 1e-6),
+      ('http_request_db_seconds', 'Time spent in SQL queries per request', 'db_time', 1e-6),
+      ('http_request_serialization_seconds', 'Time spent serializing and rendering per request', 'serialization', 1e-6),
+      ('http_request_queries', 'SQL queries per request', 'queries', 1),
+    ]
+    lines = []
+    for name, description, attribute, scale in summaries:
+      lines += [f'# HELP {name} {description}.', f'# TYPE {name} summary']
+      for (method, route), metrics in routes:
+        histogram = getattr(metrics, attribute)
+        labels = f'method="{escape(method)}",route="{escape(route)}"'
+        for fraction in QUANTILES:
+          lines.append(f'{name}{{{labels},quantile="{fraction}"}} {histogram.quantile(fraction) * scale:g}')
+        lines.append(f'{name}_sum{{{labels}}} {histogram.total * scale:g}')
+        lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+
+    lines += ['# HELP http_responses_total Sampled responses by status code.', '# TYPE http_responses_total counter']
+    for (method, route), metrics in routes:
+      for status_code, count in sorted(metrics.responses.items()):
+        lines.append(f'http_responses_total{{method="{escape(method)}",route="{escape(route)}",status="{status_code}"}} {count}')
+  for collector in _collectors:
+    lines += collector()
+  return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+  return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,40 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:27
+
+from django.db import migrations, models
+
+
+PATH_STEP = 10
+
+
+def populate_paths(apps, schema_editor):
+    Category = apps.get_model('product_management', 'Category')
+    children = {}
+    for pk, parent_id in Category.objects.values_list('pk', 'parent_id'):
+        children.setdefault(parent_id, []).append(pk)
+
+    # Walk the forest from the roots down so a parent path is known before its children
+    paths = {}
+    queue = [(pk, '') for pk in children.get(None, [])]
+    while queue:
+        pk, parent_path = queue.pop()
+        paths[pk] = parent_path + str(pk).zfill(PATH_STEP)
+        queue.extend((child, paths[pk]) for child in children.get(pk, []))
+
+    categories = [Category(pk=pk, path=path) for pk, path in paths.items()]
+    Category.objects.bulk_update(categories, ['path'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_management', '0004_alter_product_price_alter_product_quantity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(populate_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:05
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def populate_effective_prices(apps, schema_editor):
+    Product = apps.get_model('product_management', 'Product')
+    Discount = apps.get_model('product_management', 'Discount')
+
+    discounts = {}
+    for discount in Discount.objects.filter(status='active').order_by('id'):
+        discounts.setdefault(discount.product_id, []).append(discount)
+
+    def amount(discount, price):
+        if discount.discount_type == 'percentage':
+            return float(price) * float(discount.value) / 100
+        elif discount.discount_type == 'fixed':
+            return discount.value
+        return Decimal(0)
+
+    products = []
+    for product in Product.objects.only('id', 'price').iterator():
+        best = max(discounts.get(product.id, []), key=lambda discount: amount(discount, product.price), default=None)
+        product.best_discount = best
+        if best is None:
+            product.effective_price = round(product.price, 2)
+        elif best.discount_type == 'fixed':
+            product.effective_price = product.price - best.value
+        else:
+            product.effective_price = product.price - product.price * (best.value / Decimal(100))
+        products.append(product)
+    Product.objects.bulk_update(products, ['effective_price', 'best_discount'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_management', '0007_product_sku'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='best_discount',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='product_management.discount'),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=6, default=0, editable=False, max_digits=16),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_effective_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='product_price_id_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_management', '0008_product_effective_price'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='discount',
+            index=models.Index(fields=['status', 'expires_at'], name='discount_status_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.1.4 on 2026-10-18 20:54
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.db.utils import OperationalError
+
+
+def create_fts_table(apps, schema_editor):
+    """Create and fill the FTS5 index on SQLite builds that ship FTS5"""
+    connection = schema_editor.connection
+    if connection.vendor != 'sqlite':
+        return
+    try:
+        with transaction.atomic(using=connection.alias):
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE product_search USING fts5("
+                "name, description, tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+            )
+    except OperationalError:
+        # No FTS5 in this SQLite build: search uses the token index instead
+        return
+    schema_editor.execute(
+        'INSERT INTO product_search (rowid, name, description) '
+        'SELECT id, name, description FROM product_management_product'
+    )
+
+
+def drop_fts_table(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute('DROP TABLE IF EXISTS product_search')
+
+
+def populate_search_tokens(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite' and 'product_search' in schema_editor.connection.introspection.table_names():
+        return
+    from product_management.search import document_tokens
+
+    Product = apps.get_model('product_management', 'Product')
+    ProductSearchToken = apps.get_model('product_management', 'ProductSearchToken')
+    tokens = []
+    for pk, name, description in Product.objects.values_list('id', 'name', 'description').iterator():
+        tokens.extend(
+            ProductSearchToken(product_id=pk, token=token, weight=weight)
+            for token, weight in document_tokens(name, description).items()
+        )
+        if len(tokens) >= 1000:
+            ProductSearchToken.objects.bulk_create(tokens)
+            tokens = []
+    ProductSearchToken.objects.bulk_create(tokens)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_management', '0009_discount_expiry_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=64)),
+                ('weight', models.PositiveIntegerField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='product_management.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'product'], name='product_search_token_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'token'), name='product_search_token_unique')],
+            },
+        ),
+        migrations.RunPython(create_fts_table, drop_fts_table),
+        migrations.RunPython(populate_search_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.1.4 on 2026-10-18 21:23
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, F, Q, Sum
+
+
+PATH_STEP = 10
+COUNTERS = ('product_count', 'active_count', 'out_of_stock_count', 'stock_value')
+
+
+def populate_rollups(apps, schema_editor):
+    """Count the existing catalog, as `rollups.rebuild()` does"""
+    Category = apps.get_model('product_management', 'Category')
+    CategoryRollup = apps.get_model('product_management', 'CategoryRollup')
+    Product = apps.get_model('product_management', 'Product')
+
+    own = {
+        category_id: counters
+        for category_id, *counters in Product.objects.order_by().values('category_id').annotate(
+            products=Count('id'),
+            active=Count('id', filter=Q(status='active')),
+            out_of_stock=Count('id', filter=Q(status='out-of-stock')),
+            value=Sum(F('price') * F('quantity'), output_field=models.DecimalField(max_digits=20, decimal_places=2)),
+        ).values_list('category_id', 'products', 'active', 'out_of_stock', 'value')
+    }
+    paths = dict(Category.objects.values_list('id', 'path'))
+    subtree = {category_id: [0, 0, 0, Decimal(0)] for category_id in paths}
+    for category_id, path in paths.items():
+        counters = own.get(category_id)
+        if counters is None:
+            continue
+        for start in range(0, len(path), PATH_STEP):
+            totals = subtree.get(int(path[start:start + PATH_STEP]))
+            if totals is not None:
+                for index, value in enumerate(counters):
+                    totals[index] += value or 0
+
+    rows = []
+    for category_id in paths:
+        counters = own.get(category_id, [0, 0, 0, 0])
+        rows.append(CategoryRollup(
+            category_id=category_id,
+            **dict(zip(COUNTERS, subtree[category_id])),
+            **{f'own_{name}': value or 0 for name, value in zip(COUNTERS, counters)},
+        ))
+    CategoryRollup.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_management', '0013_change_log'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryRollup',
+            fields=[
+                ('category', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='rollup', serialize=False, to='product_management.category')),
+                ('product_count', models.IntegerField(default=0)),
+                ('active_count', models.IntegerField(default=0)),
+                ('out_of_stock_count', models.IntegerField(default=0)),
+                ('stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('own_product_count', models.IntegerField(default=0)),
+                ('own_active_count', models.IntegerField(default=0)),
+                ('own_out_of_stock_count', models.IntegerField(default=0)),
+                ('own_stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=20)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,55 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Value
+from django.db.models.functions import Concat, Length, Substr
 from django.utils.text import slugify
+from rest_framework.utils.encoders import JSONEncoder
 from django.core.validators import MinValueValidator
-from time import timezone
+from django.utils import timezone
 from decimal import Decimal
 
+# Each ancestor contributes a fixed-width, zero padded id segment to
+# `Category.path`, so the descendants of a node are exactly the rows whose path
+# falls in a contiguous range that a plain B-tree index can serve
+PATH_STEP = 10
+
+
+def path_segment(pk):
+  return str(pk).zfill(PATH_STEP)
+
+
+def path_range(path):
+  """Return the [lower, upper) bounds enclosing `path` and all of its descendants"""
+  upper = str(int(path) + 1).zfill(len(path))
+  return path, upper
+
+
+class CategoryQuerySet(models.QuerySet):
+  def descendants_of(self, category, include_self=True):
+    """Return the categories below `category` using a single indexed range query"""
+    lower, upper = path_range(category.path)
+    queryset = self.filter(path__gte=lower, path__lt=upper)
+    if not include_self:
+      queryset = queryset.exclude(pk=category.pk)
+    return queryset
+
+  def subtree(self, category, depth=None):
+    """Return a category and its descendants, optionally limited to `depth` levels"""
+    queryset = self.descendants_of(category)
+    if depth is not None:
+      queryset = queryset.annotate(path_length=Length('path')).filter(
+        path_length__lte=len(category.path) + depth * PATH_STEP
+      )
+    return queryset
+
+
+def category_children(categories):
+  """Group already fetched categories by their parent id in a single pass"""
+  children = {}
+  for category in categories:
+    children.setdefault(category.parent_id, []).append(category)
+  return children
+
+
 class Category(models.Model):
   """Represents a category in the ecommerce system"""
 
@@ -11,17 +57,75 @@ class Category(models.Model):
   description = models.TextField(blank=True)
   parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.SET_NULL, related_name='subcategories')
   slug = models.SlugField(max_length=100, unique=True, blank=True)
+  # Materialized path of ancestor ids, see `PATH_STEP`
+  path = models.CharField(max_length=255, db_index=True, blank=True, editable=False)
   created_at = models.DateTimeField(auto_now_add=True)
   updated_at = models.DateTimeField(auto_now=True)
 
+  objects = CategoryQuerySet.as_manager()
 
   def __str__(self):
     return self.title
 
+  @staticmethod
+  def make_slug(title):
+    return slugify(title)[:100]
+
   def save(self, *args, **kwargs):
     if not self.slug:
-      self.slug = slugify(self.title)[:100]
-    super().save(*args, **kwargs)
+      self.slug = self.make_slug(self.title)
+    with transaction.atomic():
+      super().save(*args, **kwargs)
+      self.update_path()
+
+  def update_path(self):
+    """Recompute this category's path and rebase its whole subtree in one UPDATE"""
+    paths = dict(
+      Category.objects.filter(pk__in=[self.pk, self.parent_id]).values_list('pk', 'path')
+    )
+    old_path = paths.get(self.pk, '')
+    parent_path = paths.get(self.parent_id, '') if self.parent_id else ''
+
+    if old_path and parent_path.startswith(old_path):
+      raise ValueError('A category cannot be moved under one of its own subcategories.')
+
+    new_path = parent_path + path_segment(self.pk)
+    if new_path == old_path:
+      self.path = new_path
+      return
+
+    if old_path:
+      from .signals import category_moved
+
+      # Reparenting: swap the old prefix for the new one across the subtree
+      self.path = old_path
+      Category.objects.descendants_of(self).update(
+        path=Concat(Value(new_path), Substr('path', len(old_path) + 1), output_field=models.CharField())
+      )
+      category_moved.send(sender=Category, category=self, old_path=old_path, new_path=new_path)
+    else:
+      Category.objects.filter(pk=self.pk).update(path=new_path)
+    self.path = new_path
+
+
+class CategoryRollup(models.Model):
+  """ Product counters of a category, kept up to date incrementally by `rollups.py` """
+
+  # Not cascading: category deletes settle the counters before removing the row
+  category = models.OneToOneField(
+    Category, primary_key=True, related_name='rollup', on_delete=models.DO_NOTHING, db_constraint=False
+  )
+  # Products in the category and all of its descendants
+  product_count = models.IntegerField(default=0)
+  active_count = models.IntegerField(default=0)
+  out_of_stock_count = models.IntegerField(default=0)
+  stock_value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+  # Products directly in the category
+  own_product_count = models.IntegerField(default=0)
+  own_active_count = models.IntegerField(default=0)
+  own_out_of_stock_count = models.IntegerField(default=0)
+  own_stock_value = models.DecimalField(max_digits=20, decimal_places=2, default=0)
+  updated_at = models.DateTimeField(auto_now=True)
 
 
 # Define Status enum
@@ -30,10 +134,32 @@ class ProductStatus(models.TextChoices):
   INACTIVE = 'inactive', 'Inactive'
   OUT_OF_STOCK = 'out-of-stock', 'Out of Stock'
 
+class ProductQuerySet(models.QuerySet):
+  def with_active_discounts(self):
+    """Prefetch the active discounts of every product in one batched query"""
+    return self.prefetch_related(
+      models.Prefetch(
+        'discounts',
+        queryset=Discount.objects.filter(status=DiscountStatus.ACTIVE),
+        to_attr='active_discounts',
+      )
+    )
+
+  def bulk_create(self, objs, *args, **kwargs):
+    # New products have no discounts yet, so their effective price is their price
+    objs = list(objs)
+    for product in objs:
+      if product.effective_price is None:
+        product.effective_price = product.price
+    return super().bulk_create(objs, *args, **kwargs)
+
+
 class Product(models.Model):
   """Represents a product in the ecommerce system"""
 
   name = models.CharField(max_length=255)
+  # Optional natural key used to upsert products from catalog imports
+  sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
   description = models.TextField(blank=True)
   price = models.DecimalField(
     max_digits=10,
@@ -43,12 +169,43 @@ class Product(models.Model):
   quantity = models.IntegerField(validators=[MinValueValidator(0)], default=1)
   status = models.CharField(max_length=20, choices=ProductStatus.choices, default=ProductStatus.ACTIVE, db_index=True)
   category = models.ForeignKey(Category, on_delete=models.CASCADE, db_index=True)
+  # Denormalized price after the best active discount, kept up to date by
+  # `pricing.reprice_products` so listings can sort and filter on it in SQL
+  effective_price = models.DecimalField(max_digits=16, decimal_places=6, editable=False)
+  best_discount = models.ForeignKey(
+    'Discount', null=True, blank=True, on_delete=models.SET_NULL, related_name='+', editable=False
+  )
   created_at = models.DateTimeField(auto_now_add=True)
   updated_at = models.DateTimeField(auto_now=True)
 
+  objects = ProductQuerySet.as_manager()
+
+  class Meta:
+    # Back the keyset pagination orderings of `/api/products/`
+    indexes = [
+      models.Index(fields=['created_at', 'id'], name='product_created_id_idx'),
+      models.Index(fields=['category', 'id'], name='product_category_id_idx'),
+      models.Index(fields=['effective_price', 'id'], name='product_price_id_idx'),
+    ]
+
   def __str__(self):
     return self.name
 
+  def save(self, *args, **kwargs):
+    from .pricing import best_price
+
+    discounts = []
+    if self.pk is not None:
+      discounts = list(self.discounts.filter(status=DiscountStatus.ACTIVE))
+    self.effective_price, self.best_discount = best_price(self.price, discounts)
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'price' in update_fields:
+      # The effective price follows the price it was just computed from
+      kwargs['update_fields'] = {*update_fields, 'effective_price', 'best_discount'}
+    # One transaction with the change feed entry written on post_save
+    with transaction.atomic():
+      super().save(*args, **kwargs)
+
 
 # Define Discount type Enum
 class DiscountType(models.TextChoices):
@@ -70,9 +227,31 @@ class Discount(models.Model):
   created_at = models.DateTimeField(auto_now_add=True)
   updated_at = models.DateTimeField(auto_now=True)
   expires_at = models.DateTimeField(null=True, blank=True)
+  # The discount this one was copied from when a campaign applied it to many
+  # products at once, see `campaigns.py`
+  template = models.ForeignKey('self', null=True, blank=True, related_name='copies', on_delete=models.CASCADE)
+
+  class Meta:
+    # Lets the expiry sweeper find active discounts past their expiry with a range scan
+    indexes = [
+      models.Index(fields=['status', 'expires_at'], name='discount_status_expiry_idx'),
+    ]
 
   def __str__(self):
     return f'{self.get_discount_type_display()} - {self.value}'
+
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super().from_db(db, field_names, values)
+    # Remember the product a loaded discount belonged to, so moving it to
+    # another product can reprice and invalidate both of them
+    instance.loaded_product_id = instance.__dict__.get('product_id')
+    return instance
+
+  def save(self, *args, **kwargs):
+    # One transaction with the repricing and change feed entries of post_save
+    with transaction.atomic():
+      super().save(*args, **kwargs)
   
   def apply_discount(self, price: Decimal) -> Decimal:
     """Apply the discount to a given price of a product"""
@@ -96,7 +275,108 @@ class Discount(models.Model):
     """ Check if discount hasn't expired or is inactive"""
     if self.status != DiscountStatus.ACTIVE:
       return False
-    if self.expires_at and self.expires_at >= timezone.now():
+    if self.expires_at and self.expires_at <= timezone.now():
       return False
     return True
-        
\ No newline at end of file
+        
+
+class ProductSearchToken(models.Model):
+  """ Portable inverted index entry: a word of a product's name or description
+
+  Backs product search on databases without SQLite FTS5, see `search.py`.
+  """
+
+  token = models.CharField(max_length=64)
+  product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+  # Occurrences of the token, with words of the name counting more
+  weight = models.PositiveIntegerField()
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['product', 'token'], name='product_search_token_unique'),
+    ]
+    indexes = [
+      # Prefix lookups (`token LIKE 'abc%'`) are range scans on this index
+      models.Index(fields=['token', 'product'], name='product_search_token_idx'),
+    ]
+
+
+class ReservationStatus(models.TextChoices):
+  PENDING = 'pending', 'Pending'
+  COMMITTED = 'committed', 'Committed'
+  RELEASED = 'released', 'Released'
+  EXPIRED = 'expired', 'Expired'
+
+
+class Reservation(models.Model):
+  """ Stock held for a checkout until it is committed, released or expires
+
+  The reserved quantities are taken off `Product.quantity` when the
+  reservation is made and given back if it is released or expires, see
+  `inventory.py`.
+  """
+
+  status = models.CharField(max_length=10, choices=ReservationStatus.choices, default=ReservationStatus.PENDING)
+  expires_at = models.DateTimeField()
+  created_at = models.DateTimeField(auto_now_add=True)
+  updated_at = models.DateTimeField(auto_now=True)
+
+  class Meta:
+    # Lets the expiry sweep find pending reservations past their TTL with a range scan
+    indexes = [
+      models.Index(fields=['status', 'expires_at'], name='reservation_status_expiry_idx'),
+    ]
+
+  def __str__(self):
+    return f'Reservation {self.pk} ({self.status})'
+
+
+class ReservationItem(models.Model):
+  reservation = models.ForeignKey(Reservation, related_name='items', on_delete=models.CASCADE)
+  product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+  quantity = models.PositiveIntegerField(validators=[MinValueValidator(1)])
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['reservation', 'product'], name='reservation_item_unique'),
+    ]
+
+
+class IdempotencyKey(models.Model):
+  """ Response of a write request, replayed when it is retried with the same key """
+
+  scope = models.CharField(max_length=100)
+  key = models.CharField(max_length=255)
+  # Digest of the request body, so a key can't be reused for another request
+  request_hash = models.CharField(max_length=64)
+  # Empty while the request that claimed the key is still running
+  status_code = models.PositiveSmallIntegerField(null=True)
+  response = models.JSONField(encoder=JSONEncoder, null=True)
+  created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(fields=['scope', 'key'], name='idempotency_key_unique'),
+    ]
+
+
+class ChangeAction(models.TextChoices):
+  CREATE = 'create', 'Create'
+  UPDATE = 'update', 'Update'
+  DELETE = 'delete', 'Delete'
+
+
+class ChangeLogEntry(models.Model):
+  """ One change of a catalog object, in the change feed; `id` is its sequence number """
+
+  # `_meta.model_name` of the changed model: category, product or discount
+  model = models.CharField(max_length=20)
+  object_id = models.BigIntegerField()
+  action = models.CharField(max_length=10, choices=ChangeAction.choices)
+  created_at = models.DateTimeField(auto_now_add=True)
+
+  class Meta:
+    # Lets compaction find later entries for the same object
+    indexes = [
+      models.Index(fields=['model', 'object_id', 'id'], name='change_object_idx'),
+    ]
@@ -0,0 +1,168 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+# Orderings accepted by `?ordering=` on product listings. Each one ends on the
+# primary key so it is total, and is backed by a composite index on `Product`
+PRODUCT_ORDERINGS = {
+  'created_at': ('created_at', 'id'),
+  '-created_at': ('-created_at', '-id'),
+  'category': ('category', 'id'),
+  '-category': ('-category', '-id'),
+  'effective_price': ('effective_price', 'id'),
+  '-effective_price': ('-effective_price', '-id'),
+}
+DEFAULT_PRODUCT_ORDERING = '-created_at'
+
+
+def get_product_ordering(request):
+  """Resolve the `ordering` query param to a tuple of order_by fields"""
+  params = getattr(request, 'query_params', request.GET)
+  ordering = params.get('ordering') or DEFAULT_PRODUCT_ORDERING
+  if ordering not in PRODUCT_ORDERINGS:
+    raise ValidationError({'ordering': f'Ordering must be one of: {", ".join(PRODUCT_ORDERINGS)}.'})
+  return PRODUCT_ORDERINGS[ordering]
+
+
+class KeysetPagination(BasePagination):
+  """Cursor pagination seeking on the full composite ordering of the queryset
+
+  Unlike DRF's `CursorPagination`, which keys on the first ordering field and
+  falls back to an offset for ties, the cursor here holds the value of every
+  ordering field. Each page is then a single `WHERE (a, b) > (x, y) LIMIT n`
+  index seek, with no `COUNT(*)` and no `OFFSET`, so deep pages cost the same
+  as the first one.
+  """
+
+  cursor_query_param = 'cursor'
+  page_size = 10
+  page_size_query_param = 'page_size'
+  max_page_size = 100
+  invalid_cursor_message = 'Invalid cursor'
+
+  def paginate_queryset(self, queryset, request, view=None):
+    self.request = request
+    self.base_url = request.build_absolute_uri()
+    self.ordering = list(queryset.query.order_by)
+    self.fields = [queryset.model._meta.get_field(field.lstrip('-')) for field in self.ordering]
+    page_size = self.get_page_size(request)
+
+    position, reverse = self.decode_cursor(request)
+    ordering = self.ordering
+    if reverse:
+      ordering = [self.invert(field) for field in ordering]
+      queryset = queryset.order_by(*ordering)
+
+    if position is not None:
+      queryset = queryset.filter(self.seek_filter(ordering, position))
+
+    results = list(queryset[:page_size + 1])
+    has_more = len(results) > page_size
+    results = results[:page_size]
+    if reverse:
+      results.reverse()
+
+    # Seeking backwards means there is a page after this one and vice versa
+    self.has_next = has_more if not reverse else position is not None
+    self.has_previous = position is not None if not reverse else has_more
+    self.page = results
+    return results
+
+  def get_page_size(self, request):
+    try:
+      page_size = int(request.query_params[self.page_size_query_param])
+      if page_size > 0:
+        return min(page_size, self.max_page_size)
+    except (KeyError, ValueError):
+      pass
+    return self.page_size
+
+  def invert(self, field):
+    return field[1:] if field.startswith('-') else f'-{field}'
+
+  def seek_filter(self, ordering, position):
+    """Build the row-value comparison `(a, b, ...) > (x, y, ...)` as a Q object"""
+    condition = Q()
+    for index in reversed(range(len(ordering))):
+      name = ordering[index].lstrip('-')
+      lookup = 'lt' if ordering[index].startswith('-') else 'gt'
+      step = Q(**{f'{name}__{lookup}': position[index]})
+      if index < len(ordering) - 1:
+        step |= Q(**{name: position[index]}) & condition
+      condition = step
+
+    # A redundant bound on the leading column lets the planner use an index
+    # range scan instead of evaluating the OR for every row
+    name = ordering[0].lstrip('-')
+    lookup = 'lte' if ordering[0].startswith('-') else 'gte'
+    return Q(**{f'{name}__{lookup}': position[0]}) & condition
+
+  def encode_cursor(self, instance, reverse=False):
+    values = [field.value_to_string(instance) for field in self.fields]
+    payload = json.dumps({'p': values, 'r': int(reverse)}, separators=(',', ':'))
+    cursor = urlsafe_b64encode(payload.encode()).decode()
+    return replace_query_param(self.base_url, self.cursor_query_param, cursor)
+
+  def decode_cursor(self, request):
+    cursor = request.query_params.get(self.cursor_query_param)
+    if not cursor:
+      return None, False
+    try:
+      payload = json.loads(urlsafe_b64decode(cursor.encode()))
+      values = payload['p']
+      if len(values) != len(self.fields):
+        raise ValueError
+      position = [field.to_python(value) for field, value in zip(self.fields, values)]
+      return position, bool(payload.get('r'))
+    except (TypeError, ValueError, KeyError, DjangoValidationError):
+      raise NotFound(self.invalid_cursor_message)
+
+  def get_next_link(self):
+    if not self.has_next or not self.page:
+      return None
+    return self.encode_cursor(self.page[-1])
+
+  def get_previous_link(self):
+    if not self.has_previous:
+      return None
+    if not self.page:
+      return remove_query_param(self.base_url, self.cursor_query_param)
+    return self.encode_cursor(self.page[0], reverse=True)
+
+  def get_paginated_response(self, data):
+    return Response({
+      'next': self.get_next_link(),
+      'previous': self.get_previous_link(),
+      'results': data,
+    })
+
+  def get_paginated_response_schema(self, schema):
+    return {
+      'type': 'object',
+      'required': ['results'],
+      'properties': {
+        'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+        'results': schema,
+      },
+    }
+
+
+class ProductPageNumberPagination(PageNumberPagination):
+  """Page number pagination honouring `page_size` like the keyset pagination"""
+
+  page_size_query_param = 'page_size'
+  max_page_size = KeysetPagination.max_page_size
+
+
+def get_product_paginator(request):
+  """Keyset pagination by default, page numbers when explicitly requested"""
+  params = request.query_params if request is not None else {}
+  if params.get('pagination') == 'page' or 'page' in params:
+    return ProductPageNumberPagination()
+  return KeysetPagination()
@@ -0,0 +1,258 @@
+"""Discount pricing shared by the serializers, exports and commands
+
+Products are priced many at once. Prices and discount values are whole cents,
+so what a discount takes off is an exact integer number of micro-units
+(1e-6): `p * v` for a percentage discount of `v` cents on a price of `p`
+cents, and `v * 10000` for a fixed one. `rank_discounts` picks the best
+discount of every product on those integers, read straight from the database
+and vectorized with NumPy when it is installed. Unlike float arithmetic, this
+agrees exactly with `Discount.apply_discount`.
+"""
+
+from decimal import Decimal
+from typing import Iterable, Optional, Sequence
+from django.db.models import BigIntegerField, F
+from django.db.models.functions import Cast, Round
+from .models import Discount, DiscountStatus, DiscountType, Product
+
+try:
+  import numpy as np
+except ImportError:  # pragma: no cover - numpy is optional
+  np = None
+
+ENGINE = 'numpy' if np is not None else 'python'
+
+# Micro-units per cent
+SCALE = 10_000
+INT64_MAX = 2 ** 63 - 1
+
+OTHER, PERCENTAGE, FIXED = 0, 1, 2
+KINDS = {DiscountType.PERCENTAGE: PERCENTAGE, DiscountType.FIXED: FIXED}
+
+
+def cents(field):
+  """Expression reading a two-decimal column as integer cents"""
+  return Cast(Round(F(field) * 100), BigIntegerField())
+
+
+def discount_amount(discount: Discount, price: Decimal):
+  """Amount a discount takes off `price`"""
+  if discount.discount_type == DiscountType.PERCENTAGE:
+    return price * Decimal(discount.value) / 100
+  elif discount.discount_type == DiscountType.FIXED:
+    return Decimal(discount.value)
+  return Decimal(0)
+
+
+def apply(price: Decimal, discount_type, value) -> Decimal:
+  """Same arithmetic as `Discount.apply_discount`, without building a Discount"""
+  if discount_type == DiscountType.FIXED:
+    return price - Decimal(value)
+  elif discount_type == DiscountType.PERCENTAGE:
+    return price - price * (Decimal(value) / Decimal(100))
+  return price
+
+
+def rank_discounts(prices: Sequence[int], owners: Sequence[int], kinds: Sequence[int], values: Sequence[int]):
+  """Best discount of every product, from flat arrays of integer cents
+
+  `prices` holds one price per product; `owners`, `kinds` and `values` hold
+  the product index, kind code and value of every discount. Returns the index
+  of each product's best discount (-1 without discounts) and the micro-units
+  it takes off. The first of equal discounts wins.
+  """
+  if np is not None and len(owners) and _fits_int64(prices, values):
+    return _rank_numpy(prices, owners, kinds, values)
+  return _rank_python(prices, owners, kinds, values)
+
+
+def _fits_int64(prices, values) -> bool:
+  largest_price = max(prices)
+  largest_value = max(max(values), -min(values))
+  return max(largest_price, largest_value) * SCALE < INT64_MAX and largest_price * largest_value < INT64_MAX
+
+
+def _rank_python(prices, owners, kinds, values):
+  best, taken = [-1] * len(prices), [0] * len(prices)
+  for position, (owner, kind, value) in enumerate(zip(owners, kinds, values)):
+    amount = prices[owner] * value if kind == PERCENTAGE else value * SCALE if kind == FIXED else 0
+    if best[owner] < 0 or amount > taken[owner]:
+      best[owner], taken[owner] = position, amount
+  return best, taken
+
+
+def _rank_numpy(prices, owners, kinds, values):
+  prices = np.asarray(prices, dtype=np.int64)
+  owners = np.asarray(owners, dtype=np.intp)
+  kinds = np.asarray(kinds, dtype=np.int8)
+  values = np.asarray(values, dtype=np.int64)
+
+  amounts = np.where(kinds == PERCENTAGE, prices[owners] * values, np.where(kinds == FIXED, values * SCALE, 0))
+  # Sort by product then by amount, descending; lexsort is stable so the first
+  # of equal discounts stays in front of its group
+  order = np.lexsort((-amounts, owners))
+  grouped = owners[order]
+  winners = order[np.flatnonzero(np.r_[True, grouped[1:] != grouped[:-1]])]
+
+  best = np.full(len(prices), -1, dtype=np.intp)
+  taken = np.zeros(len(prices), dtype=np.int64)
+  best[owners[winners]] = winners
+  taken[owners[winners]] = amounts[winners]
+  return best.tolist(), taken.tolist()
+
+
+def price_batch(prices: Sequence, discounts: Sequence[Sequence[tuple]]) -> list:
+  """Best-discount price of many products at once
+
+  `prices[i]` is the price of product `i` and `discounts[i]` the
+  `(discount_type, value)` pairs applying to it. Returns a `(price, best)`
+  pair per product, where `best` is the index of the winning pair in
+  `discounts[i]`, or None without discounts. The first discount wins ties.
+
+  With NumPy, the batch is ranked by `rank_discounts` on integer cents.
+  Without it, or for amounts that aren't whole cents, discounts are ranked on
+  the exact Decimal products `price * value` (hundredths of what a discount
+  takes off), which costs less than converting them for the Python engine.
+  Only the winner is applied, so prices keep the value and scale
+  `apply_discount` gives them.
+  """
+  ranked = _rank_cents(prices, discounts) if np is not None else None
+  winners = ranked if ranked is not None else _rank_decimals(prices, discounts)
+  return [
+    (round(price, 2), None) if best is None else (apply(price, *terms[best]), best)
+    for price, terms, best in zip(prices, discounts, winners)
+  ]
+
+
+def _whole_cents(amount):
+  """`amount` in integer cents, or None if it has a fraction of a cent"""
+  amount = amount * 100
+  return int(amount) if amount == int(amount) else None
+
+
+def _rank_cents(prices, discounts):
+  """Index of the best of each product's discounts, through `rank_discounts`"""
+  price_cents = [_whole_cents(price) for price in prices]
+  owners, kinds, values, offsets = [], [], [], []
+  for owner, terms in enumerate(discounts):
+    offsets.append(len(owners))
+    for kind, value in terms:
+      owners.append(owner)
+      kinds.append(KINDS.get(kind, OTHER))
+      values.append(_whole_cents(value))
+  if not owners:
+    return [None] * len(prices)
+  if None in price_cents or None in values:
+    return None
+  best, _ = rank_discounts(price_cents, owners, kinds, values)
+  return [position - offset if position >= 0 else None for position, offset in zip(best, offsets)]
+
+
+def _rank_decimals(prices, discounts):
+  winners = []
+  for price, terms in zip(prices, discounts):
+    best, most = None, None
+    for position, (kind, value) in enumerate(terms):
+      amount = price * value if kind == DiscountType.PERCENTAGE else value * 100 if kind == DiscountType.FIXED else 0
+      if best is None or amount > most:
+        best, most = position, amount
+    winners.append(best)
+  return winners
+
+
+def discount_terms(discounts: Iterable[Discount]) -> list:
+  return [(discount.discount_type, discount.value) for discount in discounts]
+
+
+def best_price(price: Decimal, discounts: Iterable[Discount]) -> tuple:
+  """`(price after the best of discounts, best discount)` for one product"""
+  discounts = list(discounts)
+  (price, best), = price_batch([price], [discount_terms(discounts)])
+  return price, discounts[best] if best is not None else None
+
+
+def best_discount(price: Decimal, discounts: Iterable[Discount]) -> Optional[Discount]:
+  """Pick the discount taking the most off `price`, the first one wins ties"""
+  return best_price(price, discounts)[1]
+
+
+def discounted_price(price: Decimal, discounts: Iterable[Discount]) -> Decimal:
+  """Price after applying the best of `discounts`"""
+  return best_price(price, discounts)[0]
+
+
+def price_products(products: Sequence[Product]) -> list:
+  """`(discounted price, best discount)` of products loaded with
+  `with_active_discounts()`, all priced in one batch"""
+  discounts = [product.active_discounts for product in products]
+  results = price_batch([product.price for product in products], [discount_terms(terms) for terms in discounts])
+  return [
+    (price, terms[best] if best is not None else None)
+    for (price, best), terms in zip(results, discounts)
+  ]
+
+
+def reprice(products) -> list:
+  """Refresh `effective_price` and `best_discount` of products loaded with
+  `with_active_discounts()`, returning the ones that changed"""
+  products = list(products)
+  changed = []
+  for product, (price, discount) in zip(products, price_products(products)):
+    if price != product.effective_price or getattr(discount, 'pk', None) != product.best_discount_id:
+      product.effective_price, product.best_discount = price, discount
+      changed.append(product)
+  return changed
+
+
+def reprice_products(product_ids, batch_size=500) -> list:
+  """Recompute the effective price of `product_ids`, returning the changed ids"""
+  changed = []
+  product_ids = list(set(product_ids))
+  for start in range(0, len(product_ids), batch_size):
+    products = (
+      Product.objects.with_active_discounts()
+      .filter(id__in=product_ids[start:start + batch_size])
+      .only('id', 'price', 'effective_price', 'best_discount')
+    )
+    updated = reprice(products)
+    Product.objects.bulk_update(updated, ['effective_price', 'best_discount'])
+    changed.extend(product.id for product in updated)
+  return changed
+
+
+def reprice_after(last_id: int, batch_size: int) -> tuple:
+  """Reprice the next `batch_size` products by id after `last_id`
+
+  Prices and discount values are read from the database as integer cents and
+  ranked as arrays, so no model instance or Decimal is built except for the
+  products whose effective price changed. Returns the ids of the products
+  read and of the ones that changed.
+  """
+  rows = list(
+    Product.objects.filter(id__gt=last_id).order_by('id')
+    .values_list('id', cents('price'), 'effective_price', 'best_discount_id')[:batch_size]
+  )
+  if not rows:
+    return [], []
+  positions = {row[0]: position for position, row in enumerate(rows)}
+  discounts = (
+    Discount.objects.filter(status=DiscountStatus.ACTIVE, product_id__gte=rows[0][0], product_id__lte=rows[-1][0])
+    .order_by('product_id', 'id')
+    .values_list('product_id', 'id', 'discount_type', cents('value'))
+  )
+  discount_ids, owners, kinds, values = [], [], [], []
+  for product_id, discount_id, kind, value in discounts:
+    discount_ids.append(discount_id)
+    owners.append(positions[product_id])
+    kinds.append(KINDS.get(kind, OTHER))
+    values.append(value)
+
+  best, taken = rank_discounts([row[1] for row in rows], owners, kinds, values)
+  changed = []
+  for (pk, price, effective_price, best_discount_id), position, amount in zip(rows, best, taken):
+    discount_id = discount_ids[position] if position >= 0 else None
+    price = Decimal(price * SCALE - amount).scaleb(-6)
+    if price != effective_price or discount_id != best_discount_id:
+      changed.append(Product(id=pk, effective_price=price, best_discount_id=discount_id))
+  Product.objects.bulk_update(changed, ['effective_price', 'best_discount'], batch_size=batch_size)
+  return [row[0] for row in rows], [product.id for product in changed]
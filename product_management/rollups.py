@@ -0,0 +1,207 @@
+"""Per-category product counters, descendants included, kept incrementally
+
+`CategoryRollup` holds the number of products, of active and of out of
+stock products, and the stock value (price × quantity) of each category,
+both for the products directly in it (`own_*`) and for its whole subtree.
+Reading them is a join, never an aggregate over products.
+
+- A product save or delete adds the difference it makes to its category's
+  row and to the rows of every ancestor, read off the materialized path, in
+  one UPDATE.
+- A category move takes its subtree counters from the old ancestors and
+  adds them to the new ones; a category delete takes them from its
+  ancestors (its products are deleted and its subcategories become roots).
+- Stock reservations and releases know what they changed, and add it the
+  same way (`add_categories`).
+- Other set-based product writes, which don't know what they changed,
+  recount the own counters of the categories involved with one GROUP BY
+  and propagate the difference.
+
+`rebuild()` (`manage.py reconcile_rollups`) recomputes every row in bulk,
+and runs by itself the first time a write finds a category without a row.
+"""
+
+from decimal import Decimal
+from typing import NamedTuple
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.utils import timezone
+from .models import PATH_STEP, Category, CategoryRollup, Product, ProductStatus
+
+FIELDS = ('product_count', 'active_count', 'out_of_stock_count', 'stock_value')
+OWN_FIELDS = tuple(f'own_{field}' for field in FIELDS)
+VALUE_FIELD = DecimalField(max_digits=20, decimal_places=2)
+
+
+class Totals(NamedTuple):
+  product_count: int = 0
+  active_count: int = 0
+  out_of_stock_count: int = 0
+  stock_value: Decimal = Decimal(0)
+
+  @classmethod
+  def of(cls, status, price, quantity):
+    """Counters of a single product"""
+    value = Decimal(str(price)) * quantity
+    return cls(1, int(status == ProductStatus.ACTIVE), int(status == ProductStatus.OUT_OF_STOCK), value)
+
+  def plus(self, other):
+    return Totals(*(a + b for a, b in zip(self, other)))
+
+  def minus(self, other):
+    return Totals(*(a - b for a, b in zip(self, other)))
+
+
+ZERO = Totals()
+
+
+def ancestor_ids(path):
+  """Ids of the category at `path` and of all of its ancestors"""
+  return [int(path[start:start + PATH_STEP]) for start in range(0, len(path), PATH_STEP)]
+
+
+def output_field(field):
+  return VALUE_FIELD if field.endswith('stock_value') else IntegerField()
+
+
+def add(category_ids, delta, own_category_id=None):
+  """Add `delta` to the subtree counters of `category_ids`, and to the own
+  counters of `own_category_id`
+
+  Returns whether a category had no row yet, in which case everything was
+  rebuilt instead, the write being in the database already.
+  """
+  if delta == ZERO or not category_ids:
+    return False
+  changes = {
+    field: F(field) + Value(value, output_field=output_field(field)) for field, value in zip(FIELDS, delta)
+  }
+  if own_category_id is not None:
+    for field, value in zip(OWN_FIELDS, delta):
+      changes[field] = F(field) + Case(
+        When(category_id=own_category_id, then=Value(value)), default=Value(0), output_field=output_field(field)
+      )
+  updated = CategoryRollup.objects.filter(category_id__in=category_ids).update(updated_at=timezone.now(), **changes)
+  if updated < len(set(category_ids)):
+    rebuild()
+    return True
+  return False
+
+
+def add_products(category_id, delta):
+  """Add the counters `delta` of products to a category and its ancestors"""
+  if delta == ZERO:
+    return
+  path = Category.objects.filter(id=category_id).values_list('path', flat=True).first()
+  if path:
+    add(ancestor_ids(path), delta, own_category_id=category_id)
+
+
+def add_categories(deltas):
+  """Apply `{(category_id, path): Totals}`, one UPDATE per category"""
+  for (category_id, path), delta in deltas.items():
+    if add(ancestor_ids(path), delta, own_category_id=category_id):
+      return
+
+
+def own_totals(products):
+  """`{category_id: Totals}` of the products of a queryset, in one GROUP BY"""
+  rows = (
+    products.order_by().values('category_id').annotate(
+      products=Count('id'),
+      active=Count('id', filter=Q(status=ProductStatus.ACTIVE)),
+      out_of_stock=Count('id', filter=Q(status=ProductStatus.OUT_OF_STOCK)),
+      value=Sum(F('price') * F('quantity'), output_field=VALUE_FIELD),
+    ).values_list('category_id', 'products', 'active', 'out_of_stock', 'value')
+  )
+  return {category_id: Totals(*counts, value or Decimal(0)) for category_id, *counts, value in rows}
+
+
+def recount(category_ids):
+  """Recount the products directly in `category_ids`, propagating the change"""
+  category_ids = set(category_ids) - {None}
+  if not category_ids:
+    return
+  with transaction.atomic():
+    # Locking the rows serializes recounts of a category, so each one adds
+    # the difference from the counters the previous one stored
+    stored = {
+      rollup.category_id: rollup
+      for rollup in CategoryRollup.objects.select_for_update(of=('self',)).select_related('category')
+      .filter(category_id__in=category_ids)
+    }
+    if len(stored) < len(category_ids) and len(stored) < Category.objects.filter(id__in=category_ids).count():
+      rebuild()
+      return
+    counted = own_totals(Product.objects.filter(category_id__in=stored))
+    for category_id, rollup in stored.items():
+      current = Totals(*(getattr(rollup, field) for field in OWN_FIELDS))
+      delta = counted.get(category_id, ZERO).minus(current)
+      if add(ancestor_ids(rollup.category.path), delta, own_category_id=category_id):
+        return
+
+
+def move_subtree(category, old_path, new_path):
+  """Move the counters of a reparented category from its old ancestors to its new ones"""
+  rollup = CategoryRollup.objects.filter(category_id=category.pk).first()
+  if rollup is None:
+    rebuild()
+    return
+  totals = Totals(*(getattr(rollup, field) for field in FIELDS))
+  if not add(ancestor_ids(old_path)[:-1], ZERO.minus(totals)):
+    add(ancestor_ids(new_path)[:-1], totals)
+
+
+def remove_category(category_id, path):
+  """Take a deleted category's counters from its ancestors and drop its row"""
+  rollup = CategoryRollup.objects.filter(category_id=category_id).first()
+  if rollup is None:
+    return
+  rollup.delete()
+  add(ancestor_ids(path)[:-1], ZERO.minus(Totals(*(getattr(rollup, field) for field in FIELDS))))
+
+
+def ensure(category_ids):
+  """Create zeroed rows for new categories, which have no products yet"""
+  CategoryRollup.objects.bulk_create(
+    [CategoryRollup(category_id=category_id) for category_id in category_ids], ignore_conflicts=True
+  )
+
+
+def rebuild(batch_size=1000):
+  """Recompute every rollup from the products, returning `(rows, corrected)`"""
+  with transaction.atomic():
+    paths = dict(Category.objects.values_list('id', 'path'))
+    own = own_totals(Product.objects.all())
+    subtree = dict.fromkeys(paths, ZERO)
+    for category_id, path in paths.items():
+      totals = own.get(category_id, ZERO)
+      if totals != ZERO:
+        for ancestor_id in ancestor_ids(path):
+          if ancestor_id in subtree:
+            subtree[ancestor_id] = subtree[ancestor_id].plus(totals)
+
+    previous = {
+      category_id: tuple(counters)
+      for category_id, *counters in CategoryRollup.objects.values_list('category_id', *FIELDS, *OWN_FIELDS)
+    }
+    now = timezone.now()
+    rows = [
+      CategoryRollup(
+        category_id=category_id, updated_at=now,
+        **dict(zip(FIELDS, subtree[category_id])), **dict(zip(OWN_FIELDS, own.get(category_id, ZERO))),
+      )
+      for category_id in paths
+    ]
+    corrected = sum(
+      1 for row in rows
+      if previous.get(row.category_id) != tuple(getattr(row, field) for field in FIELDS + OWN_FIELDS)
+    )
+    CategoryRollup.objects.bulk_create(
+      rows, batch_size=batch_size, update_conflicts=True,
+      unique_fields=['category'], update_fields=[*FIELDS, *OWN_FIELDS, 'updated_at'],
+    )
+    # Rows of categories deleted without going through the model
+    stale = set(previous) - set(paths)
+    CategoryRollup.objects.filter(category_id__in=stale).delete()
+  return len(rows), corrected + len(stale)
@@ -0,0 +1,192 @@
+"""Full-text search over product names and descriptions
+
+Two interchangeable backends keep a search index next to the products:
+
+- `Fts5Backend`, an SQLite FTS5 table ranked with bm25, used on SQLite
+- `TokenBackend`, a portable inverted index of `ProductSearchToken` rows,
+  used on every other database
+
+Both are kept up to date incrementally by the signals in `signals.py`, and
+`manage.py rebuild_search_index` rebuilds them from scratch.
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+from django.conf import settings
+from django.db import connection
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from .models import Product, ProductSearchToken
+
+FTS_TABLE = 'product_search'
+# Name words weigh this many times more than description words
+NAME_WEIGHT = 10
+MAX_TOKEN_LENGTH = 64
+MAX_QUERY_TERMS = 8
+WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+  """Lowercase words of `text` without diacritics, like FTS5's unicode61"""
+  text = unicodedata.normalize('NFKD', text or '')
+  text = ''.join(char for char in text if not unicodedata.combining(char))
+  return [word[:MAX_TOKEN_LENGTH] for word in WORD.findall(text.lower())]
+
+
+def document_tokens(name, description):
+  """Weighted tokens of a product for the portable index"""
+  weights = Counter()
+  for token in tokenize(name):
+    weights[token] += NAME_WEIGHT
+  for token in tokenize(description):
+    weights[token] += 1
+  return weights
+
+
+def prefix_range(term):
+  """Bounds of the strings starting with `term`, as an index range scan"""
+  return term, term[:-1] + chr(ord(term[-1]) + 1)
+
+
+class Fts5Backend:
+  name = 'fts5'
+
+  def index(self, products):
+    with connection.cursor() as cursor:
+      cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk, _, _ in products])
+      cursor.executemany(
+        f'INSERT INTO {FTS_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+        [(pk, name, description or '') for pk, name, description in products],
+      )
+
+  def remove(self, product_ids):
+    with connection.cursor() as cursor:
+      cursor.executemany(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [(pk,) for pk in product_ids])
+
+  def clear(self):
+    with connection.cursor() as cursor:
+      cursor.execute(f'DELETE FROM {FTS_TABLE}')
+
+  def match_expression(self, terms):
+    # Quoted so query text can't use FTS5 syntax, `*` for prefix matching
+    return ' AND '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+
+  def filter(self, queryset, terms):
+    return queryset.extra(
+      where=[f'{Product._meta.db_table}.id IN (SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s)'],
+      params=[self.match_expression(terms)],
+    )
+
+  def rank(self, queryset, terms):
+    # bm25() is lower for better matches; the name column weighs more
+    return queryset.extra(
+      tables=[FTS_TABLE],
+      where=[f'{FTS_TABLE}.rowid = {Product._meta.db_table}.id', f'{FTS_TABLE} MATCH %s'],
+      params=[self.match_expression(terms)],
+      select={'score': f'-bm25({FTS_TABLE}, {NAME_WEIGHT}.0, 1.0)'},
+    )
+
+
+class TokenBackend:
+  name = 'tokens'
+
+  def index(self, products):
+    self.remove([pk for pk, _, _ in products])
+    ProductSearchToken.objects.bulk_create(
+      [
+        ProductSearchToken(product_id=pk, token=token, weight=weight)
+        for pk, name, description in products
+        for token, weight in document_tokens(name, description).items()
+      ],
+      batch_size=1000,
+    )
+
+  def remove(self, product_ids):
+    ProductSearchToken.objects.filter(product_id__in=list(product_ids)).delete()
+
+  def clear(self):
+    ProductSearchToken.objects.all().delete()
+
+  def postings(self, term):
+    lower, upper = prefix_range(term)
+    return ProductSearchToken.objects.filter(token__gte=lower, token__lt=upper)
+
+  def filter(self, queryset, terms):
+    for term in terms:
+      queryset = queryset.filter(id__in=self.postings(term).values('product_id'))
+    return queryset
+
+  def rank(self, queryset, terms):
+    """tf-idf: each term adds the weight of its matching tokens scaled by
+    how rare the term is in the catalog"""
+    total = Product.objects.count() or 1
+    score = Value(0.0)
+    for term in terms:
+      matches = self.postings(term).values('product_id').distinct().count()
+      idf = math.log(1 + total / max(matches, 1))
+      weight = Subquery(
+        self.postings(term).filter(product_id=OuterRef('pk'))
+        .values('product_id').annotate(total=Sum('weight')).values('total')
+      )
+      score = score + Coalesce(weight, 0) * Value(idf)
+    return self.filter(queryset, terms).annotate(score=score)
+
+
+def get_backend():
+  """The configured search backend, FTS5 on SQLite unless set otherwise"""
+  backend = getattr(settings, 'PRODUCT_SEARCH_BACKEND', 'auto')
+  if backend == 'auto':
+    backend = 'fts5' if connection.vendor == 'sqlite' and fts5_available() else 'tokens'
+  return Fts5Backend() if backend == 'fts5' else TokenBackend()
+
+
+_fts5_tables = {}
+
+
+def fts5_available():
+  """Whether the migrations created the FTS5 table, checked once per database"""
+  name = connection.settings_dict['NAME']
+  if name not in _fts5_tables:
+    _fts5_tables[name] = FTS_TABLE in connection.introspection.table_names()
+  return _fts5_tables[name]
+
+
+def query_terms(query):
+  return tokenize(query)[:MAX_QUERY_TERMS]
+
+
+def index_product(product):
+  get_backend().index([(product.pk, product.name, product.description)])
+
+
+def index_products(product_ids):
+  """Reindex `product_ids`, dropping the ones that no longer exist"""
+  product_ids = set(product_ids) - {None}
+  if not product_ids:
+    return
+  products = list(Product.objects.filter(id__in=product_ids).values_list('id', 'name', 'description'))
+  backend = get_backend()
+  backend.index(products)
+  backend.remove(product_ids - {pk for pk, _, _ in products})
+
+
+def remove_products(product_ids):
+  get_backend().remove(set(product_ids) - {None})
+
+
+def rebuild_index(batch_size=1000):
+  """Index the whole catalog from scratch, returning the number of products"""
+  backend = get_backend()
+  backend.clear()
+  indexed, last_id = 0, 0
+  while True:
+    products = list(
+      Product.objects.filter(id__gt=last_id).order_by('id').values_list('id', 'name', 'description')[:batch_size]
+    )
+    if not products:
+      return indexed
+    backend.index(products)
+    indexed += len(products)
+    last_id = products[-1][0]
@@ -1,12 +1,27 @@
 from rest_framework import serializers
 from decimal import Decimal
-from .models import Category, Product, Discount, DiscountStatus, DiscountType
+from django.conf import settings
+from .models import Category, Product, Discount, DiscountStatus, DiscountType, Reservation, ReservationItem
+from .metrics import TimedDataMixin
+from .pricing import discount_amount, discounted_price, price_products
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedDataMixin, serializers.ModelSerializer):
   subcategories = serializers.SerializerMethodField()
+  # Counters of the category and its descendants, read from `CategoryRollup`
+  # (fetch categories with `select_related('rollup')`)
+  product_count = serializers.IntegerField(source='rollup.product_count', read_only=True)
+  active_product_count = serializers.IntegerField(source='rollup.active_count', read_only=True)
+  out_of_stock_count = serializers.IntegerField(source='rollup.out_of_stock_count', read_only=True)
+  stock_value = serializers.DecimalField(
+    max_digits=20, decimal_places=2, source='rollup.stock_value', read_only=True
+  )
+
   class Meta:
     model = Category
-    fields = ['id', 'title', 'description', 'parent', 'slug', 'created_at', 'updated_at', 'subcategories']
+    fields = [
+      'id', 'title', 'description', 'parent', 'slug', 'created_at', 'updated_at',
+      'product_count', 'active_product_count', 'out_of_stock_count', 'stock_value', 'subcategories',
+    ]
 
   def validate(self, category):
     """Ensure category isn't trying to set itself as it's parent"""
@@ -14,19 +29,68 @@ class CategorySerializer(serializers.ModelSerializer):
 
     if parent and self.instance and parent.id == self.instance.id:
       raise serializers.ValidationError("A category cannot be it's own parent.")
+    if parent and self.instance and self.instance.path and parent.path.startswith(self.instance.path):
+      raise serializers.ValidationError("A category cannot be moved under one of its own subcategories.")
     return category
   
   def get_subcategories(self, obj):
     """Return the subcategories of the current category"""
-    subcategories = Category.objects.filter(parent=obj)
-    return CategorySerializer(subcategories, many=True).data
+    level = self.context.get('level', 1)
+    depth = self.context.get('depth')
+    if depth is not None and level > depth:
+      return []
+
+    # Views pass every category they fetched, grouped by parent, so the
+    # tree is assembled in memory instead of querying once per node
+    children = self.context.get('children')
+    if children is None:
+      subcategories = Category.objects.filter(parent=obj).select_related('rollup')
+    else:
+      subcategories = children.get(obj.id, [])
+
+    context = {**self.context, 'level': level + 1}
+    return CategorySerializer(subcategories, many=True, context=context).data
+
+class CategoryField(serializers.PrimaryKeyRelatedField):
+  """Primary key field for categories that can be resolved from a preloaded map
+
+  Bulk writes put `{id: category}` for every referenced category in
+  `context['categories']` so validating many rows costs one `IN` query.
+  """
+
+  def to_internal_value(self, data):
+    categories = self.context.get('categories')
+    if categories is None:
+      return super().to_internal_value(data)
+    if isinstance(data, bool):
+      self.fail('incorrect_type', data_type=type(data).__name__)
+    try:
+      pk = int(data)
+    except (TypeError, ValueError):
+      self.fail('incorrect_type', data_type=type(data).__name__)
+    if pk not in categories:
+      self.fail('does_not_exist', pk_value=data)
+    return categories[pk]
 
-class ProductSerializer(serializers.ModelSerializer):
-  category = serializers.PrimaryKeyRelatedField(queryset=Category.objects.all())
+
+class ProductListSerializer(TimedDataMixin, serializers.ListSerializer):
+  def to_representation(self, data):
+    """Price the whole list in one batch before serializing its items"""
+    products = list(data.all() if hasattr(data, 'all') else data)
+    if all(hasattr(product, 'active_discounts') for product in products):
+      self.context['discounted_prices'] = {
+        product.pk: price for product, (price, _) in zip(products, price_products(products))
+      }
+    return super().to_representation(products)
+
+
+class ProductSerializer(TimedDataMixin, serializers.ModelSerializer):
+  category = CategoryField(queryset=Category.objects.all())
   discounted_price = serializers.SerializerMethodField()
 
   class Meta:
     model = Product
+    list_serializer_class = ProductListSerializer
     fields = ['id', 'name', 'description', 'price', 'quantity', 'status', 'category', 'created_at', 'updated_at', 'discounted_price']
 
   def validate_price(self, value):
@@ -37,28 +101,21 @@ class ProductSerializer(serializers.ModelSerializer):
 
   def get_discounted_price(self, obj: Product):
     """Get the discounted price for a product"""
-    active_discounts = obj.discounts.filter(status='active')
-    
-    if active_discounts.exists():
-      # Get the best discount and apply it to the price
-      best_discount = max(active_discounts, key=lambda x: self.apply_highest_discount(x, obj.price))
-      # Apply discount and return rounded discounted price
-      return best_discount.apply_discount(obj.price)
-    
-    # If no active discount, return the original price rounded to 2 decimal places
-    return round(obj.price, 2)
+    prices = self.context.get('discounted_prices')
+    if prices is not None and obj.pk in prices:
+      return prices[obj.pk]
+    # Use the discounts prefetched by `Product.objects.with_active_discounts()`
+    # when available so list responses don't issue a query per product
+    active_discounts = getattr(obj, 'active_discounts', None)
+    if active_discounts is None:
+      active_discounts = list(obj.discounts.filter(status=DiscountStatus.ACTIVE))
+    return discounted_price(obj.price, active_discounts)
 
   def apply_highest_discount(self, discount: Discount, price: Decimal):
     """Retrieve the highest discount value for the product price"""
-    if discount.discount_type == DiscountType.PERCENTAGE:
-      # Apply percentage discount
-      return float(price) * float(discount.value) / 100
-    elif discount.discount_type == DiscountType.FIXED:
-      # Apply fixed discount
-      return discount.value
-    return Decimal(0)
+    return discount_amount(discount, price)
   
-class DiscountSerializer(serializers.ModelSerializer):
+class DiscountSerializer(TimedDataMixin, serializers.ModelSerializer):
   class Meta:
     model = Discount
     fields = ['id', 'product', 'discount_type', 'value', 'status', 'expires_at']
@@ -72,3 +129,51 @@ class DiscountSerializer(serializers.ModelSerializer):
   value = serializers.DecimalField(max_digits=10, decimal_places=2)
   status = serializers.ChoiceField(choices=DiscountStatus.choices)
   expires_at = serializers.DateTimeField(format='%Y-%m-%dT%H:%M:%SZ')
+
+
+class DiscountCampaignSerializer(serializers.Serializer):
+  """Products a discount is applied to or removed from: ids or a category"""
+  products = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+  category = serializers.IntegerField(required=False)
+  include_descendants = serializers.BooleanField(default=False)
+
+  def validate_products(self, products):
+    if len(products) > settings.PRODUCT_BULK_MAX_ROWS:
+      raise serializers.ValidationError(f'At most {settings.PRODUCT_BULK_MAX_ROWS} products can be sent at once.')
+    return products
+
+  def validate(self, data):
+    if ('products' in data) == ('category' in data):
+      raise serializers.ValidationError('Send either a list of products or a category.')
+    return data
+
+
+class ReservationItemSerializer(serializers.ModelSerializer):
+  # Plain ids: unknown products are reported by `inventory.reserve` without a lookup per item
+  product = serializers.IntegerField()
+  quantity = serializers.IntegerField(min_value=1)
+
+  class Meta:
+    model = ReservationItem
+    fields = ['product', 'quantity']
+
+  def to_representation(self, item):
+    return {'product': item.product_id, 'quantity': item.quantity}
+
+
+class ReservationSerializer(TimedDataMixin, serializers.ModelSerializer):
+  items = ReservationItemSerializer(many=True)
+  ttl = serializers.IntegerField(min_value=1, required=False, write_only=True)
+
+  class Meta:
+    model = Reservation
+    fields = ['id', 'status', 'items', 'ttl', 'expires_at', 'created_at', 'updated_at']
+    read_only_fields = ['status', 'expires_at', 'created_at', 'updated_at']
+
+  def validate_items(self, items):
+    if not items:
+      raise serializers.ValidationError('A reservation needs at least one item.')
+    return items
+
+  def validate_ttl(self, ttl):
+    return min(ttl, settings.RESERVATION_MAX_TTL)
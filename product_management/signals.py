@@ -0,0 +1,173 @@
+from django.db.models.functions import Substr
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+from . import caching, changes, rollups, search
+from .models import Category, ChangeAction, Discount, Product
+from .pricing import reprice_products
+
+# Sent by set-based writes (bulk_create, bulk_update, queryset updates) which
+# bypass the model signals, with `product_ids` and `action` of the change, the
+# `discount_ids` updated and `created_discount_ids` inserted by discount
+# changes, and the `category_ids` products were moved out of
+products_bulk_changed = Signal()
+
+# Sent by `Category.update_path` when a category moves, with the `category`
+# and its `old_path` and `new_path`
+category_moved = Signal()
+
+# Product fields the category rollups count
+ROLLUP_FIELDS = {'category', 'category_id', 'status', 'price', 'quantity'}
+
+
+def log_saved(sender, instance, created, **kwargs):
+  changes.record(sender, [instance.pk], ChangeAction.CREATE if created else ChangeAction.UPDATE)
+
+
+def log_deleted(sender, instance, **kwargs):
+  changes.record(sender, [instance.pk], ChangeAction.DELETE)
+
+
+# Model saves and deletes run in a transaction, which the entries join
+for model in (Category, Product, Discount):
+  post_save.connect(log_saved, sender=model)
+  post_delete.connect(log_deleted, sender=model)
+
+
+@receiver(post_delete, sender=Category)
+def detach_subcategories(sender, instance: Category, **kwargs):
+  """Turn the subtree of a deleted category into roots of their own
+
+  `Category.parent` uses SET_NULL, so by the time this runs the direct children
+  are already detached; stripping the deleted prefix fixes every descendant's
+  path in a single UPDATE within the same delete transaction.
+  """
+  if not instance.path:
+    return
+  descendants = Category.objects.descendants_of(instance, include_self=False)
+  descendant_ids = list(descendants.values_list('id', flat=True))
+  descendants.update(path=Substr('path', len(instance.path) + 1))
+  changes.record(Category, descendant_ids, ChangeAction.UPDATE)
+
+
+@receiver(post_delete, sender=Category)
+def remove_category_rollup(sender, instance: Category, **kwargs):
+  # Connected after `detach_subcategories`: the subtree has left the ancestors
+  if instance.path:
+    rollups.remove_category(instance.pk, instance.path)
+
+
+@receiver(post_save, sender=Category)
+def create_category_rollup(sender, instance: Category, created, **kwargs):
+  if created:
+    rollups.ensure([instance.pk])
+
+
+@receiver(category_moved, sender=Category)
+def move_category_rollup(sender, category, old_path, new_path, **kwargs):
+  rollups.move_subtree(category, old_path, new_path)
+
+
+@receiver(pre_save, sender=Product)
+def load_rollup_counters(sender, instance: Product, update_fields=None, **kwargs):
+  """Read the counted fields as stored, for `count_saved_product` to diff"""
+  instance._rollup_before = None
+  if instance.pk is not None and (update_fields is None or ROLLUP_FIELDS & set(update_fields)):
+    # Locked, so that concurrent saves of a product each diff from the other's result
+    instance._rollup_before = (
+      Product.objects.select_for_update(of=('self',)).filter(pk=instance.pk)
+      .values_list('category_id', 'status', 'price', 'quantity').first()
+    )
+
+
+@receiver(post_save, sender=Product)
+def count_saved_product(sender, instance: Product, created, **kwargs):
+  before = getattr(instance, '_rollup_before', None)
+  instance._rollup_before = None
+  after = rollups.Totals.of(instance.status, instance.price, instance.quantity)
+  if before is None:
+    if created:
+      rollups.add_products(instance.category_id, after)
+    return
+  category_id, *counted = before
+  before = rollups.Totals.of(*counted)
+  if category_id == instance.category_id:
+    rollups.add_products(category_id, after.minus(before))
+  else:
+    rollups.add_products(category_id, rollups.ZERO.minus(before))
+    rollups.add_products(instance.category_id, after)
+
+
+@receiver(post_delete, sender=Product)
+def uncount_deleted_product(sender, instance: Product, origin=None, **kwargs):
+  # Products deleted along with their category are settled by `remove_category_rollup`
+  deleting_category = isinstance(origin, Category) or getattr(origin, 'model', None) is Category
+  if not deleting_category:
+    totals = rollups.Totals.of(instance.status, instance.price, instance.quantity)
+    rollups.add_products(instance.category_id, rollups.ZERO.minus(totals))
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_cache(sender, instance: Product, **kwargs):
+  caching.invalidate_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance: Product, update_fields=None, **kwargs):
+  if update_fields is None or {'name', 'description'} & set(update_fields):
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance: Product, **kwargs):
+  search.remove_products([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=Discount)
+def reprice_discounted_product(sender, instance: Discount, origin=None, **kwargs):
+  """Refresh the effective price and cache of the products a discount touches"""
+  product_ids = {instance.product_id, getattr(instance, 'loaded_product_id', None)} - {None}
+  instance.loaded_product_id = instance.product_id
+
+  # Discounts deleted along with their product don't need a reprice
+  deleting_product = isinstance(origin, Product) or getattr(origin, 'model', None) is Product
+  if not deleting_product:
+    reprice_products(product_ids)
+    changes.record(Product, product_ids, ChangeAction.UPDATE)
+  caching.invalidate_products(product_ids)
+
+
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, instance: Category, **kwargs):
+  # Category changes can move products in and out of `include_descendants` listings
+  caching.invalidate_catalog()
+
+
+@receiver(products_bulk_changed, sender=Product)
+def reprice_bulk_changed_products(sender, product_ids, action, **kwargs):
+  # Fresh inserts are priced by `ProductQuerySet.bulk_create` already
+  if action in ('update', 'upsert', 'discounts'):
+    reprice_products(product_ids)
+  caching.invalidate_products(product_ids)
+
+
+@receiver(products_bulk_changed, sender=Product)
+def log_bulk_changed_products(sender, product_ids, action, discount_ids=(), created_discount_ids=(), **kwargs):
+  changes.record(Product, product_ids, ChangeAction.CREATE if action == 'create' else ChangeAction.UPDATE)
+  changes.record(Discount, created_discount_ids, ChangeAction.CREATE)
+  changes.record(Discount, discount_ids, ChangeAction.UPDATE)
+
+
+@receiver(products_bulk_changed, sender=Product)
+def recount_bulk_changed_products(sender, product_ids, action, category_ids=(), **kwargs):
+  """Recount the categories of products written in bulk, and `category_ids`,
+  those the products were in before"""
+  # Discounts don't change the counters, stock changes adjust them directly
+  if action in ('create', 'update', 'upsert'):
+    categories = Product.objects.filter(id__in=product_ids).order_by().values_list('category_id', flat=True)
+    rollups.recount({*categories.distinct(), *category_ids})
+
+
+@receiver(products_bulk_changed, sender=Product)
+def reindex_bulk_changed_products(sender, product_ids, action, **kwargs):
+  if action in ('create', 'update', 'upsert'):
+    search.index_products(product_ids)
@@ -0,0 +1,130 @@
+from decimal import Decimal
+from rest_framework import status
+from rest_framework.test import APITestCase
+from django.test import TestCase
+from product_management import campaigns
+from product_management.models import Category, Discount, DiscountStatus, DiscountType, IdempotencyKey, Product
+
+
+class CampaignTest(TestCase):
+  def setUp(self):
+    self.category = Category.objects.create(title="Electronics")
+    self.products = [
+      Product.objects.create(name=f"Phone {index}", price=Decimal("100.00"), quantity=1, category=self.category)
+      for index in range(3)
+    ]
+    self.discount = Discount.objects.create(
+      product=self.products[0], discount_type=DiscountType.PERCENTAGE, value=Decimal("10.00")
+    )
+
+  def effective_prices(self):
+    return list(Product.objects.order_by('id').values_list('effective_price', flat=True))
+
+  def test_apply_copies_discount(self):
+    """Test that applying creates one copy per product and reprices them"""
+    changed = campaigns.apply(self.discount, Product.objects.all())
+    self.assertEqual(changed, [self.products[1].id, self.products[2].id])
+    self.assertEqual(self.discount.copies.count(), 2)
+    self.assertEqual(self.effective_prices(), [Decimal("90.00")] * 3)
+    # Nothing left to do the second time
+    self.assertEqual(campaigns.apply(self.discount, Product.objects.all()), [])
+    self.assertEqual(self.discount.copies.count(), 2)
+
+  def test_unapply_and_reapply(self):
+    """Test that unapplying deactivates copies which reapplying switches back on"""
+    campaigns.apply(self.discount, Product.objects.all())
+    subset = Product.objects.filter(id__in=[self.products[0].id, self.products[1].id])
+    self.assertEqual(campaigns.unapply(self.discount, subset), [self.products[0].id, self.products[1].id])
+    self.assertEqual(self.effective_prices(), [Decimal("100.00"), Decimal("100.00"), Decimal("90.00")])
+    self.assertEqual(campaigns.unapply(self.discount, subset), [])
+
+    self.assertEqual(campaigns.apply(self.discount, subset), [self.products[0].id, self.products[1].id])
+    self.assertEqual(self.discount.copies.count(), 2)
+    self.assertEqual(Discount.objects.filter(status=DiscountStatus.INACTIVE).count(), 0)
+
+  def test_apply_through_a_copy(self):
+    """Test that a copy applies its template, so unapplying the template reaches every product"""
+    campaigns.apply(self.discount, Product.objects.filter(id=self.products[1].id))
+    copy = self.discount.copies.get()
+    self.assertEqual(campaigns.apply(copy, Product.objects.all()), [self.products[2].id])
+    self.assertFalse(Discount.objects.filter(template=copy).exists())
+
+    campaigns.unapply(self.discount, Product.objects.all())
+    self.assertEqual(self.effective_prices(), [Decimal("100.00")] * 3)
+
+  def test_expired_discount(self):
+    Discount.objects.filter(id=self.discount.id).update(expires_at="2000-01-01T00:00:00Z")
+    self.discount.refresh_from_db()
+    with self.assertRaises(campaigns.CampaignError):
+      campaigns.apply(self.discount, Product.objects.all())
+
+
+class DiscountCampaignViewTest(APITestCase):
+  def setUp(self):
+    self.root = Category.objects.create(title="Electronics")
+    self.child = Category.objects.create(title="Phones", parent=self.root)
+    self.laptop = Product.objects.create(name="Laptop", price=Decimal("200.00"), quantity=1, category=self.root)
+    self.phone = Product.objects.create(name="Phone", price=Decimal("100.00"), quantity=1, category=self.child)
+    self.discount = Discount.objects.create(
+      product=self.laptop, discount_type=DiscountType.FIXED, value=Decimal("20.00"), status=DiscountStatus.INACTIVE
+    )
+
+  def post(self, action, data, key=None):
+    headers = {"HTTP_IDEMPOTENCY_KEY": key} if key else {}
+    return self.client.post(f"/api/discounts/{self.discount.id}/{action}/", data, format="json", **headers)
+
+  def test_apply_to_products(self):
+    response = self.post("apply", {"products": [self.laptop.id, self.phone.id, 999]})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.data["changed"], [self.laptop.id, self.phone.id])
+    self.assertEqual(response.data["not_found"], [999])
+    self.assertEqual(response.data["prices"], [
+      {"id": self.laptop.id, "discounted_price": Decimal("180.00")},
+      {"id": self.phone.id, "discounted_price": Decimal("80.00")},
+    ])
+    detail = self.client.get(f"/api/products/{self.phone.id}")
+    self.assertEqual(detail.data["discounted_price"], Decimal("80.00"))
+
+  def test_category_filter(self):
+    response = self.post("apply", {"category": self.root.id})
+    self.assertEqual(response.data["changed"], [self.laptop.id])
+    response = self.post("apply", {"category": self.root.id, "include_descendants": True})
+    self.assertEqual(response.data["changed"], [self.phone.id])
+    response = self.post("unapply", {"category": self.child.id})
+    self.assertEqual(response.data["prices"], [{"id": self.phone.id, "discounted_price": Decimal("100.00")}])
+
+  def test_idempotency_key(self):
+    """Test that a retry with the same key replays the response without redoing the work"""
+    first = self.post("apply", {"products": [self.phone.id]}, key="campaign-1")
+    Discount.objects.filter(template=self.discount).update(status=DiscountStatus.INACTIVE)
+
+    retry = self.post("apply", {"products": [self.phone.id]}, key="campaign-1")
+    self.assertEqual(retry.status_code, status.HTTP_200_OK)
+    self.assertEqual(retry["Idempotent-Replayed"], "true")
+    self.assertEqual(retry.json(), first.json())
+    self.assertFalse(Discount.objects.filter(template=self.discount, status=DiscountStatus.ACTIVE).exists())
+
+    reused = self.post("unapply", {"products": [self.phone.id]}, key="campaign-1")
+    self.assertEqual(reused.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+  def test_failed_requests_free_the_key(self):
+    self.assertEqual(self.post("apply", {}, key="campaign-2").status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertFalse(IdempotencyKey.objects.exists())
+    self.assertEqual(self.post("apply", {"products": [self.phone.id]}, key="campaign-2").status_code, status.HTTP_200_OK)
+
+  def test_apply_through_a_copy(self):
+    self.post("apply", {"products": [self.phone.id]})
+    copy = Discount.objects.get(template=self.discount)
+    response = self.client.post(f"/api/discounts/{copy.id}/apply/", {"category": self.root.id}, format="json")
+    self.assertEqual(response.data["discount"], self.discount.id)
+    self.assertEqual(response.data["changed"], [self.laptop.id])
+
+    self.post("unapply", {"products": [self.laptop.id, self.phone.id]})
+    self.assertFalse(Discount.objects.filter(status=DiscountStatus.ACTIVE).exists())
+
+  def test_invalid_requests(self):
+    both = {"products": [self.phone.id], "category": self.root.id}
+    self.assertEqual(self.post("apply", both).status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(self.post("apply", {"products": []}).status_code, status.HTTP_400_BAD_REQUEST)
+    response = self.client.post("/api/discounts/999/apply/", {"products": [self.phone.id]}, format="json")
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
@@ -0,0 +1,121 @@
+from datetime import datetime, timezone
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase
+from product_management import campaigns
+from product_management.changes import represent
+from product_management.models import Category, ChangeLogEntry, Discount, DiscountType, Product
+
+
+def logged():
+  return list(ChangeLogEntry.objects.order_by('id').values_list('model', 'object_id', 'action'))
+
+
+class ChangeLogTest(TestCase):
+  def setUp(self):
+    self.category = Category.objects.create(title="Electronics")
+    self.product = Product.objects.create(name="Phone", price=Decimal("100.00"), category=self.category)
+    ChangeLogEntry.objects.all().delete()
+
+  def test_model_changes(self):
+    """Test that saves and deletes, cascades included, are logged in order"""
+    discount = Discount.objects.create(product=self.product, discount_type=DiscountType.FIXED, value=Decimal("5.00"))
+    self.product.name = "Smartphone"
+    self.product.save()
+    ids = (self.product.id, discount.id, self.category.id)
+    self.product.delete()
+    self.category.delete()
+    self.assertEqual(logged(), [
+      ('discount', ids[1], 'create'),
+      ('product', ids[0], 'update'),
+      ('product', ids[0], 'update'),
+      ('discount', ids[1], 'delete'),
+      ('product', ids[0], 'delete'),
+      ('category', ids[2], 'delete'),
+    ])
+
+  def test_rolled_back_changes_are_not_logged(self):
+    with self.assertRaises(RuntimeError), transaction.atomic():
+      Product.objects.create(name="Tablet", price=Decimal("50.00"), category=self.category)
+      raise RuntimeError
+    self.assertEqual(logged(), [])
+
+  def test_bulk_changes(self):
+    discount = Discount.objects.create(product=self.product, discount_type=DiscountType.FIXED, value=Decimal("5.00"))
+    other = Product.objects.create(name="Tablet", price=Decimal("50.00"), category=self.category)
+    ChangeLogEntry.objects.all().delete()
+
+    campaigns.apply(discount, Product.objects.all())
+    copy = discount.copies.get()
+    self.assertEqual(logged(), [('product', other.id, 'update'), ('discount', copy.id, 'create')])
+
+    # Switching an unapplied copy back on is an update
+    campaigns.unapply(discount, Product.objects.filter(id=other.id))
+    ChangeLogEntry.objects.all().delete()
+    campaigns.apply(discount, Product.objects.filter(id=other.id))
+    self.assertEqual(logged(), [('product', other.id, 'update'), ('discount', copy.id, 'update')])
+
+  def test_compact(self):
+    """Test that compaction keeps only the latest entry of each object"""
+    other = Product.objects.create(name="Tablet", price=Decimal("50.00"), category=self.category)
+    for price in ("90.00", "80.00"):
+      self.product.price = Decimal(price)
+      self.product.save()
+    other_id = other.id
+    other.delete()
+
+    output = StringIO()
+    call_command('compact_changes', batch_size=2, stdout=output)
+    self.assertIn('Dropped 2 superseded changes', output.getvalue())
+    self.assertEqual(logged(), [('product', self.product.id, 'update'), ('product', other_id, 'delete')])
+
+
+class ChangeFeedViewTest(APITestCase):
+  def setUp(self):
+    self.category = Category.objects.create(title="Electronics")
+    self.products = [
+      Product.objects.create(name=f"Phone {index}", price=Decimal("100.00"), category=self.category)
+      for index in range(3)
+    ]
+    self.first = ChangeLogEntry.objects.order_by('id').first().id
+
+  def test_incremental_reads(self):
+    response = self.client.get("/api/changes/", {"since": 0, "limit": 2})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    data = response.json()
+    self.assertEqual(
+      [(change["model"], change["id"], change["action"]) for change in data["changes"]],
+      [("category", self.category.id, "create"), ("product", self.products[0].id, "create")],
+    )
+    self.assertEqual(data["changes"][0]["seq"], self.first)
+    self.assertTrue(data["has_more"])
+
+    data = self.client.get("/api/changes/", {"since": data["next"]}).json()
+    self.assertEqual([change["id"] for change in data["changes"]], [product.id for product in self.products[1:]])
+    self.assertFalse(data["has_more"])
+
+  def test_same_bytes_as_drf(self):
+    """Test that the feed renders its timestamps exactly as DRF's `JSONRenderer` would"""
+    ChangeLogEntry.objects.filter(id=self.first).update(created_at=datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc))
+    response = self.client.get("/api/changes/", {"since": 0})
+    entries = list(ChangeLogEntry.objects.order_by('id'))
+    expected = JSONRenderer().render({
+      'changes': [represent(entry) for entry in entries], 'next': entries[-1].id, 'has_more': False,
+    })
+    self.assertEqual(response.content, expected)
+    self.assertIn(b'"changed_at":"2024-05-01T12:30:15.123456Z"', response.content)
+
+  @override_settings(CHANGE_FEED_POLL_INTERVAL=0.01)
+  def test_long_poll_times_out_empty(self):
+    last = ChangeLogEntry.objects.order_by('id').last().id
+    data = self.client.get("/api/changes/", {"since": last, "wait": 0.05}).json()
+    self.assertEqual(data, {"changes": [], "next": last, "has_more": False})
+
+  def test_invalid_parameters(self):
+    for params in ({"since": "x"}, {"since": -1}, {"limit": 0}, {"wait": "nan"}):
+      self.assertEqual(self.client.get("/api/changes/", params).status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,162 @@
+import json
+import os
+import tempfile
+import threading
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from datetime import timedelta
+from decimal import Decimal
+from django.core.cache import cache
+from django.utils import timezone
+from product_management import expiry
+from product_management.models import Category, ChangeLogEntry, Discount, DiscountStatus, DiscountType, Product
+
+
+class ImportCatalogCommandTest(TestCase):
+  def setUp(self):
+    self.directory = tempfile.TemporaryDirectory()
+    self.addCleanup(self.directory.cleanup)
+
+  def write(self, name, content):
+    path = os.path.join(self.directory.name, name)
+    with open(path, 'w') as file:
+      file.write(content)
+    return path
+
+  def run_import(self, **options):
+    output = StringIO()
+    call_command('import_catalog', stdout=output, stderr=StringIO(), **options)
+    return output.getvalue()
+
+  def test_import_categories_in_topological_order(self):
+    """Test that children listed before their parents are still linked"""
+    path = self.write('categories.csv', 'title,description,parent\n'
+                      'Gaming Laptops,,Laptops\n'
+                      'Laptops,"All laptops,\nnotebooks",Electronics\n'
+                      'Electronics,,\n')
+    self.run_import(categories=path, chunk_size=1)
+
+    gaming = Category.objects.get(title='Gaming Laptops')
+    laptops = Category.objects.get(title='Laptops')
+    self.assertEqual(gaming.parent, laptops)
+    self.assertEqual(laptops.description, 'All laptops,\nnotebooks')
+    self.assertEqual(gaming.slug, 'gaming-laptops')
+    self.assertEqual(set(Category.objects.descendants_of(laptops.parent)), set(Category.objects.all()))
+
+  def test_import_upserts_products_and_discounts(self):
+    Category.objects.create(title='Electronics')
+    products = self.write('products.ndjson', '\n'.join(json.dumps(row) for row in [
+      {'sku': 'P-1', 'name': 'Phone', 'price': '100.00', 'quantity': 3, 'category': 'Electronics'},
+      {'sku': 'P-2', 'name': 'Tablet', 'price': '-5', 'category': 'Electronics'},
+      {'sku': 'P-3', 'name': 'Chair', 'price': '20.00', 'category': 'Furniture'},
+    ]))
+    discounts = self.write('discounts.csv', 'product,discount_type,value,status,expires_at\n'
+                           'P-1,percentage,10,active,\n')
+    self.run_import(products=products, discounts=discounts)
+    self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['P-1'])
+    discount_changes = ChangeLogEntry.objects.filter(model='discount')
+    self.assertEqual(list(discount_changes.values_list('action', flat=True)), ['create'])
+
+    # Importing again updates the existing rows instead of duplicating them
+    products = self.write('products2.ndjson', json.dumps(
+      {'sku': 'P-1', 'name': 'Smartphone', 'price': '120.00', 'quantity': 1, 'category': 'Electronics'}
+    ))
+    discounts = self.write('discounts2.csv', 'product,discount_type,value,status,expires_at\n'
+                           'P-1,percentage,10.00,inactive,\n')
+    self.run_import(products=products, discounts=discounts)
+
+    product = Product.objects.get(sku='P-1')
+    self.assertEqual(product.name, 'Smartphone')
+    self.assertEqual(Discount.objects.get().status, 'inactive')
+    self.assertEqual(list(discount_changes.order_by('id').values_list('action', flat=True)), ['create', 'update'])
+
+  def test_rejects_invalid_discounts(self):
+    Product.objects.create(sku='P-1', name='Phone', price=Decimal('100.00'), category=Category.objects.create(title='Electronics'))
+    discounts = self.write('discounts.csv', 'product,discount_type,value,status,expires_at\n'
+                           'P-1,percentage,10,paused,\n'
+                           'P-1,fixed,-5,active,\n'
+                           'P-1,fixed,abc,,\n'
+                           'P-1,fixed,5,,\n')
+    self.run_import(discounts=discounts)
+    self.assertEqual(list(Discount.objects.values_list('discount_type', 'value', 'status')), [
+      ('fixed', Decimal('5.00'), 'active'),
+    ])
+
+  def test_resume_from_checkpoint(self):
+    Category.objects.create(title='Electronics')
+    rows = [{'sku': f'P-{i}', 'name': f'Product {i}', 'price': '1.00', 'category': 'Electronics'} for i in range(5)]
+    products = self.write('products.ndjson', '\n'.join(json.dumps(row) for row in rows))
+    checkpoint = os.path.join(self.directory.name, 'checkpoint.json')
+
+    # Simulate a crash after the first two rows were committed
+    with open(products, 'rb') as file:
+      offset = len(file.readline()) + len(file.readline())
+    with open(checkpoint, 'w') as file:
+      json.dump({'products': {'file': products, 'offset': offset, 'rows': 2, 'done': False}}, file)
+
+    output = self.run_import(products=products, checkpoint=checkpoint, chunk_size=2)
+    self.assertIn('rows/s', output)
+    self.assertEqual(sorted(Product.objects.values_list('sku', flat=True)), ['P-2', 'P-3', 'P-4'])
+    with open(checkpoint) as file:
+      self.assertTrue(json.load(file)['products']['done'])
+
+
+
+class RepriceCommandTest(TestCase):
+  def test_reprice_rebuilds_effective_prices(self):
+    category = Category.objects.create(title='Electronics')
+    products = [Product.objects.create(name=f'Product {i}', price=Decimal('100.00'), category=category) for i in range(3)]
+    discount = Discount.objects.create(product=products[0], value=20, discount_type=DiscountType.PERCENTAGE)
+    Product.objects.update(effective_price=0, best_discount=None)
+
+    output = StringIO()
+    call_command('reprice', batch_size=2, stdout=output)
+    self.assertIn('Repriced 3 products (3 changed)', output.getvalue())
+    prices = dict(Product.objects.values_list('id', 'effective_price'))
+    self.assertEqual(prices[products[0].id], Decimal('80.00'))
+    self.assertEqual(prices[products[1].id], Decimal('100.00'))
+    self.assertEqual(Product.objects.get(pk=products[0].id).best_discount, discount)
+
+
+
+class ExpireDiscountsCommandTest(TestCase):
+  def setUp(self):
+    cache.clear()
+    category = Category.objects.create(title='Electronics')
+    self.product = Product.objects.create(name='Phone', price=Decimal('100.00'), category=category)
+    self.other = Product.objects.create(name='Tablet', price=Decimal('50.00'), category=category)
+    past, future = timezone.now() - timedelta(hours=1), timezone.now() + timedelta(hours=1)
+    self.expired = [
+      Discount.objects.create(product=self.product, value=10 + i, discount_type=DiscountType.FIXED, expires_at=past)
+      for i in range(3)
+    ]
+    self.current = Discount.objects.create(product=self.product, value=5, discount_type=DiscountType.FIXED, expires_at=future)
+    self.untouched = Discount.objects.create(product=self.other, value=5, discount_type=DiscountType.FIXED)
+
+  def test_expire_discounts_in_batches(self):
+    self.assertEqual(self.client.get(f'/api/products/{self.product.id}').data['discounted_price'], 88)
+
+    output = StringIO()
+    # Each of the 2 batches also logs its products and discounts to the change feed
+    with self.assertNumQueries(20):
+      call_command('expire_discounts', batch_size=2, stdout=output)
+    self.assertIn('Expired 3 discounts', output.getvalue())
+
+    self.assertEqual(
+      set(Discount.objects.filter(status=DiscountStatus.ACTIVE)), {self.current, self.untouched}
+    )
+    self.product.refresh_from_db()
+    self.assertEqual(self.product.effective_price, Decimal('95.00'))
+    self.assertEqual(self.product.best_discount, self.current)
+    self.assertEqual(self.client.get(f'/api/products/{self.product.id}').data['discounted_price'], 95)
+
+  @override_settings(DISCOUNT_EXPIRY_SWEEP_INTERVAL=3600)
+  def test_sweeper_starts_from_the_entry_points_only(self):
+    """Test that loading the app (as management commands do) starts no sweeper"""
+    self.assertNotIn('discount-expiry-sweeper', [thread.name for thread in threading.enumerate()])
+    sweeper = expiry.start_configured_sweeper()
+    self.addCleanup(sweeper.stop)
+    self.assertTrue(sweeper.is_alive())
+    with override_settings(DISCOUNT_EXPIRY_SWEEP_INTERVAL=0):
+      self.assertIsNone(expiry.start_configured_sweeper())
@@ -0,0 +1,116 @@
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from django.db import OperationalError, connections
+from django.test import TestCase, TransactionTestCase
+from django.utils import timezone
+from product_management import inventory
+from product_management.models import Category, Product, ProductStatus, Reservation, ReservationStatus
+
+
+class ReservationTest(TestCase):
+  def setUp(self):
+    category = Category.objects.create(title="Electronics")
+    self.phone = Product.objects.create(name="Phone", price=Decimal("100.00"), quantity=3, category=category)
+    self.laptop = Product.objects.create(name="Laptop", price=Decimal("900.00"), quantity=1, category=category)
+
+  def assertStock(self, product, quantity, status):
+    product.refresh_from_db()
+    self.assertEqual((product.quantity, product.status), (quantity, status))
+
+  def test_reserve_takes_stock(self):
+    """Test that reserving decrements stock and sells out products at zero"""
+    reservation = inventory.reserve([(self.laptop.id, 1), (self.phone.id, 1), (self.phone.id, 1)])
+    self.assertEqual(reservation.status, ReservationStatus.PENDING)
+    self.assertEqual(
+      sorted(reservation.items.values_list('product_id', 'quantity')),
+      sorted([(self.phone.id, 2), (self.laptop.id, 1)]),
+    )
+    self.assertStock(self.phone, 1, ProductStatus.ACTIVE)
+    self.assertStock(self.laptop, 0, ProductStatus.OUT_OF_STOCK)
+
+  def test_insufficient_stock_reserves_nothing(self):
+    """Test that one short item rolls back the whole reservation"""
+    with self.assertRaises(inventory.InsufficientStock) as raised:
+      inventory.reserve([(self.phone.id, 1), (self.laptop.id, 2)])
+    self.assertEqual(raised.exception.product_id, self.laptop.id)
+    self.assertStock(self.phone, 3, ProductStatus.ACTIVE)
+    self.assertFalse(Reservation.objects.exists())
+
+  def test_unknown_product(self):
+    with self.assertRaises(Product.DoesNotExist):
+      inventory.reserve([(self.laptop.id + 100, 1)])
+
+  def test_release_returns_stock(self):
+    """Test that releasing restocks products and reactivates sold out ones"""
+    reservation = inventory.reserve([(self.laptop.id, 1)])
+    inventory.release(reservation.id)
+    self.assertStock(self.laptop, 1, ProductStatus.ACTIVE)
+    with self.assertRaises(inventory.ReservationError):
+      inventory.commit(reservation.id)
+
+  def test_commit_keeps_stock_sold(self):
+    reservation = inventory.reserve([(self.phone.id, 2)])
+    self.assertEqual(inventory.commit(reservation.id).status, ReservationStatus.COMMITTED)
+    self.assertStock(self.phone, 1, ProductStatus.ACTIVE)
+    with self.assertRaises(inventory.ReservationError):
+      inventory.release(reservation.id)
+    self.assertStock(self.phone, 1, ProductStatus.ACTIVE)
+
+  def test_expired_reservation_cannot_be_committed(self):
+    """Test that committing after the TTL fails and gives the stock back"""
+    reservation = inventory.reserve([(self.laptop.id, 1)], ttl=60)
+    Reservation.objects.filter(id=reservation.id).update(expires_at=timezone.now() - timedelta(seconds=1))
+    with self.assertRaises(inventory.ReservationError):
+      inventory.commit(reservation.id)
+    self.assertEqual(Reservation.objects.get(id=reservation.id).status, ReservationStatus.EXPIRED)
+    self.assertStock(self.laptop, 1, ProductStatus.ACTIVE)
+
+  def test_expire_reservations(self):
+    """Test that the sweep only releases pending reservations past their TTL"""
+    expired = inventory.reserve([(self.phone.id, 1)], ttl=60)
+    committed = inventory.reserve([(self.phone.id, 1)], ttl=60)
+    inventory.commit(committed.id)
+    live = inventory.reserve([(self.laptop.id, 1)], ttl=600)
+
+    self.assertEqual(inventory.expire_reservations(now=timezone.now() + timedelta(seconds=120)), 1)
+    statuses = dict(Reservation.objects.values_list('id', 'status'))
+    self.assertEqual(statuses[expired.id], ReservationStatus.EXPIRED)
+    self.assertEqual(statuses[committed.id], ReservationStatus.COMMITTED)
+    self.assertEqual(statuses[live.id], ReservationStatus.PENDING)
+    self.assertStock(self.phone, 2, ProductStatus.ACTIVE)
+
+
+class ConcurrentReservationTest(TransactionTestCase):
+  def test_no_oversell(self):
+    """Test that threads racing for the same stock never sell more than there is"""
+    category = Category.objects.create(title="Electronics")
+    product = Product.objects.create(name="Phone", price=Decimal("100.00"), quantity=20, category=category)
+    reserved, lock = [], threading.Lock()
+
+    def worker():
+      try:
+        for _ in range(10):
+          while True:
+            try:
+              reservation = inventory.reserve([(product.id, 1)])
+            except inventory.InsufficientStock:
+              break
+            except OperationalError:
+              # SQLite's shared in-memory test database reports "table is locked"
+              continue
+            with lock:
+              reserved.append(reservation.id)
+            break
+      finally:
+        connections.close_all()
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+
+    product.refresh_from_db()
+    self.assertEqual(len(reserved), 20)
+    self.assertEqual((product.quantity, product.status), (0, ProductStatus.OUT_OF_STOCK))
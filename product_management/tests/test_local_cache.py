@@ -0,0 +1,139 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.test import SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase
+from product_management import caching, local_cache
+from product_management.local_cache import LocalCache
+from product_management.models import Category, Discount, DiscountType, Product
+
+
+# Run by the "other worker" of `test_write_in_another_process`
+INVALIDATE = (
+  'import django; django.setup(); '
+  'from product_management import caching; caching.invalidate_products([{pk}])'
+)
+
+
+class LocalCacheTest(SimpleTestCase):
+  def test_lru_eviction(self):
+    lru = LocalCache('test', max_size=2, ttl=60)
+    for key in ('a', 'b'):
+      lru.get_or_load(key, lambda: key.upper())
+    lru.get_or_load('a', lambda: 'reloaded')
+    lru.get_or_load('c', lambda: 'C')
+    # 'b' was the least recently used
+    self.assertEqual(list(lru.entries), ['a', 'c'])
+    self.assertEqual(lru.get_or_load('a', lambda: 'reloaded'), 'A')
+    self.assertEqual(lru.stats(), {
+      'hits': 2, 'misses': 3, 'coalesced': 0, 'evictions': 1, 'expirations': 0, 'invalidations': 0, 'entries': 2,
+    })
+
+  def test_ttl(self):
+    lru = LocalCache('test', max_size=2, ttl=0.01)
+    lru.get_or_load('a', lambda: 1)
+    time.sleep(0.02)
+    self.assertEqual(lru.get_or_load('a', lambda: 2), 2)
+    self.assertEqual(lru.stats()['expirations'], 1)
+
+  def test_concurrent_misses_share_one_load(self):
+    """Test that concurrent misses for a key wait on a single load"""
+    lru = LocalCache('test', max_size=10, ttl=60)
+    loads, started = [], threading.Event()
+
+    def load():
+      loads.append(1)
+      started.set()
+      time.sleep(0.05)
+      return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(lru.get_or_load('a', load))) for _ in range(8)]
+    threads[0].start()
+    started.wait()
+    for thread in threads[1:]:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    self.assertEqual((len(loads), results), (1, ['value'] * 8))
+    self.assertEqual(lru.stats()['coalesced'], 7)
+
+  def test_invalidated_load_is_not_stored(self):
+    lru = LocalCache('test', max_size=10, ttl=60)
+
+    def load():
+      lru.invalidate(lambda key: key == 'a')
+      return 'stale'
+
+    self.assertEqual(lru.get_or_load('a', load), 'stale')
+    self.assertNotIn('a', lru)
+
+  def test_errors_are_not_cached(self):
+    lru = LocalCache('test', max_size=10, ttl=60)
+    with self.assertRaises(KeyError):
+      lru.get_or_load('a', lambda: {}['missing'])
+    self.assertEqual(lru.get_or_load('a', lambda: 1), 1)
+
+  def test_disabled(self):
+    lru = LocalCache('test', max_size=0, ttl=60)
+    self.assertEqual([lru.get_or_load('a', lambda: value) for value in (1, 2)], [1, 2])
+
+
+class ProductLocalCacheTest(APITestCase):
+  def setUp(self):
+    cache.clear()
+    local_cache.product_details.clear()
+    category = Category.objects.create(title="Electronics")
+    self.product = Product.objects.create(name="Phone", price=Decimal("100.00"), category=category)
+    self.url = f"/api/products/{self.product.id}"
+
+  def test_hot_product_skips_shared_cache(self):
+    self.client.get(self.url)
+    cache.delete(caching.product_detail_key(self.product.id))
+    with self.assertNumQueries(0):
+      response = self.client.get(self.url)
+    self.assertEqual(response.data["name"], "Phone")
+
+  def test_changes_evict(self):
+    """Test that product and discount writes evict every fieldset of the product"""
+    self.client.get(self.url)
+    self.client.get(self.url, {"fields": "id,discounted_price"})
+    Discount.objects.create(product=self.product, discount_type=DiscountType.FIXED, value=Decimal("10.00"))
+    self.assertFalse([key for key in local_cache.product_details.entries if key[0] == self.product.id])
+    self.assertEqual(self.client.get(self.url).data["discounted_price"], 90)
+
+  def test_write_in_another_process(self):
+    """Test that a write invalidated by another worker is never served from this one's memory"""
+    location = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, location)
+    backend = 'django.core.cache.backends.filebased.FileBasedCache'
+    with override_settings(CACHES={'default': {'BACKEND': backend, 'LOCATION': location}}):
+      first = self.client.get(self.url)
+      self.assertEqual(self.client.get(self.url)["ETag"], first["ETag"])
+
+      # The other worker writes the database and bumps the shared version
+      Product.objects.filter(id=self.product.id).update(name="Smartphone", updated_at=timezone.now())
+      subprocess.run(
+        [sys.executable, '-c', INVALIDATE.format(pk=self.product.id)], check=True, cwd=settings.BASE_DIR,
+        env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'ecommerce_system.settings',
+             'CACHE_BACKEND': backend, 'CACHE_LOCATION': location,
+             'SQLITE_PATH': os.path.join(location, 'worker.sqlite3')},
+      )
+      response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first["ETag"])
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(response.data["name"], "Smartphone")
+
+  def test_counters_in_metrics(self):
+    self.client.get(self.url)
+    self.client.get(self.url)
+    body = self.client.get("/metrics").content.decode()
+    self.assertRegex(body, r'local_cache_hits_total\{cache="product_detail"\} [1-9]')
+    self.assertIn('local_cache_entries{cache="product_detail"}', body)
@@ -0,0 +1,73 @@
+import random
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, SimpleTestCase, override_settings
+from rest_framework.test import APITestCase
+from product_management import metrics
+from product_management.models import Category, Product
+
+
+class HistogramTest(SimpleTestCase):
+  def test_small_values_are_exact(self):
+    histogram = metrics.Histogram()
+    for value in range(100):
+      histogram.record(value)
+    self.assertEqual((histogram.quantile(0.5), histogram.quantile(0.99)), (49, 98))
+    self.assertEqual((histogram.min, histogram.max, histogram.total), (0, 99, sum(range(100))))
+
+  def test_relative_error_is_bounded(self):
+    """Test that quantiles stay within one sub-bucket of the exact value"""
+    rng = random.Random(0)
+    values = [int(rng.lognormvariate(10, 2)) for _ in range(10000)]
+    histogram = metrics.Histogram()
+    for value in values:
+      histogram.record(value)
+    values.sort()
+    for fraction in (0.5, 0.9, 0.99, 0.999):
+      exact = values[int(fraction * len(values) + 0.5) - 1]
+      self.assertGreaterEqual(histogram.quantile(fraction), exact)
+      self.assertLessEqual(histogram.quantile(fraction), exact * (1 + 1 / metrics.HALF_SUB_BUCKETS))
+
+  def test_bucket_bounds(self):
+    for value in (127, 128, 255, 256, 1000, 10 ** 9):
+      index = metrics.Histogram.index(value)
+      self.assertLessEqual(value, metrics.Histogram.upper_bound(index))
+      self.assertGreater(value, metrics.Histogram.upper_bound(index - 1))
+
+
+class MetricsMiddlewareTest(APITestCase):
+  def setUp(self):
+    metrics.reset()
+    category = Category.objects.create(title="Electronics")
+    self.product = Product.objects.create(name="Phone", price=100.00, category=category)
+
+  def scrape(self):
+    response = self.client.get("/metrics")
+    self.assertEqual(response.status_code, 200)
+    self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+    return response.content.decode()
+
+  def test_records_per_route(self):
+    for _ in range(3):
+      self.client.get(f"/api/products/{self.product.id}")
+    self.client.get("/api/products/999")
+    body = self.scrape()
+
+    labels = 'method="GET",route="/api/products/<int:pk>"'
+    self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 4', body)
+    self.assertIn(f'http_responses_total{{{labels},status="200"}} 3', body)
+    self.assertIn(f'http_responses_total{{{labels},status="404"}} 1', body)
+    self.assertIn(f'# TYPE http_request_queries summary', body)
+    queries = metrics._routes[("GET", "/api/products/<int:pk>")].queries
+    self.assertGreater(queries.max, 0)
+    self.assertGreater(metrics._routes[("GET", "/api/products/<int:pk>")].serialization.max, 0)
+
+  def test_async_views_are_measured(self):
+    async_to_sync(AsyncClient().get)(f"/api/async/products/{self.product.id}")
+    route = metrics._routes[("GET", "/api/async/products/<int:pk>")]
+    self.assertEqual(route.latency.count, 1)
+    self.assertEqual(route.queries.max, 2)
+
+  @override_settings(METRICS_SAMPLE_RATE=0)
+  def test_sampling_turned_off(self):
+    self.client.get(f"/api/products/{self.product.id}")
+    self.assertEqual(metrics._routes, {})
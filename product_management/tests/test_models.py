@@ -1,6 +1,9 @@
 from django.test import TestCase
 from django.core.exceptions import ValidationError
-from product_management.models import Category, Discount, Product
+from datetime import timedelta
+from decimal import Decimal
+from django.utils import timezone
+from product_management.models import Category, Discount, DiscountStatus, DiscountType, Product
 
 class CategoryModelTest(TestCase):
   def setUp(self):
@@ -16,6 +19,50 @@ class CategoryModelTest(TestCase):
     self.assertIsNotNone(self.category.slug)
 
 
+class CategoryPathTest(TestCase):
+  def setUp(self):
+    """Set up a small category tree"""
+    self.root = Category.objects.create(title="Electronics")
+    self.laptops = Category.objects.create(title="Laptops", parent=self.root)
+    self.gaming = Category.objects.create(title="Gaming Laptops", parent=self.laptops)
+    self.other = Category.objects.create(title="Computers")
+
+  def test_path_includes_ancestors(self):
+    """Test that a category's path starts with its parent's path"""
+    self.assertTrue(self.gaming.path.startswith(self.laptops.path))
+    self.assertTrue(self.laptops.path.startswith(self.root.path))
+
+  def test_descendants_of(self):
+    """Test that descendants are matched by a path range"""
+    descendants = Category.objects.descendants_of(self.root)
+    self.assertEqual(set(descendants), {self.root, self.laptops, self.gaming})
+
+  def test_reparent_moves_subtree_in_one_update(self):
+    """Test that moving a category rebases its descendants with a single update"""
+    self.laptops.parent = self.other
+    # Plus reading the subtree's product counters, which are empty here
+    with self.assertNumQueries(3):
+      self.laptops.update_path()
+    self.gaming.refresh_from_db()
+    self.assertTrue(self.gaming.path.startswith(self.other.path))
+    self.assertEqual(set(Category.objects.descendants_of(self.root)), {self.root})
+
+  def test_cannot_move_under_own_subcategory(self):
+    """Test that a category can't become a child of its own descendant"""
+    self.root.parent = self.gaming
+    with self.assertRaises(ValueError):
+      self.root.save()
+
+  def test_delete_parent_detaches_subtree(self):
+    """Test that deleting a parent turns its subtree into a root tree"""
+    self.root.delete()
+    self.laptops.refresh_from_db()
+    self.gaming.refresh_from_db()
+    self.assertIsNone(self.laptops.parent)
+    self.assertEqual(self.laptops.path, str(self.laptops.pk).zfill(10))
+    self.assertEqual(self.gaming.path, self.laptops.path + str(self.gaming.pk).zfill(10))
+
+
 class ProductModelTest(TestCase):
   def setUp(self):
     """Set up test for product"""
@@ -47,4 +94,78 @@ class ProductModelTest(TestCase):
       category=self.category
     )
     with self.assertRaises(ValidationError):
-      self.product.full_clean()
\ No newline at end of file
+      self.product.full_clean()
+
+
+class EffectivePriceTest(TestCase):
+  def setUp(self):
+    """Set up a product without discounts"""
+    self.category = Category.objects.create(title="Electronics")
+    self.product = Product.objects.create(name="Phone", price=Decimal("200.00"), category=self.category)
+
+  def assertEffectivePrice(self, product, price, discount=None):
+    product.refresh_from_db()
+    self.assertEqual(product.effective_price, Decimal(price))
+    self.assertEqual(product.best_discount, discount)
+
+  def test_new_product_uses_its_price(self):
+    """Test that a product without discounts is priced at its own price"""
+    self.assertEffectivePrice(self.product, "200.00")
+
+  def test_discount_lifecycle_updates_effective_price(self):
+    """Test that creating, deactivating and deleting discounts reprices the product"""
+    fixed = Discount.objects.create(product=self.product, value=30, discount_type=DiscountType.FIXED)
+    self.assertEffectivePrice(self.product, "170.00", fixed)
+
+    percentage = Discount.objects.create(product=self.product, value=25, discount_type=DiscountType.PERCENTAGE)
+    self.assertEffectivePrice(self.product, "150.00", percentage)
+
+    percentage.status = DiscountStatus.INACTIVE
+    percentage.save()
+    self.assertEffectivePrice(self.product, "170.00", fixed)
+
+    fixed.delete()
+    self.assertEffectivePrice(self.product, "200.00")
+
+  def test_moving_discount_reprices_both_products(self):
+    """Test that moving a discount to another product reprices both of them"""
+    other = Product.objects.create(name="Tablet", price=Decimal("100.00"), category=self.category)
+    discount = Discount.objects.create(product=self.product, value=10, discount_type=DiscountType.FIXED)
+
+    discount = Discount.objects.get(pk=discount.pk)
+    discount.product = other
+    discount.save()
+    self.assertEffectivePrice(self.product, "200.00")
+    self.assertEffectivePrice(other, "90.00", discount)
+
+  def test_price_change_reprices(self):
+    """Test that changing a product's price refreshes its effective price"""
+    Discount.objects.create(product=self.product, value=10, discount_type=DiscountType.PERCENTAGE)
+    self.product.refresh_from_db()
+    self.product.price = Decimal("50.00")
+    self.product.save()
+    self.assertEffectivePrice(self.product, "45.00", self.product.discounts.get())
+
+  def test_price_change_with_update_fields(self):
+    """Test that saving only the price also saves the effective price"""
+    discount = Discount.objects.create(product=self.product, value=10, discount_type=DiscountType.PERCENTAGE)
+    self.product.refresh_from_db()
+    self.product.price = Decimal("50.00")
+    self.product.save(update_fields=["price"])
+    self.assertEffectivePrice(self.product, "45.00", discount)
+
+
+
+class DiscountValidityTest(TestCase):
+  def setUp(self):
+    """Set up a product to attach discounts to"""
+    category = Category.objects.create(title="Electronics")
+    self.product = Product.objects.create(name="Phone", price=Decimal("100.00"), category=category)
+
+  def test_is_valid(self):
+    """Test that only active, unexpired discounts are valid"""
+    now = timezone.now()
+    self.assertTrue(Discount(product=self.product, value=5, discount_type=DiscountType.FIXED).is_valid())
+    self.assertTrue(Discount(product=self.product, value=5, expires_at=now + timedelta(days=1)).is_valid())
+    self.assertFalse(Discount(product=self.product, value=5, expires_at=now - timedelta(days=1)).is_valid())
+    self.assertFalse(Discount(product=self.product, value=5, status=DiscountStatus.INACTIVE).is_valid())
@@ -0,0 +1,104 @@
+import random
+from decimal import Decimal
+from unittest import skipIf
+from django.test import SimpleTestCase, TestCase
+from product_management import pricing
+from product_management.models import Category, Discount, DiscountType, Product
+
+
+def reference_price(price, terms):
+  """Best-discount price computed one discount at a time with `apply_discount`"""
+  if not terms:
+    return round(price, 2), None
+  prices = [Discount(discount_type=kind, value=value).apply_discount(price) for kind, value in terms]
+  best = max(range(len(prices)), key=lambda position: price - prices[position])
+  return prices[best], best
+
+
+def random_catalog(size, seed=0):
+  rng = random.Random(seed)
+  prices = [Decimal(rng.randrange(0, 10 ** 7)) / 100 for _ in range(size)]
+  discounts = [
+    [
+      (rng.choice(DiscountType.values), Decimal(rng.randrange(0, 10000)) / 100)
+      for _ in range(rng.randrange(0, 5))
+    ]
+    for _ in prices
+  ]
+  return prices, discounts
+
+
+class PriceBatchTest(SimpleTestCase):
+  def setUp(self):
+    self.prices, self.discounts = random_catalog(500)
+
+  def test_matches_apply_discount(self):
+    for price, terms, result in zip(self.prices, self.discounts, pricing.price_batch(self.prices, self.discounts)):
+      expected = reference_price(price, terms)
+      self.assertEqual(result, expected)
+      # Same scale too, so the prices render identically
+      self.assertEqual(str(result[0]), str(expected[0]))
+
+  def test_first_discount_wins_ties(self):
+    terms = [(DiscountType.FIXED, Decimal('10.00')), (DiscountType.PERCENTAGE, Decimal('10.00'))]
+    self.assertEqual(pricing.price_batch([Decimal('100.00')], [terms]), [(Decimal('90.00'), 0)])
+    self.assertEqual(pricing.price_batch([Decimal('100.00')], [terms[::-1]]), [(Decimal('90.000000'), 0)])
+
+  @skipIf(pricing.np is None, 'numpy is not installed')
+  def test_engines_agree(self):
+    """Test that the vectorized ranking picks the same winners as the Decimal one"""
+    self.assertEqual(pricing._rank_cents(self.prices, self.discounts), pricing._rank_decimals(self.prices, self.discounts))
+    # Fractions of a cent can't be ranked as integer cents
+    self.assertIsNone(pricing._rank_cents([Decimal('10.005')], [[(DiscountType.FIXED, Decimal('1.00'))]]))
+
+
+class RankDiscountsTest(SimpleTestCase):
+  def setUp(self):
+    self.prices, self.discounts = random_catalog(500, seed=1)
+    self.args = (
+      [int(price * 100) for price in self.prices],
+      [owner for owner, terms in enumerate(self.discounts) for _ in terms],
+      [pricing.KINDS[kind] for terms in self.discounts for kind, _ in terms],
+      [int(value * 100) for terms in self.discounts for _, value in terms],
+    )
+
+  def assertMatchesReference(self, ranked):
+    best, taken = ranked
+    position = 0
+    for owner, (price, terms) in enumerate(zip(self.prices, self.discounts)):
+      expected, index = reference_price(price, terms)
+      self.assertEqual(best[owner], position + index if index is not None else -1)
+      self.assertEqual(Decimal(int(price * 100) * pricing.SCALE - taken[owner]) / 10 ** 6, expected)
+      position += len(terms)
+
+  def test_python_engine(self):
+    self.assertMatchesReference(pricing._rank_python(*self.args))
+
+  @skipIf(pricing.np is None, 'numpy is not installed')
+  def test_numpy_engine(self):
+    self.assertMatchesReference(pricing._rank_numpy(*self.args))
+
+  def test_falls_back_to_python_integers_beyond_int64(self):
+    best, taken = pricing.rank_discounts([10 ** 12], [0], [pricing.PERCENTAGE], [10 ** 9])
+    self.assertEqual((best, taken), ([0], [10 ** 21]))
+
+
+class RepriceAfterTest(TestCase):
+  def test_matches_apply_discount(self):
+    category = Category.objects.create(title='Electronics')
+    prices, discounts = random_catalog(50, seed=2)
+    products = Product.objects.bulk_create([
+      Product(name=f'Product {i}', price=price, category=category) for i, price in enumerate(prices)
+    ])
+    Discount.objects.bulk_create([
+      Discount(product=product, discount_type=kind, value=value)
+      for product, terms in zip(products, discounts) for kind, value in terms
+    ])
+
+    product_ids, changed = pricing.reprice_after(0, 100)
+    self.assertEqual(product_ids, [product.id for product in products])
+    self.assertEqual(set(changed), {product.id for product, terms in zip(products, discounts) if terms})
+    effective = dict(Product.objects.values_list('id', 'effective_price'))
+    for product, price, terms in zip(products, prices, discounts):
+      self.assertEqual(effective[product.id], reference_price(price, terms)[0])
+    self.assertEqual(pricing.reprice_after(0, 100), (product_ids, []))
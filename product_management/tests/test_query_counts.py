@@ -0,0 +1,96 @@
+from django.test import override_settings
+from rest_framework.test import APITestCase
+from product_management import rollups, search
+from product_management.benchmarks import (
+  ENDPOINTS, WRITE_ENDPOINTS, count_queries, seed_catalog, seed_discounts, seed_products,
+)
+from product_management.models import Category, Product
+from product_management.pricing import reprice_products
+
+# Most SQL queries each read endpoint may issue on a cache miss, whatever the
+# size of the catalog. Lower these when an endpoint gets cheaper; raising one
+# needs a reason.
+MAX_QUERIES = {
+  'category_list': 2,
+  'category_tree': 2,
+  'category_detail': 3,
+  'product_list': 3,
+  'product_list_page': 4,
+  'product_list_filtered': 5,
+  'product_detail': 3,
+  'product_search': 4,
+  'product_export': 2,
+  'async_product_list': 3,
+  'async_product_detail': 2,
+  'async_category_list': 1,
+  'change_feed': 1,
+}
+
+# Most SQL queries each write endpoint may issue, whatever the size of the
+# catalog, e.g. of the category a campaign applies to
+MAX_WRITE_QUERIES = {
+  'product_create': 10,
+  'product_bulk_create': 15,
+  'product_bulk_update': 17,
+  'discount_create': 8,
+  'discount_apply': 10,
+  'discount_campaign': 14,
+  'reservation_create': 9,
+}
+
+
+@override_settings(
+  CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}},
+  PRODUCT_LOCAL_CACHE_SIZE=0,
+)
+class EndpointQueryCountTest(APITestCase):
+  def count(self, url):
+    with count_queries() as queries:
+      response = self.client.get(url)
+      if response.streaming:
+        b''.join(response.streaming_content)
+    self.assertEqual(response.status_code, 200, url)
+    return len(queries)
+
+  def count_write(self, method, url, body):
+    with count_queries() as queries:
+      response = getattr(self.client, method)(url, body, format='json')
+    self.assertIn(response.status_code, (200, 201), f'{method.upper()} {url}: {response.content}')
+    return len(queries)
+
+  def test_seeded_catalog_is_priced(self):
+    """Test that seeding leaves effective prices as the write paths would"""
+    seed_catalog(15, depth=2, fanout=2, discounts_per_product=2)
+    self.assertTrue(Product.objects.filter(best_discount__isnull=False).exists())
+    self.assertEqual(reprice_products(Product.objects.values_list('id', flat=True)), [])
+    self.assertEqual(rollups.rebuild()[1], 0)
+
+  def test_every_endpoint_is_pinned(self):
+    self.assertEqual(set(MAX_QUERIES), set(ENDPOINTS))
+    self.assertEqual(set(MAX_WRITE_QUERIES), set(WRITE_ENDPOINTS))
+
+  def test_query_counts(self):
+    """Test that no endpoint exceeds its pinned query count or issues
+    queries per product, discount or category"""
+    ids = seed_catalog(15, depth=2, fanout=2, discounts_per_product=2)
+    small = {name: self.count(url.format(**ids)) for name, url in ENDPOINTS.items()}
+    # Each write is sent once first, so both counts see it repeated: e.g. the
+    # first discount created may change a price, the same one again can't
+    for name, (method, url, body) in WRITE_ENDPOINTS.items():
+      self.count_write(method, url.format(**ids), body(ids))
+    small_writes = {
+      name: self.count_write(method, url.format(**ids), body(ids)) for name, (method, url, body) in WRITE_ENDPOINTS.items()
+    }
+
+    # A bigger catalog, with more discounts per product, must cost the same
+    seed_products(45, seed=1, category_ids=list(Category.objects.values_list('id', flat=True)))
+    seed_discounts(per_product=4, seed=1)
+    search.rebuild_index()
+    for name, url in ENDPOINTS.items():
+      with self.subTest(endpoint=name):
+        self.assertLessEqual(small[name], MAX_QUERIES[name])
+        self.assertEqual(self.count(url.format(**ids)), small[name])
+    for name, (method, url, body) in WRITE_ENDPOINTS.items():
+      with self.subTest(endpoint=name):
+        self.assertLessEqual(small_writes[name], MAX_WRITE_QUERIES[name])
+        self.assertEqual(self.count_write(method, url.format(**ids), body(ids)), small_writes[name])
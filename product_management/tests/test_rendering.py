@@ -0,0 +1,85 @@
+import gzip
+import json
+import unittest
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from django.test import SimpleTestCase, override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+from product_management import compression, renderers
+from product_management.models import Category, Product
+
+
+class RendererTest(SimpleTestCase):
+  def test_matches_drf_output(self):
+    """Test that the fast encoder writes the same bytes as DRF's JSONRenderer"""
+    data = {
+      'price': Decimal("19.99"),
+      'at': datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc),
+      'offset': datetime(2024, 5, 1, 12, 30, tzinfo=timezone(timedelta(seconds=30))),
+      'name': "Café \u2028 line",
+      'counts': {1: 2},
+      'items': [None, True, 1.5],
+    }
+    self.assertEqual(renderers.dumps(data), renderers.stdlib_dumps(data))
+    self.assertIn(b'"2024-05-01T12:30:15.123456Z"', renderers.dumps(data))
+
+  def test_falls_back_for_unsupported_values(self):
+    self.assertEqual(renderers.dumps({'big': 2 ** 70}), b'{"big":1180591620717411303424}')
+
+  def test_indented_rendering(self):
+    content = renderers.FastJSONRenderer().render({'a': 1}, 'application/json; indent=2')
+    self.assertEqual(content, b'{\n  "a": 1\n}')
+
+
+class NegotiationTest(SimpleTestCase):
+  def test_negotiate(self):
+    self.assertEqual(compression.negotiate('gzip, deflate'), 'gzip')
+    self.assertEqual(compression.negotiate('*'), next(iter(compression.CODECS)))
+    self.assertIsNone(compression.negotiate(''))
+    self.assertIsNone(compression.negotiate('gzip;q=0, identity'))
+    self.assertIsNone(compression.negotiate('deflate'))
+
+  @unittest.skipUnless('br' in compression.CODECS, 'brotli is not installed')
+  def test_client_preference_wins(self):
+    self.assertEqual(compression.negotiate('gzip;q=1, br;q=0.5'), 'gzip')
+    self.assertEqual(compression.negotiate('gzip, br'), 'br')
+
+
+@override_settings(RESPONSE_COMPRESSION_MIN_SIZE=0)
+class CompressionMiddlewareTest(APITestCase):
+  def setUp(self):
+    category = Category.objects.create(title="Electronics")
+    for index in range(3):
+      Product.objects.create(name=f"Phone {index}", price=Decimal("100.00"), quantity=1, category=category)
+
+  def test_gzip_response(self):
+    plain = self.client.get("/api/products/")
+    response = self.client.get("/api/products/", HTTP_ACCEPT_ENCODING="gzip")
+    self.assertEqual(response["Content-Encoding"], "gzip")
+    self.assertIn("Accept-Encoding", response["Vary"])
+    self.assertEqual(gzip.decompress(response.content), plain.content)
+    self.assertEqual(int(response["Content-Length"]), len(response.content))
+
+  def test_weak_etag_still_validates(self):
+    response = self.client.get("/api/categories/", HTTP_ACCEPT_ENCODING="gzip")
+    self.assertTrue(response["ETag"].startswith('W/"'))
+    revalidated = self.client.get("/api/categories/", HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=response["ETag"])
+    self.assertEqual(revalidated.status_code, status.HTTP_304_NOT_MODIFIED)
+
+  def test_streamed_export(self):
+    plain = b''.join(self.client.get("/api/products/export/").streaming_content)
+    response = self.client.get("/api/products/export/", HTTP_ACCEPT_ENCODING="gzip")
+    self.assertEqual(response["Content-Encoding"], "gzip")
+    body = gzip.decompress(b''.join(response.streaming_content))
+    self.assertEqual(body, plain)
+    self.assertEqual(len(body.splitlines()), 3)
+
+  def test_left_alone(self):
+    """Test that small bodies, other paths and unaccepted codings aren't compressed"""
+    with override_settings(RESPONSE_COMPRESSION_MIN_SIZE=10 ** 6):
+      self.assertFalse(self.client.get("/api/products/", HTTP_ACCEPT_ENCODING="gzip").has_header("Content-Encoding"))
+    self.assertFalse(self.client.get("/api/discounts/", HTTP_ACCEPT_ENCODING="gzip").has_header("Content-Encoding"))
+    response = self.client.get("/api/products/", HTTP_ACCEPT_ENCODING="identity")
+    self.assertFalse(response.has_header("Content-Encoding"))
+    self.assertEqual(json.loads(response.content)["results"][0]["name"], "Phone 2")
@@ -0,0 +1,128 @@
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework import status
+from rest_framework.test import APITestCase
+from product_management import inventory, rollups
+from product_management.models import Category, CategoryRollup, Product, ProductStatus
+
+
+def counters(category):
+  """`(products, active, out of stock, stock value)` of a category's subtree"""
+  rollup = CategoryRollup.objects.get(category=category)
+  return (rollup.product_count, rollup.active_count, rollup.out_of_stock_count, rollup.stock_value)
+
+
+class RollupTest(TestCase):
+  def setUp(self):
+    self.root = Category.objects.create(title="Electronics")
+    self.phones = Category.objects.create(title="Phones", parent=self.root)
+    self.other = Category.objects.create(title="Garden")
+    self.phone = Product.objects.create(name="Phone", price=Decimal("100.00"), quantity=3, category=self.phones)
+    self.laptop = Product.objects.create(name="Laptop", price=Decimal("500.00"), quantity=1, category=self.root)
+
+  def assertReconciled(self):
+    self.assertEqual(rollups.rebuild()[1], 0)
+
+  def test_counts_include_descendants(self):
+    self.assertEqual(counters(self.root), (2, 2, 0, Decimal("800.00")))
+    self.assertEqual(counters(self.phones), (1, 1, 0, Decimal("300.00")))
+    self.assertEqual(counters(self.other), (0, 0, 0, Decimal("0.00")))
+    self.assertReconciled()
+
+  def test_product_updates(self):
+    """Test that saves adjust the counters of the old and new categories"""
+    self.phone.status = ProductStatus.OUT_OF_STOCK
+    self.phone.quantity = 0
+    self.phone.save()
+    self.assertEqual(counters(self.root), (2, 1, 1, Decimal("500.00")))
+
+    self.laptop.category = self.other
+    self.laptop.save()
+    self.assertEqual(counters(self.root), (1, 0, 1, Decimal("0.00")))
+    self.assertEqual(counters(self.other), (1, 1, 0, Decimal("500.00")))
+    self.assertReconciled()
+
+  def test_product_delete(self):
+    self.phone.delete()
+    self.assertEqual(counters(self.root), (1, 1, 0, Decimal("500.00")))
+    self.assertEqual(counters(self.phones), (0, 0, 0, Decimal("0.00")))
+    self.assertReconciled()
+
+  def test_category_move(self):
+    """Test that a moved subtree's counters leave its old ancestors for its new ones"""
+    self.phones.parent = self.other
+    self.phones.save()
+    self.assertEqual(counters(self.root), (1, 1, 0, Decimal("500.00")))
+    self.assertEqual(counters(self.other), (1, 1, 0, Decimal("300.00")))
+    self.assertReconciled()
+
+  def test_category_delete(self):
+    """Test that deleting a category drops its products and orphans its subtree"""
+    self.root.delete()
+    self.assertFalse(CategoryRollup.objects.filter(category_id=self.root.id).exists())
+    self.assertEqual(counters(self.phones), (1, 1, 0, Decimal("300.00")))
+    self.assertReconciled()
+
+  def test_stock_changes(self):
+    """Test that reservations adjust the counters by what they change, without recounting"""
+    with CaptureQueriesContext(connection) as queries:
+      reservation = inventory.reserve([(self.laptop.id, 1), (self.phone.id, 2)])
+    self.assertFalse([query for query in queries if 'GROUP BY' in query['sql']])
+    self.assertEqual(counters(self.root), (2, 1, 1, Decimal("100.00")))
+    self.assertEqual(counters(self.phones), (1, 1, 0, Decimal("100.00")))
+    inventory.release(reservation.id)
+    self.assertEqual(counters(self.root), (2, 2, 0, Decimal("800.00")))
+    self.assertReconciled()
+
+  def test_reconcile_command(self):
+    CategoryRollup.objects.filter(category=self.root).update(product_count=7)
+    CategoryRollup.objects.filter(category=self.other).delete()
+    output = StringIO()
+    call_command('reconcile_rollups', stdout=output)
+    self.assertIn('Reconciled 3 categories, corrected 2', output.getvalue())
+    self.assertEqual(counters(self.root), (2, 2, 0, Decimal("800.00")))
+    self.assertReconciled()
+
+  def test_missing_rows_are_rebuilt(self):
+    CategoryRollup.objects.all().delete()
+    Product.objects.create(name="Tablet", price=Decimal("50.00"), quantity=2, category=self.phones)
+    self.assertEqual(counters(self.root), (3, 3, 0, Decimal("900.00")))
+
+
+class CategoryRollupApiTest(APITestCase):
+  def setUp(self):
+    self.root = Category.objects.create(title="Electronics")
+    self.phones = Category.objects.create(title="Phones", parent=self.root)
+    Product.objects.create(name="Phone", price=Decimal("100.00"), quantity=2, category=self.phones)
+    Product.objects.create(
+      name="Laptop", price=Decimal("500.00"), quantity=0, status=ProductStatus.OUT_OF_STOCK, category=self.root
+    )
+
+  def test_counters_in_category_responses(self):
+    response = self.client.get("/api/categories/", {"tree": "true"})
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    root = response.json()[0]
+    self.assertEqual(
+      (root["product_count"], root["active_product_count"], root["out_of_stock_count"], root["stock_value"]),
+      (2, 1, 1, "200.00"),
+    )
+    self.assertEqual(root["subcategories"][0]["product_count"], 1)
+
+  def test_no_aggregates_at_read_time(self):
+    """Test that the counters come with the categories, whatever their number"""
+    for index in range(5):
+      Category.objects.create(title=f"Accessories {index}", parent=self.phones)
+    # One query for the validators and one for the categories and their counters
+    with self.assertNumQueries(2):
+      self.client.get("/api/categories/")
+
+  def test_bulk_update_moves_counters(self):
+    phone = Product.objects.get(name="Phone")
+    response = self.client.patch("/api/products/bulk/", [{"id": phone.id, "category": self.root.id}], format="json")
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(counters(self.phones), (0, 0, 0, Decimal("0.00")))
+    self.assertEqual(counters(self.root), (2, 1, 1, Decimal("200.00")))
@@ -1,5 +1,9 @@
+from decimal import Decimal
 from django.test import TestCase
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from product_management.models import Product, Category, Discount, DiscountType
+from product_management.product_rows import ProductRows, parse_fields
 from product_management.serializers import ProductSerializer, DiscountSerializer, CategorySerializer
 
 class ProductSerializerTest(TestCase):
@@ -77,4 +81,49 @@ class ProductSerializerTest(TestCase):
     serializer = ProductSerializer(data=incomplete_data)
     self.assertFalse(serializer.is_valid())
     self.assertIn("price", serializer.errors)
-    self.assertIn("category", serializer.errors)
\ No newline at end of file
+    self.assertIn("category", serializer.errors)
+
+class ProductRowsTest(TestCase):
+  def setUp(self):
+    self.category = Category.objects.create(title="Electronics")
+    prices = ["0.00", "19.99", "100.00", "2500.99", "99999999.99"]
+    for i, price in enumerate(prices):
+      product = Product.objects.create(
+        name=f"Product {i} éè \"quoted\"", description="" if i % 2 else f"Line one\nline {i}",
+        price=Decimal(price), quantity=i, status=["active", "inactive", "out-of-stock"][i % 3], category=self.category,
+      )
+      Discount.objects.create(product=product, value=Decimal("12.50"), discount_type=DiscountType.PERCENTAGE)
+      # Ties and discounts larger than the price are priced like the serializer does
+      Discount.objects.create(product=product, value=Decimal(price) / 8, discount_type=DiscountType.FIXED)
+      Discount.objects.create(product=product, value=Decimal("1000.00"), discount_type=DiscountType.FIXED, status="inactive")
+
+  def render(self, data):
+    return JSONRenderer().render(data)
+
+  def test_byte_identical_to_serializer(self):
+    products = Product.objects.with_active_discounts().order_by("id")
+    renderer = ProductRows()
+    self.assertEqual(
+      self.render(renderer.render(renderer.rows(products))),
+      self.render(ProductSerializer(products, many=True).data),
+    )
+    for product in products:
+      self.assertEqual(
+        self.render(renderer.render(renderer.rows(Product.objects.filter(id=product.id)))[0]),
+        self.render(ProductSerializer(product).data),
+      )
+
+  def test_sparse_fields(self):
+    fields = parse_fields({"fields": "discounted_price,name, id"})
+    self.assertEqual(fields, ("id", "name", "discounted_price"))
+    renderer = ProductRows(fields)
+    full = ProductSerializer(Product.objects.with_active_discounts().order_by("id"), many=True).data
+    self.assertEqual(
+      renderer.render(renderer.rows(Product.objects.order_by("id"))),
+      [{field: row[field] for field in fields} for row in full],
+    )
+
+  def test_invalid_fields(self):
+    for fields in ("id,secret", ",", " "):
+      with self.assertRaises(ValidationError):
+        parse_fields({"fields": fields})
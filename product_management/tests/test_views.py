@@ -1,6 +1,15 @@
+import csv
+import io
+import json
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APITestCase
 from rest_framework import status
-from product_management.models import Category, Product
+from product_management import local_cache, search
+from product_management.models import Category, Product, Discount, DiscountType
 
 class CategoryViewSetTest(APITestCase):
   def setUp(self):
@@ -47,6 +56,48 @@ class CategoryViewSetTest(APITestCase):
         self.assertIn('title', response.data)
         self.assertIn('category with this title already exists.', response.data['title'][0])
 
+
+class CategoryTreeTest(APITestCase):
+  def setUp(self):
+    self.root = Category.objects.create(title="Electronics")
+    self.laptops = Category.objects.create(title="Laptops", parent=self.root)
+    self.gaming = Category.objects.create(title="Gaming Laptops", parent=self.laptops)
+    self.phones = Category.objects.create(title="Phones", parent=self.root)
+
+  def test_list_fetches_forest_once(self):
+    """Test that the whole category forest is fetched with one query"""
+    for i in range(5):
+      Category.objects.create(title=f"Accessories - {i}", parent=self.gaming)
+    # One aggregate for the ETag and one query for the categories
+    with self.assertNumQueries(2):
+      response = self.client.get("/api/categories/")
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(len(response.data), 9)
+
+  def test_tree_mode_returns_roots(self):
+    response = self.client.get("/api/categories/?tree=true")
+    self.assertEqual(len(response.data), 1)
+    root = response.data[0]
+    self.assertEqual(root["title"], "Electronics")
+    self.assertEqual([c["title"] for c in root["subcategories"]], ["Laptops", "Phones"])
+    self.assertEqual(root["subcategories"][0]["subcategories"][0]["title"], "Gaming Laptops")
+
+  def test_depth_limits_nesting(self):
+    response = self.client.get("/api/categories/?tree=true&depth=1")
+    laptops = response.data[0]["subcategories"][0]
+    self.assertEqual(laptops["title"], "Laptops")
+    self.assertEqual(laptops["subcategories"], [])
+
+  def test_invalid_depth(self):
+    response = self.client.get("/api/categories/?depth=-1")
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_retrieve_subtree(self):
+    with self.assertNumQueries(3):
+      response = self.client.get(f"/api/categories/{self.laptops.id}/")
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.data["subcategories"][0]["title"], "Gaming Laptops")
+
   
 class ProductViewSetTest(APITestCase):
   def setUp(self):
@@ -58,8 +109,561 @@ class ProductViewSetTest(APITestCase):
       category=self.category,
     ) for i in range(15)]
     
+  def test_filter_by_category_with_descendants(self):
+    laptops = Category.objects.create(title="Laptops", parent=self.category)
+    gaming = Category.objects.create(title="Gaming Laptops", parent=laptops)
+    Product.objects.create(name="Gaming laptop", price=10, category=gaming)
+    other = Category.objects.create(title="Furniture")
+    Product.objects.create(name="Chair", price=10, category=other)
+
+    response = self.client.get(f"/api/products/?category={laptops.id}&include_descendants=true")
+    self.assertEqual([p["name"] for p in response.data["results"]], ["Gaming laptop"])
+
+    response = self.client.get(f"/api/products/?category={self.category.id}&include_descendants=true&pagination=page")
+    self.assertEqual(response.data["count"], 16)
+
   def test_paginated_products(self):
     response = self.client.get("/api/products/?page_size=10")
     self.assertEqual(response.status_code, status.HTTP_200_OK)
     self.assertTrue("next" in response.data)
-    self.assertEqual(len(response.data["results"]), 10)
\ No newline at end of file
+    self.assertEqual(len(response.data["results"]), 10)
+
+  def walk_pages(self, url):
+    names = []
+    while url:
+      response = self.client.get(url)
+      self.assertEqual(response.status_code, status.HTTP_200_OK)
+      names.extend(product["name"] for product in response.data["results"])
+      url = response.data["next"]
+    return names
+
+  def test_cursor_pagination_walks_every_product_once(self):
+    names = self.walk_pages("/api/products/?page_size=4&ordering=created_at")
+    self.assertEqual(names, [f'Product - {i}' for i in range(15)])
+
+  def test_cursor_pagination_by_category(self):
+    other = Category.objects.create(title="Furniture")
+    Product.objects.create(name="Chair", price=10, category=other)
+    names = self.walk_pages("/api/products/?page_size=4&ordering=-category")
+    self.assertEqual(names[0], "Chair")
+    self.assertEqual(len(names), 16)
+
+  def test_cursor_previous_page(self):
+    first = self.client.get("/api/products/?page_size=5&ordering=created_at")
+    second = self.client.get(first.data["next"])
+    previous = self.client.get(second.data["previous"])
+    self.assertEqual(previous.data["results"], first.data["results"])
+    self.assertIsNone(first.data["previous"])
+
+  def test_cursor_pagination_skips_offset(self):
+    first = self.client.get("/api/products/?page_size=5")
+    with CaptureQueriesContext(connection) as context:
+      self.client.get(first.data["next"])
+    self.assertFalse(any("OFFSET" in query["sql"] for query in context.captured_queries))
+
+  def test_invalid_cursor_and_ordering(self):
+    self.assertEqual(self.client.get("/api/products/?cursor=bogus").status_code, status.HTTP_404_NOT_FOUND)
+    self.assertEqual(self.client.get("/api/products/?ordering=name").status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_order_and_filter_by_effective_price(self):
+    cheap = Product.objects.create(name="Cheap", price=10, category=self.category)
+    Discount.objects.create(product=cheap, value=8, discount_type=DiscountType.FIXED)
+    pricey = Product.objects.create(name="Pricey", price=50, category=self.category)
+
+    names = self.walk_pages("/api/products/?page_size=4&ordering=effective_price")
+    self.assertEqual(names[0], "Cheap")
+    self.assertEqual(names[-1], "Pricey")
+
+    response = self.client.get("/api/products/?min_price=5&max_price=20&page_size=50")
+    self.assertEqual(len(response.data["results"]), 15)
+    response = self.client.get("/api/products/?max_price=2")
+    self.assertEqual([p["name"] for p in response.data["results"]], ["Cheap"])
+    self.assertEqual(self.client.get("/api/products/?min_price=abc").status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_page_number_fallback(self):
+    response = self.client.get("/api/products/?page=2")
+    self.assertEqual(response.data["count"], 15)
+    self.assertEqual(len(response.data["results"]), 5)
+
+
+class ProductFilterTest(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.phones = Category.objects.create(title="Phones")
+    self.laptops = Category.objects.create(title="Laptops")
+    self.phone = Product.objects.create(name="Phone", price=20, quantity=0, category=self.phones)
+    self.tablet = Product.objects.create(name="Tablet", price=300, quantity=3, category=self.phones, status="inactive")
+    self.laptop = Product.objects.create(name="Laptop", price=1500, quantity=10, category=self.laptops)
+    Discount.objects.create(product=self.laptop, value=10, discount_type=DiscountType.PERCENTAGE)
+
+  def names(self, query):
+    response = self.client.get(f"/api/products/?ordering=created_at&{query}")
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return [product["name"] for product in response.data["results"]]
+
+  def test_filters(self):
+    self.assertEqual(self.names("status=inactive"), ["Tablet"])
+    self.assertEqual(self.names("in_stock=true"), ["Tablet", "Laptop"])
+    self.assertEqual(self.names("in_stock=false"), ["Phone"])
+    self.assertEqual(self.names("min_quantity=5"), ["Laptop"])
+    self.assertEqual(self.names("has_discount=true"), ["Laptop"])
+    self.assertEqual(self.names("has_discount=false&category=" + str(self.phones.id)), ["Phone", "Tablet"])
+    self.assertEqual(self.client.get("/api/products/?status=sold").status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_facets_in_one_query(self):
+    with CaptureQueriesContext(connection) as context:
+      response = self.client.get("/api/products/?facets=true")
+    without_facets = len(context.captured_queries)
+    cache.clear()
+    with CaptureQueriesContext(connection) as context:
+      self.client.get("/api/products/")
+    self.assertEqual(without_facets, len(context.captured_queries) + 1)
+
+    facets = response.data["facets"]
+    self.assertEqual(facets["status"], [{"value": "active", "count": 2}, {"value": "inactive", "count": 1}])
+    self.assertEqual(facets["category"], [
+      {"id": self.phones.id, "title": "Phones", "count": 2},
+      {"id": self.laptops.id, "title": "Laptops", "count": 1},
+    ])
+    counts = {bucket["min"]: bucket["count"] for bucket in facets["price"]}
+    self.assertEqual(counts, {"0": 1, "25": 0, "50": 0, "100": 0, "250": 1, "500": 0, "1000": 1})
+    self.assertIsNone(facets["price"][-1]["max"])
+
+    # Facets describe the filtered products
+    facets = self.client.get(f"/api/products/?facets=true&category={self.laptops.id}").data["facets"]
+    self.assertEqual(facets["status"], [{"value": "active", "count": 1}])
+
+
+class ProductDiscountQueryCountTest(APITestCase):
+  def setUp(self):
+    self.category = Category.objects.create(title="Electronics", description="All electronic products")
+
+  def create_products(self, count):
+    for i in range(count):
+      product = Product.objects.create(name=f'Product - {i}', price=100, quantity=5, category=self.category)
+      Discount.objects.create(product=product, value=10, discount_type=DiscountType.PERCENTAGE)
+      Discount.objects.create(product=product, value=5, discount_type=DiscountType.FIXED)
+
+  def count_queries(self, url):
+    with CaptureQueriesContext(connection) as context:
+      response = self.client.get(url)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return len(context.captured_queries)
+
+  def test_list_query_count_is_constant(self):
+    """Test that listing products doesn't issue a discount query per product"""
+    self.create_products(2)
+    small_page = self.count_queries("/api/products/")
+    self.create_products(8)
+    full_page = self.count_queries("/api/products/")
+    self.assertEqual(small_page, full_page)
+
+  def test_list_discounted_price(self):
+    self.create_products(1)
+    response = self.client.get("/api/products/")
+    self.assertEqual(response.data["results"][0]["discounted_price"], 90)
+
+  def test_detail_query_count(self):
+    self.create_products(1)
+    product = Product.objects.get()
+    with self.assertNumQueries(3):
+      response = self.client.get(f"/api/products/{product.id}")
+    self.assertEqual(response.data["discounted_price"], 90)
+
+
+
+class ProductCacheTest(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.category = Category.objects.create(title="Electronics", description="All electronic products")
+    self.product = Product.objects.create(name="Phone", price=100, quantity=5, category=self.category)
+
+  def test_detail_is_cached(self):
+    self.client.get(f"/api/products/{self.product.id}")
+    with self.assertNumQueries(0):
+      response = self.client.get(f"/api/products/{self.product.id}")
+    self.assertEqual(response.data["name"], "Phone")
+
+  def test_list_is_cached_per_query(self):
+    self.client.get("/api/products/")
+    with self.assertNumQueries(0):
+      self.client.get("/api/products/")
+    with self.assertNumQueries(3):
+      self.client.get("/api/products/?ordering=created_at")
+
+  def test_product_update_invalidates(self):
+    self.client.get(f"/api/products/{self.product.id}")
+    self.client.get("/api/products/")
+    self.product.name = "Smartphone"
+    self.product.save()
+    self.assertEqual(self.client.get(f"/api/products/{self.product.id}").data["name"], "Smartphone")
+    self.assertEqual(self.client.get("/api/products/").data["results"][0]["name"], "Smartphone")
+
+  def test_apply_discount_invalidates(self):
+    other = Product.objects.create(name="Tablet", price=50, quantity=5, category=self.category)
+    discount = Discount.objects.create(product=other, value=10, discount_type=DiscountType.FIXED)
+    self.assertEqual(self.client.get(f"/api/products/{self.product.id}").data["discounted_price"], 100)
+    self.assertEqual(self.client.get(f"/api/products/{other.id}").data["discounted_price"], 40)
+
+    response = self.client.post(f"/api/products/{self.product.id}/{discount.id}/")
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(self.client.get(f"/api/products/{self.product.id}").data["discounted_price"], 90)
+    self.assertEqual(self.client.get(f"/api/products/{other.id}").data["discounted_price"], 50)
+
+
+
+class ConditionalGetTest(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.category = Category.objects.create(title="Electronics", description="All electronic products")
+    self.product = Product.objects.create(name="Phone", price=100, quantity=5, category=self.category)
+    self.url = f"/api/products/{self.product.id}"
+
+  def test_detail_etag_not_modified(self):
+    response = self.client.get(self.url)
+    self.assertIn("ETag", response.headers)
+    self.assertIn("Last-Modified", response.headers)
+
+    cache.clear()
+    local_cache.product_details.clear()
+    with self.assertNumQueries(1):
+      response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response.headers["ETag"])
+    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    self.assertEqual(response.content, b"")
+
+  def test_discount_changes_etag(self):
+    etag = self.client.get(self.url).headers["ETag"]
+    Discount.objects.create(product=self.product, value=10, discount_type=DiscountType.FIXED)
+    response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertNotEqual(response.headers["ETag"], etag)
+    self.assertEqual(response.data["discounted_price"], 90)
+
+  def test_list_etag(self):
+    etag = self.client.get("/api/products/").headers["ETag"]
+    self.assertEqual(self.client.get("/api/products/", HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+    Product.objects.create(name="Tablet", price=50, quantity=5, category=self.category)
+    self.assertEqual(self.client.get("/api/products/", HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+  def test_category_list_etag(self):
+    etag = self.client.get("/api/categories/").headers["ETag"]
+    with self.assertNumQueries(1):
+      response = self.client.get("/api/categories/", HTTP_IF_NONE_MATCH=etag)
+    self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    Category.objects.create(title="Laptops", parent=self.category)
+    self.assertEqual(self.client.get("/api/categories/", HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+  def test_missing_product(self):
+    self.assertEqual(self.client.get("/api/products/999").status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProductBulkViewTest(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.categories = [Category.objects.create(title=f"Category - {i}") for i in range(3)]
+
+  def rows(self, count):
+    return [
+      {"name": f"Product - {i}", "price": "10.50", "quantity": 3, "category": self.categories[i % 3].id}
+      for i in range(count)
+    ]
+
+  def test_bulk_create_reports_each_row(self):
+    rows = self.rows(3)
+    rows[1]["price"] = -1
+    rows.append({"name": "No category", "price": 5, "category": 999})
+    response = self.client.post("/api/products/bulk/", rows, format="json")
+
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.data["created"], 2)
+    self.assertEqual(response.data["failed"], 2)
+    self.assertEqual([r["status"] for r in response.data["results"]], ["created", "error", "created", "error"])
+    self.assertIn("price", response.data["results"][1]["errors"])
+    self.assertIn("category", response.data["results"][3]["errors"])
+    self.assertEqual(Product.objects.count(), 2)
+
+  def test_bulk_create_query_count_is_constant(self):
+    with CaptureQueriesContext(connection) as small:
+      self.client.post("/api/products/bulk/?batch_size=1000", self.rows(3), format="json")
+    with CaptureQueriesContext(connection) as large:
+      self.client.post("/api/products/bulk/?batch_size=1000", self.rows(60), format="json")
+    self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+    self.assertEqual(Product.objects.count(), 63)
+
+  def test_bulk_create_in_batches(self):
+    with CaptureQueriesContext(connection) as context:
+      self.client.post("/api/products/bulk/?batch_size=2", self.rows(5), format="json")
+    inserts = [q for q in context.captured_queries if q["sql"].startswith('INSERT INTO "product_management_product"')]
+    self.assertEqual(len(inserts), 3)
+
+  def test_bulk_update(self):
+    self.client.post("/api/products/bulk/", self.rows(2), format="json")
+    first, second = Product.objects.order_by("id")
+    self.client.get(f"/api/products/{first.id}")
+    response = self.client.patch("/api/products/bulk/", [
+      {"id": first.id, "price": "20.00"},
+      {"id": second.id, "quantity": -5},
+      {"id": 999, "name": "Missing"},
+    ], format="json")
+
+    self.assertEqual(response.data["updated"], 1)
+    self.assertEqual([r["status"] for r in response.data["results"]], ["updated", "error", "error"])
+    self.assertEqual(self.client.get(f"/api/products/{first.id}").data["price"], "20.00")
+
+  def test_bulk_update_writes_only_changed_fields(self):
+    """Test that a row's update leaves the fields it didn't send, e.g. stock, to concurrent writers"""
+    self.client.post("/api/products/bulk/", self.rows(2), format="json")
+    first, second = Product.objects.order_by("id")
+    with CaptureQueriesContext(connection) as context:
+      self.client.patch("/api/products/bulk/", [
+        {"id": first.id, "quantity": 7},
+        {"id": second.id, "name": "Renamed"},
+      ], format="json")
+    updates = [q["sql"] for q in context.captured_queries if q["sql"].startswith('UPDATE "product_management_product"')]
+    self.assertTrue([sql for sql in updates if '"quantity" =' in sql])
+    self.assertFalse([sql for sql in updates if '"quantity" =' in sql and '"name" =' in sql])
+    self.assertEqual(Product.objects.get(id=first.id).quantity, 7)
+    self.assertEqual(Product.objects.get(id=second.id).name, "Renamed")
+
+  def test_bulk_rejects_bool_ids(self):
+    self.client.post("/api/products/bulk/", self.rows(2), format="json")
+    response = self.client.patch("/api/products/bulk/", [{"id": True, "name": "Renamed"}], format="json")
+    self.assertEqual(response.data["failed"], 1)
+    self.assertFalse(Product.objects.filter(name="Renamed").exists())
+    response = self.client.delete("/api/products/bulk/", {"ids": [True]}, format="json")
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(Product.objects.count(), 2)
+
+  def test_bulk_delete(self):
+    self.client.post("/api/products/bulk/", self.rows(2), format="json")
+    ids = list(Product.objects.values_list("id", flat=True))
+    response = self.client.delete("/api/products/bulk/", {"ids": ids + [999]}, format="json")
+    self.assertEqual(response.data["deleted"], 2)
+    self.assertEqual(response.data["failed"], 1)
+    self.assertFalse(Product.objects.exists())
+
+  def test_bulk_rejects_non_list(self):
+    response = self.client.post("/api/products/bulk/", {"name": "Single"}, format="json")
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductExportViewTest(APITestCase):
+  def setUp(self):
+    self.category = Category.objects.create(title="Electronics")
+    self.other = Category.objects.create(title="Furniture")
+    self.phone = Product.objects.create(name="Phone", price=100, quantity=5, category=self.category)
+    Discount.objects.create(product=self.phone, value=25, discount_type=DiscountType.PERCENTAGE)
+    self.chair = Product.objects.create(name="Chair", price=40, quantity=2, category=self.other)
+
+  def export(self, query=""):
+    response = self.client.get(f"/api/products/export/{query}")
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertTrue(response.streaming)
+    return response, b"".join(response.streaming_content).decode()
+
+  def test_ndjson_export_matches_detail(self):
+    response, body = self.export()
+    self.assertEqual(response["Content-Type"], "application/x-ndjson")
+    rows = [json.loads(line) for line in body.splitlines()]
+    self.assertEqual([row["name"] for row in rows], ["Phone", "Chair"])
+    detail = self.client.get(f"/api/products/{self.phone.id}")
+    self.assertEqual(rows[0], json.loads(detail.content))
+
+  def test_csv_export(self):
+    response, body = self.export("?output=csv")
+    self.assertEqual(response["Content-Type"], "text/csv")
+    rows = list(csv.reader(io.StringIO(body)))
+    self.assertEqual(rows[0][-1], "discounted_price")
+    self.assertEqual(rows[1][1], "Phone")
+    self.assertEqual(rows[1][-1], "75.0000")
+
+  def test_export_filters(self):
+    _, body = self.export(f"?category={self.other.id}")
+    self.assertEqual(len(body.splitlines()), 1)
+
+    Product.objects.filter(id=self.chair.id).update(updated_at="2020-01-01T00:00:00Z")
+    _, body = self.export("?updated_since=2024-01-01T00:00:00Z")
+    self.assertEqual([json.loads(line)["name"] for line in body.splitlines()], ["Phone"])
+
+  def test_export_invalid_params(self):
+    self.assertEqual(self.client.get("/api/products/export/?output=xml").status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(self.client.get("/api/products/export/?updated_since=yesterday").status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ProductSearchViewTest(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.phones = Category.objects.create(title="Phones")
+    self.laptops = Category.objects.create(title="Laptops")
+    self.phone = Product.objects.create(name="Smartphone X", description="A phone with a great camera", price=500, category=self.phones)
+    self.case = Product.objects.create(name="Phone case", description="Protects your smartphone", price=20, category=self.phones)
+    self.laptop = Product.objects.create(name="Laptop Pro", description="Comes with a webcam and a camera cover", price=1500, category=self.laptops, status="inactive")
+
+  def search(self, **params):
+    response = self.client.get("/api/products/search/", params)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    return response.data
+
+  def assertSearchBehaviour(self):
+    # Name matches rank above description matches
+    data = self.search(q="smartphone")
+    self.assertEqual([product['id'] for product in data['results']], [self.phone.id, self.case.id])
+
+    # Prefix matching, every word has to match
+    self.assertEqual({product['id'] for product in self.search(q="cam")['results']}, {self.phone.id, self.laptop.id})
+    self.assertEqual([product['id'] for product in self.search(q="cam phone")['results']], [self.phone.id])
+
+    data = self.search(q="camera")
+    self.assertEqual(data['count'], 2)
+    self.assertEqual(
+      data['facets']['category'],
+      [{'id': self.phones.id, 'title': 'Phones', 'count': 1}, {'id': self.laptops.id, 'title': 'Laptops', 'count': 1}],
+    )
+    self.assertEqual(data['facets']['status'], [{'value': 'active', 'count': 1}, {'value': 'inactive', 'count': 1}])
+    self.assertEqual([product['id'] for product in self.search(q="camera", status="active")['results']], [self.phone.id])
+    self.assertEqual([product['id'] for product in self.search(q="camera", category=self.laptops.id)['results']], [self.laptop.id])
+
+    # The index follows saves, bulk updates and deletes
+    self.laptop.name = "Notebook Pro"
+    self.laptop.save()
+    self.assertEqual(self.search(q="laptop")['count'], 0)
+    self.client.patch("/api/products/bulk/", [{"id": self.case.id, "name": "Sleeve"}], format='json')
+    self.assertEqual(self.search(q="sleeve")['results'][0]['id'], self.case.id)
+    self.phone.delete()
+    self.assertEqual(self.search(q="smartphone")['results'][0]['id'], self.case.id)
+    self.assertEqual(self.search(q="smartphone")['count'], 1)
+
+  def test_fts5_backend(self):
+    self.assertEqual(search.get_backend().name, 'fts5')
+    self.assertSearchBehaviour()
+
+  def test_token_backend(self):
+    with override_settings(PRODUCT_SEARCH_BACKEND='tokens'):
+      search.rebuild_index()
+      self.assertSearchBehaviour()
+
+  def test_query_is_required(self):
+    response = self.client.get("/api/products/search/", {'q': ' ?! '})
+    self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AsyncViewsTest(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.root = Category.objects.create(title="Electronics")
+    self.child = Category.objects.create(title="Phones", parent=self.root)
+    Category.objects.create(title="Cases", parent=self.child)
+    self.products = [Product.objects.create(name=f"Product {i}", price=100 + i, category=self.child) for i in range(12)]
+    Discount.objects.create(product=self.products[0], value=10, discount_type=DiscountType.PERCENTAGE)
+    Discount.objects.create(product=self.products[0], value=15, discount_type=DiscountType.FIXED)
+
+  def async_get(self, url):
+    return async_to_sync(self.async_client.get)(url)
+
+  def assertSameResponse(self, async_url, sync_url):
+    response = self.async_get(async_url)
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    data, expected = response.json(), self.client.get(sync_url).json()
+    if isinstance(data, dict) and "results" in data:
+      # Pagination links point at the endpoint they came from
+      for link in ("next", "previous"):
+        self.assertEqual(bool(data.pop(link)), bool(expected.pop(link)))
+    self.assertEqual(data, expected)
+    return data
+
+  def test_product_list(self):
+    data = self.assertSameResponse("/api/async/products/?page=2", "/api/products/?pagination=page&page=2")
+    self.assertEqual(data["count"], 12)
+    self.assertSameResponse(
+      "/api/async/products/?ordering=created_at&page_size=5",
+      "/api/products/?pagination=page&ordering=created_at&page_size=5",
+    )
+    self.assertSameResponse(
+      f"/api/async/products/?category={self.root.id}&include_descendants=true&max_price=100",
+      f"/api/products/?pagination=page&category={self.root.id}&include_descendants=true&max_price=100",
+    )
+    self.assertEqual(self.async_get("/api/async/products/?page=3").status_code, status.HTTP_404_NOT_FOUND)
+    self.assertEqual(self.async_get("/api/async/products/?ordering=name").status_code, status.HTTP_400_BAD_REQUEST)
+
+  def test_product_list_gathers_count_page_and_discounts(self):
+    with CaptureQueriesContext(connection) as context:
+      self.async_get("/api/async/products/")
+    self.assertEqual(len(context.captured_queries), 3)
+
+  def test_product_detail(self):
+    pk = self.products[0].id
+    self.assertSameResponse(f"/api/async/products/{pk}", f"/api/products/{pk}")
+    self.assertEqual(self.async_get("/api/async/products/999").status_code, status.HTTP_404_NOT_FOUND)
+
+  def test_category_list(self):
+    self.assertSameResponse("/api/async/categories/", "/api/categories/")
+    self.assertSameResponse("/api/async/categories/?tree=true&depth=1", "/api/categories/?tree=true&depth=1")
+    self.assertEqual(self.async_get("/api/async/categories/?depth=-1").status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ReservationViewTest(APITestCase):
+  def setUp(self):
+    self.category = Category.objects.create(title="Electronics")
+    self.product = Product.objects.create(name="Phone", price=100.00, quantity=2, category=self.category)
+
+  def reserve(self, quantity, **data):
+    return self.client.post("/api/reservations/", {"items": [{"product": self.product.id, "quantity": quantity}], **data}, format="json")
+
+  def test_reserve_and_commit(self):
+    response = self.reserve(2, ttl=60)
+    self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+    self.assertEqual(response.data["status"], "pending")
+    self.assertEqual(response.data["items"], [{"product": self.product.id, "quantity": 2}])
+
+    # Sold out: the product listing reflects the new stock right away
+    detail = self.client.get(f"/api/products/{self.product.id}")
+    self.assertEqual((detail.data["quantity"], detail.data["status"]), (0, "out-of-stock"))
+    self.assertEqual(self.reserve(1).status_code, status.HTTP_409_CONFLICT)
+
+    response = self.client.post(f"/api/reservations/{response.data['id']}/commit/")
+    self.assertEqual(response.status_code, status.HTTP_200_OK)
+    self.assertEqual(response.data["status"], "committed")
+    response = self.client.post(f"/api/reservations/{response.data['id']}/release/")
+    self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+  def test_release(self):
+    reservation = self.reserve(1).data
+    response = self.client.post(f"/api/reservations/{reservation['id']}/release/")
+    self.assertEqual(response.data["status"], "released")
+    self.assertEqual(self.client.get(f"/api/reservations/{reservation['id']}").data["status"], "released")
+    self.product.refresh_from_db()
+    self.assertEqual(self.product.quantity, 2)
+
+  def test_invalid_requests(self):
+    self.assertEqual(self.reserve(0).status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(self.client.post("/api/reservations/", {"items": []}, format="json").status_code, status.HTTP_400_BAD_REQUEST)
+    response = self.client.post("/api/reservations/", {"items": [{"product": 999, "quantity": 1}]}, format="json")
+    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+    self.assertEqual(self.client.post("/api/reservations/999/commit/").status_code, status.HTTP_404_NOT_FOUND)
+    self.assertEqual(self.client.get("/api/reservations/999").status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProductSparseFieldsTest(APITestCase):
+  def setUp(self):
+    cache.clear()
+    self.category = Category.objects.create(title="Electronics")
+    self.product = Product.objects.create(name="Phone", price=100, quantity=5, category=self.category)
+    Discount.objects.create(product=self.product, value=25, discount_type=DiscountType.PERCENTAGE)
+
+  def test_list_and_detail(self):
+    response = self.client.get("/api/products/?fields=name,discounted_price,id")
+    self.assertEqual(response.data["results"], [{"id": self.product.id, "name": "Phone", "discounted_price": 75}])
+    response = self.client.get(f"/api/products/{self.product.id}?fields=price")
+    self.assertEqual(response.data, {"price": "100.00"})
+    # Each fieldset is cached on its own
+    response = self.client.get(f"/api/products/{self.product.id}")
+    self.assertEqual(response.data["name"], "Phone")
+
+  def test_export(self):
+    response = self.client.get("/api/products/export/?output=csv&fields=id,discounted_price")
+    rows = list(csv.reader(io.StringIO(b"".join(response.streaming_content).decode())))
+    self.assertEqual(rows, [["id", "discounted_price"], [str(self.product.id), "75.0000"]])
+
+  def test_unknown_field(self):
+    self.assertEqual(self.client.get("/api/products/?fields=id,cost").status_code, status.HTTP_400_BAD_REQUEST)
+    self.assertEqual(self.client.get(f"/api/products/{self.product.id}?fields=cost").status_code, status.HTTP_400_BAD_REQUEST)
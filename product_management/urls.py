@@ -1,6 +1,8 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductView, ProductDetailView, DiscountView, ApplyDiscountToProductView
+from . import campaigns, inventory
+from .async_views import AsyncCategoryListView, AsyncProductDetailView, AsyncProductView, ChangeFeedView
+from .views import CategoryViewSet, ProductView, ProductBulkView, ProductExportView, ProductSearchView, ProductDetailView, DiscountView, DiscountCampaignView, ApplyDiscountToProductView, ReservationView, ReservationDetailView, ReservationActionView
 
 router = DefaultRouter()
 router.register(r'categories', CategoryViewSet)
@@ -8,7 +10,20 @@ router.register(r'categories', CategoryViewSet)
 urlpatterns = [
   path('', include(router.urls)),
   path('products/', ProductView.as_view(), name='product-list'),
+  path('products/bulk/', ProductBulkView.as_view(), name='product-bulk'),
+  path('products/export/', ProductExportView.as_view(), name='product-export'),
+  path('products/search/', ProductSearchView.as_view(), name='product-search'),
   path('products/<int:pk>', ProductDetailView.as_view(), name='product-detail'),
   path('products/<int:product_id>/<int:discount_id>/', ApplyDiscountToProductView.as_view(), name='apply-discount-to-product'),
   path('discounts/', DiscountView.as_view(), name='discount-create'),
+  path('discounts/<int:pk>/apply/', DiscountCampaignView.as_view(operation=campaigns.apply), name='discount-apply'),
+  path('discounts/<int:pk>/unapply/', DiscountCampaignView.as_view(operation=campaigns.unapply), name='discount-unapply'),
+  path('reservations/', ReservationView.as_view(), name='reservation-create'),
+  path('reservations/<int:pk>', ReservationDetailView.as_view(), name='reservation-detail'),
+  path('reservations/<int:pk>/commit/', ReservationActionView.as_view(operation=inventory.commit), name='reservation-commit'),
+  path('reservations/<int:pk>/release/', ReservationActionView.as_view(operation=inventory.release), name='reservation-release'),
+  path('async/products/', AsyncProductView.as_view(), name='async-product-list'),
+  path('async/products/<int:pk>', AsyncProductDetailView.as_view(), name='async-product-detail'),
+  path('async/categories/', AsyncCategoryListView.as_view(), name='async-category-list'),
+  path('changes/', ChangeFeedView.as_view(), name='change-feed'),
 ]
\ No newline at end of file
@@ -1,22 +1,116 @@
+import csv
+from collections import defaultdict
+from itertools import islice
+from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from rest_framework import viewsets, status
+from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
-from .models import Category, Product, Discount
-from .serializers import CategorySerializer, ProductSerializer, DiscountSerializer
-from typing import List
+from django_filters.rest_framework import DjangoFilterBackend
+from .models import Category, Product, Discount, DiscountStatus, Reservation, category_children, path_range
+from .serializers import CategorySerializer, ProductSerializer, DiscountSerializer, DiscountCampaignSerializer, ReservationSerializer
+from .filters import ProductFilter, product_facets
+from .pagination import ProductPageNumberPagination, get_product_ordering, get_product_paginator
+from .product_rows import ProductRows, parse_fields
+from .renderers import dumps
+from . import caching, campaigns, idempotency, inventory, local_cache, search
+from .signals import products_bulk_changed
+from .conditional import cached_entry, category_state, conditional_get, conditional_response, product_state
 from drf_yasg.utils import swagger_auto_schema
 
+def parse_depth(params):
+  """Parse the optional `depth` query param limiting subcategory nesting"""
+  depth = params.get('depth')
+  if depth in (None, ''):
+    return None
+  try:
+    depth = int(depth)
+  except ValueError:
+    raise ValidationError({'depth': 'depth must be a non-negative integer.'})
+  if depth < 0:
+    raise ValidationError({'depth': 'depth must be a non-negative integer.'})
+  return depth
+
+
 class CategoryViewSet(viewsets.ModelViewSet):
-  queryset = Category.objects.all()
+  queryset = Category.objects.select_related('rollup')
   serializer_class = CategorySerializer
   pagination_class = None
-  
+  category_tree = None
+
+  def get_depth(self):
+    return parse_depth(self.request.query_params)
+
+  def get_serializer_context(self):
+    context = super().get_serializer_context()
+    context['depth'] = self.get_depth()
+    if self.category_tree is not None:
+      context['children'] = self.category_tree
+    return context
+
+  def list(self, request, *args, **kwargs):
+    queryset = self.filter_queryset(self.get_queryset())
+    return conditional_get(
+      request,
+      lambda: category_state(request, queryset),
+      lambda: self.build_list(queryset),
+    )
+
+  def build_list(self, queryset):
+    """List categories, building every nested subtree from a single query"""
+    request = self.request
+    categories = list(queryset)
+    self.category_tree = category_children(categories)
+
+    # `?tree=true` returns only the root categories with their subtrees nested
+    if request.query_params.get('tree') in ('true', '1'):
+      categories = self.category_tree.get(None, [])
+
+    serializer = self.get_serializer(categories, many=True)
+    return serializer.data
+
+  def retrieve(self, request, *args, **kwargs):
+    """Retrieve a category with its subtree fetched in one range query"""
+    category = self.get_object()
+    subtree = Category.objects.subtree(category, depth=self.get_depth()).select_related('rollup')
+    return conditional_get(
+      request,
+      lambda: category_state(request, subtree),
+      lambda: self.build_subtree(category, subtree),
+    )
+
+  def build_subtree(self, category, subtree):
+    self.category_tree = category_children(subtree)
+    serializer = self.get_serializer(category)
+    return serializer.data
+
+
+def filter_products(request, products):
+  """Apply the product filters shared by listings, exports and search"""
+  filterset = ProductFilter(request.query_params, queryset=products, request=request)
+  if not filterset.is_valid():
+    raise ValidationError(filterset.errors)
+  return filterset.qs
+
 
 class ProductView(GenericAPIView):
-  queryset = Product.objects.all()
+  queryset = Product.objects.with_active_discounts()
   serializer_class = ProductSerializer
+  filter_backends = [DjangoFilterBackend]
+  filterset_class = ProductFilter
+
+  @property
+  def paginator(self):
+    """Keyset pagination unless page numbers are asked for with `?pagination=page`"""
+    if not hasattr(self, '_paginator'):
+      self._paginator = get_product_paginator(getattr(self, 'request', None))
+    return self._paginator
 
   def post(self, request):
     serializer = ProductSerializer(data=request.data)
@@ -26,30 +120,270 @@ class ProductView(GenericAPIView):
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
   
   def get(self, request):
-    products: List[Product] = Product.objects.all()
-
-    # Filter by category
-    category_id = request.query_params.get('category')
-    if category_id:
-      products = products.filter(category__id=category_id)
-
-    paginator = self.paginate_queryset(products)
-    if paginator is not None:
-      serializer = ProductSerializer(paginator, many=True)
-      return self.get_paginated_response(serializer.data)
-    
-    serializer = ProductSerializer(products, many=True)
-    return Response(serializer.data)
+    products = self.filter_queryset(self.get_queryset())
+    return conditional_get(
+      request,
+      lambda: product_state(request, products),
+      lambda: self.list_products(products),
+      cache_key=caching.product_list_key(request),
+    )
+
+  def list_products(self, products):
+    """Build the (paginated) product listing payload for the current request"""
+    ordering = get_product_ordering(self.request)
+    products = products.order_by(*ordering)
+    # Read only the needed columns; the cursor is built from the ordering ones
+    renderer = ProductRows(parse_fields(self.request.query_params))
+    rows = renderer.rows(products, *ordering)
+
+    page = self.paginate_queryset(rows)
+    if page is not None:
+      data = self.get_paginated_response(renderer.render(page)).data
+      if self.request.query_params.get('facets') in ('true', '1'):
+        data['facets'] = product_facets(products)
+      return data
+
+    return renderer.render(rows)
   
+def is_id(value):
+  """Whether a JSON value is a primary key: an int, but not a bool"""
+  return isinstance(value, int) and not isinstance(value, bool)
+
+
+
+class ProductBulkView(APIView):
+  """ Create, update or delete many products in a single transaction """
+
+  def get_batch_size(self, request):
+    batch_size = request.query_params.get('batch_size', settings.PRODUCT_BULK_BATCH_SIZE)
+    try:
+      batch_size = int(batch_size)
+    except (TypeError, ValueError):
+      raise ValidationError({'batch_size': 'batch_size must be a positive integer.'})
+    if batch_size < 1:
+      raise ValidationError({'batch_size': 'batch_size must be a positive integer.'})
+    return min(batch_size, settings.PRODUCT_BULK_MAX_ROWS)
+
+  def get_rows(self, request):
+    rows = request.data
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+      raise ValidationError({'error': 'Expected a list of products.'})
+    if len(rows) > settings.PRODUCT_BULK_MAX_ROWS:
+      raise ValidationError({'error': f'At most {settings.PRODUCT_BULK_MAX_ROWS} products can be sent at once.'})
+    return rows
+
+  def get_context(self, rows):
+    """Resolve every category referenced by `rows` with a single IN query"""
+    category_ids = set()
+    for row in rows:
+      try:
+        category_ids.add(int(row['category']))
+      except (KeyError, TypeError, ValueError):
+        pass
+    return {'request': self.request, 'categories': Category.objects.in_bulk(category_ids)}
+
+  def report(self, results, action):
+    succeeded = sum(1 for result in results if result['status'] == action)
+    return Response({
+      action: succeeded,
+      'failed': len(results) - succeeded,
+      'results': results,
+    }, status=status.HTTP_200_OK)
+
+  @swagger_auto_schema(
+        operation_description="Create many products, reporting success or errors per row",
+        request_body=ProductSerializer(many=True),
+    )
+  def post(self, request):
+    rows = self.get_rows(request)
+    context = self.get_context(rows)
+    batch_size = self.get_batch_size(request)
+
+    results, products = [], []
+    for index, row in enumerate(rows):
+      serializer = ProductSerializer(data=row, context=context)
+      if serializer.is_valid():
+        products.append((index, Product(**serializer.validated_data)))
+      else:
+        results.append({'index': index, 'status': 'error', 'errors': serializer.errors})
+
+    with transaction.atomic():
+      Product.objects.bulk_create([product for _, product in products], batch_size=batch_size)
+      products_bulk_changed.send(sender=Product, product_ids=[product.id for _, product in products], action='create')
+
+    results.extend({'index': index, 'status': 'created', 'id': product.id} for index, product in products)
+    results.sort(key=lambda result: result['index'])
+    return self.report(results, 'created')
+
+  @swagger_auto_schema(
+        operation_description="Partially update many products, each row must include its `id`",
+        request_body=ProductSerializer(many=True),
+    )
+  def patch(self, request):
+    rows = self.get_rows(request)
+    context = self.get_context(rows)
+    batch_size = self.get_batch_size(request)
+    existing = Product.objects.in_bulk([row['id'] for row in rows if is_id(row.get('id'))])
+
+    results, products, fields = [], {}, defaultdict(set)
+    category_ids = {product.category_id for product in existing.values()}
+    for index, row in enumerate(rows):
+      product = existing.get(row['id']) if is_id(row.get('id')) else None
+      if product is None:
+        results.append({'index': index, 'status': 'error', 'errors': {'id': [f'Product with id - {row.get("id")} not found']}})
+        continue
+      serializer = ProductSerializer(product, data=row, partial=True, context=context)
+      if not serializer.is_valid():
+        results.append({'index': index, 'status': 'error', 'errors': serializer.errors})
+        continue
+      for field, value in serializer.validated_data.items():
+        setattr(product, field, value)
+      fields[product.id].update(serializer.validated_data)
+      products[product.id] = product
+      results.append({'index': index, 'status': 'updated', 'id': product.id})
+
+    if products:
+      # bulk_update bypasses save(), so auto_now has to be applied by hand
+      now = timezone.now()
+      for product in products.values():
+        product.updated_at = now
+      # Each row only writes the fields it changed: writing the union would put
+      # back the stale values read above over concurrent changes, e.g. to stock
+      groups = defaultdict(list)
+      for pk, product in products.items():
+        groups[tuple(sorted(fields[pk] | {'updated_at'}))].append(product)
+      with transaction.atomic():
+        for group_fields, group in groups.items():
+          Product.objects.bulk_update(group, group_fields, batch_size=batch_size)
+        products_bulk_changed.send(
+          sender=Product, product_ids=list(products), action='update', category_ids=category_ids
+        )
+
+    return self.report(results, 'updated')
+
+  def delete(self, request):
+    ids = request.data.get('ids') if isinstance(request.data, dict) else None
+    if not isinstance(ids, list) or not all(is_id(pk) for pk in ids):
+      raise ValidationError({'ids': 'Expected a list of product ids.'})
+
+    with transaction.atomic():
+      found = set(Product.objects.filter(id__in=ids).values_list('id', flat=True))
+      Product.objects.filter(id__in=found).delete()
+
+    results = [
+      {'index': index, 'status': 'deleted', 'id': pk} if pk in found
+      else {'index': index, 'status': 'error', 'errors': {'id': [f'Product with id - {pk} not found']}}
+      for index, pk in enumerate(ids)
+    ]
+    return self.report(results, 'deleted')
+
+
+class Echo:
+  """File-like object handing each written CSV line back to the caller"""
+
+  def write(self, value):
+    return value
+
+
+class ProductExportView(APIView):
+  """ Stream the whole (filtered) catalog as NDJSON or CSV """
+
+  content_types = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+  }
+
+  def get(self, request):
+    output = request.query_params.get('output', 'ndjson')
+    if output not in self.content_types:
+      raise ValidationError({'output': f'output must be one of: {", ".join(self.content_types)}.'})
+
+    renderer = ProductRows(parse_fields(request.query_params))
+    products = filter_products(request, Product.objects.all())
+    updated_since = request.query_params.get('updated_since')
+    if updated_since:
+      updated_since = parse_datetime(updated_since)
+      if updated_since is None:
+        raise ValidationError({'updated_since': 'updated_since must be an ISO 8601 datetime.'})
+      if timezone.is_naive(updated_since):
+        updated_since = timezone.make_aware(updated_since)
+      products = products.filter(updated_at__gte=updated_since)
+
+    # iterator() streams rows from the database cursor chunk by chunk (each
+    # chunk priced with one discount query), so memory doesn't grow with the catalog
+    chunk_size = settings.PRODUCT_EXPORT_CHUNK_SIZE
+    rows = self.serialize(renderer, renderer.rows(products.order_by('id')).iterator(chunk_size=chunk_size), chunk_size)
+    lines = self.csv_lines(renderer.fields, rows) if output == 'csv' else self.ndjson_lines(rows)
+
+    response = StreamingHttpResponse(lines, content_type=self.content_types[output])
+    response['Content-Disposition'] = f'attachment; filename="products.{output}"'
+    return response
+
+  def serialize(self, renderer, rows, chunk_size):
+    for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+      yield from renderer.render(chunk)
+
+  def ndjson_lines(self, rows):
+    for row in rows:
+      yield dumps(row) + b'\n'
+
+  def csv_lines(self, fields, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(fields)
+    for row in rows:
+      yield writer.writerow(row.values())
+
+
+class ProductSearchView(GenericAPIView):
+  """ Ranked full-text search over product names and descriptions, with facets """
+  queryset = Product.objects.with_active_discounts()
+  serializer_class = ProductSerializer
+  pagination_class = ProductPageNumberPagination
+
+  def get(self, request):
+    terms = search.query_terms(request.query_params.get('q', ''))
+    if not terms:
+      raise ValidationError({'q': 'A search query is required.'})
+
+    products = filter_products(request, self.get_queryset())
+
+    # Every word must match, as a prefix, best matches first
+    backend = search.get_backend()
+    page = self.paginate_queryset(backend.rank(products, terms).order_by('-score', 'id'))
+    response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+    response.data['facets'] = product_facets(backend.filter(products, terms))
+    return response
+
+
 class ProductDetailView(APIView):
   def get(self, request, pk, *args, **kwargs):
+    fields = parse_fields(request.query_params)
+    get_state = lambda: product_state(request, Product.objects.filter(id=pk))
+    build_data = lambda: self.retrieve_product(pk, fields)
+    revalidating = 'HTTP_IF_NONE_MATCH' in request.META or 'HTTP_IF_MODIFIED_SINCE' in request.META
+    # The shared version is part of the local key, so a write invalidating
+    # the product in any process also makes this process's copy unreachable
+    version = caching.product_version(pk)
+    cache_key = caching.product_detail_key(pk, fields, version)
     try:
-      product = Product.objects.get(id=pk)
+      if revalidating and (pk, fields, version) not in local_cache.product_details:
+        # Only build the payload if the client's copy turns out stale
+        return conditional_get(request, get_state, build_data, cache_key=cache_key)
+      # Hot products are served from process memory, and concurrent misses
+      # for one product share a single load
+      state, data = local_cache.product_details.get_or_load(
+        (pk, fields, version), lambda: cached_entry(cache_key, get_state, build_data)
+      )
     except Product.DoesNotExist:
       return Response({ 'error': f'Product with id - {pk} not found'}, status=status.HTTP_404_NOT_FOUND)
-    
-    serializer = ProductSerializer(product)
-    return Response(serializer.data)
+    return conditional_response(request, state, data)
+
+  def retrieve_product(self, pk, fields):
+    renderer = ProductRows(fields)
+    products = renderer.render(renderer.rows(Product.objects.filter(id=pk)))
+    if not products:
+      raise Product.DoesNotExist
+    return products[0]
   
 
 class DiscountView(APIView):
@@ -72,11 +406,16 @@ class ApplyDiscountToProductView(APIView):
   """ Apply an existing discount to a product """
   def post(self, request, product_id, discount_id):
     try:
-      product = Product.objects.get(id=product_id)
+      product = Product.objects.with_active_discounts().get(id=product_id)
 
       discount = Discount.objects.get(id=discount_id)
 
-      product.discounts.add(discount)
+      # Save the discount (bulk=False) so its post_save signal reprices and
+      # invalidates both this product and the one it was moved from
+      product.discounts.add(discount, bulk=False)
+      # Keep the prefetched discounts in sync instead of re-querying them
+      if discount.status == DiscountStatus.ACTIVE and discount not in product.active_discounts:
+        product.active_discounts.append(discount)
 
       # Apply the discount
       discounted_price = discount.apply_discount(product.price)
@@ -92,4 +431,108 @@ class ApplyDiscountToProductView(APIView):
         return Response({"error": "Product not found."}, status=status.HTTP_404_NOT_FOUND)
 
     except Discount.DoesNotExist:
-        return Response({"error": "Discount not found."}, status=status.HTTP_404_NOT_FOUND)
\ No newline at end of file
+        return Response({"error": "Discount not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
+class DiscountCampaignView(APIView):
+  """ Apply a discount to, or remove it from, many products at once """
+
+  # `campaigns.apply` or `campaigns.unapply`, set in the URL conf
+  operation = None
+
+  def get_products(self, data):
+    if 'products' in data:
+      return Product.objects.filter(id__in=set(data['products']))
+    if not data['include_descendants']:
+      return Product.objects.filter(category_id=data['category'])
+    category = Category.objects.filter(id=data['category']).first()
+    if category is None:
+      return Product.objects.none()
+    lower, upper = path_range(category.path)
+    return Product.objects.filter(category__path__gte=lower, category__path__lt=upper)
+
+  @swagger_auto_schema(
+        operation_description="Apply or unapply a discount on a list of products or a category, "
+                              "returning their discounted prices. Retries sending the same "
+                              "Idempotency-Key header get the first response back.",
+        request_body=DiscountCampaignSerializer,
+        responses={
+            200: 'Changed products and discounted prices',
+            404: 'Not Found - Unknown discount',
+            409: 'Conflict - Expired discount',
+            422: 'Unprocessable - Idempotency-Key reused for another request',
+        }
+    )
+  def post(self, request, pk):
+    return idempotency.idempotent(request, 'discount-campaign', lambda: self.run(request, pk))
+
+  def run(self, request, pk):
+    try:
+      discount = campaigns.campaign_template(Discount.objects.select_related('template').get(id=pk))
+    except Discount.DoesNotExist:
+      return Response({"error": "Discount not found."}, status=status.HTTP_404_NOT_FOUND)
+    serializer = DiscountCampaignSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    products = self.get_products(serializer.validated_data)
+    try:
+      changed = self.operation(discount, products)
+    except campaigns.CampaignError as error:
+      return Response({'error': str(error)}, status=status.HTTP_409_CONFLICT)
+
+    rows = ProductRows(('id', 'discounted_price'))
+    prices = rows.render(rows.rows(products.order_by('id')))
+    data = {'discount': discount.id, 'changed': changed, 'prices': prices}
+    if 'products' in serializer.validated_data:
+      found = {price['id'] for price in prices}
+      data['not_found'] = sorted(set(serializer.validated_data['products']) - found)
+    return Response(data)
+
+
+class ReservationView(APIView):
+  """ Reserve stock of one or more products for a checkout """
+
+  @swagger_auto_schema(
+        operation_description="Reserve every item or none, holding the stock until the reservation expires",
+        request_body=ReservationSerializer,
+        responses={
+            201: ReservationSerializer,
+            404: 'Not Found - Unknown product',
+            409: 'Conflict - Not enough stock',
+        }
+    )
+  def post(self, request):
+    serializer = ReservationSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    items = [(item['product'], item['quantity']) for item in serializer.validated_data['items']]
+    try:
+      reservation = inventory.reserve(items, ttl=serializer.validated_data.get('ttl'))
+    except Product.DoesNotExist as error:
+      return Response({'error': str(error)}, status=status.HTTP_404_NOT_FOUND)
+    except inventory.InsufficientStock as error:
+      return Response({'error': str(error), 'product': error.product_id}, status=status.HTTP_409_CONFLICT)
+    return Response(ReservationSerializer(reservation).data, status=status.HTTP_201_CREATED)
+
+
+class ReservationDetailView(APIView):
+  def get(self, request, pk):
+    try:
+      reservation = Reservation.objects.prefetch_related('items').get(id=pk)
+    except Reservation.DoesNotExist:
+      return Response({'error': f'Reservation with id - {pk} not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(ReservationSerializer(reservation).data)
+
+
+class ReservationActionView(APIView):
+  """ Commit or release a pending reservation """
+
+  # `inventory.commit` or `inventory.release`, set in the URL conf
+  operation = None
+
+  def post(self, request, pk):
+    try:
+      reservation = self.operation(pk)
+    except Reservation.DoesNotExist:
+      return Response({'error': f'Reservation with id - {pk} not found'}, status=status.HTTP_404_NOT_FOUND)
+    except inventory.ReservationError as error:
+      return Response({'error': str(error)}, status=status.HTTP_409_CONFLICT)
+    return Response(ReservationSerializer(reservation).data)